@@ -0,0 +1,229 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extras
+
+import json_backend
+from db_pool import PoolTimeout
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+INSERT_ACTIVITIES_SQL = 'INSERT INTO activities (user_id, activity_type, points, details, created_at) VALUES %s'
+
+# created_at بساعة الخادم نفسها التي يستخدمها الوضع المتزامن (CURRENT_TIMESTAMP بالتوقيت المحلي للجلسة)
+# مطروحًا منها عمر النشاط في الطابور، فيبقى الترتيب وتوجيه الأقسام الشهرية متسقًا بين الوضعين
+INSERT_ACTIVITIES_TEMPLATE = '(%s, %s, %s, %s, LOCALTIMESTAMP - make_interval(secs => %s))'
+
+# أخطاء الاتصال وانتظار التجمع عابرة: تُعاد الدفعة كما هي دون عزل صفوفها
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout)
+
+
+class ActivityWriter:
+    """كاتب سجل النشاطات: داخل معاملة العملية الأصلية (sync) أو عبر طابور يُفرَّغ على دفعات (buffered)"""
+
+    def __init__(self, connection_factory, mode="sync", batch_size=500,
+                 flush_interval=1.0, max_queue=50000, max_retries=3):
+        if mode not in ("sync", "buffered"):
+            raise ValueError(f"وضع كاتب النشاطات غير معروف: {mode}")
+
+        self._connection_factory = connection_factory
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        # محاولات الكتابة الفاشلة المتتالية لدفعة مقدمة الطابور
+        self._attempts = 0
+
+        # عدادات المقاييس
+        self._enqueued = 0
+        self._written = 0
+        self._flushes = 0
+        self._failures = 0
+        self._overflows = 0
+        self._dropped = 0
+        self._flush_time = 0.0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+
+    @property
+    def buffered(self):
+        """هل تُؤجل كتابة النشاطات إلى الطابور"""
+        return self.mode == "buffered"
+
+    def _ensure_started(self):
+        """تشغيل ثريد التفريغ مرة واحدة لكل عملية"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="activity-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def enqueue(self, user_id, activity_type, points, details=None):
+        """إضافة نشاط إلى الطابور؛ يعيد False إذا كان الطابور ممتلئًا ليكتبه المستدعي مباشرة"""
+        self._ensure_started()
+        enqueued_at = time.monotonic()
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self._overflows += 1
+                return False
+            self._queue.append((user_id, activity_type, points, details or {}, enqueued_at))
+            self._enqueued += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _run(self):
+        """حلقة ثريد التفريغ: عند بلوغ حجم الدفعة أو انقضاء الفاصل الزمني"""
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def _write(self, batch):
+        """إدراج دفعة بعبارة واحدة متعددة الصفوف في معاملة واحدة"""
+        now = time.monotonic()
+        rows = [
+            (user_id, activity_type, points, json_backend.dumps(details), now - enqueued_at)
+            for user_id, activity_type, points, details, enqueued_at in batch
+        ]
+        with self._connection_factory() as conn:
+            with conn.cursor() as cursor:
+                psycopg2.extras.execute_values(
+                    cursor, INSERT_ACTIVITIES_SQL, rows,
+                    template=INSERT_ACTIVITIES_TEMPLATE, page_size=self.batch_size
+                )
+
+    def _isolate(self, batch):
+        """كتابة الدفعة بتنصيفها حتى تنعزل الصفوف المرفوضة فتُسقط وحدها
+
+        يعيد (عدد المكتوب، الصفوف غير المكتوبة بسبب خطأ عابر لتعاد إلى الطابور).
+        """
+        try:
+            self._write(batch)
+            return len(batch), []
+        except TRANSIENT_ERRORS:
+            return 0, batch
+        except Exception as e:
+            if len(batch) > 1:
+                return self._bisect(batch)
+            user_id, activity_type, points, details, _ = batch[0]
+            logger.error(
+                f"إسقاط نشاط ترفضه قاعدة البيانات: المستخدم {user_id}، النوع {activity_type}، "
+                f"النقاط {points}، التفاصيل {json_backend.dumps(details)}: {e}"
+            )
+            with self._cond:
+                self._dropped += 1
+            return 0, []
+
+    def _bisect(self, batch):
+        """عزل الصفوف المرفوضة في نصفي الدفعة"""
+        middle = len(batch) // 2
+        written, remaining = self._isolate(batch[:middle])
+        if remaining:
+            return written, remaining + batch[middle:]
+        second_written, remaining = self._isolate(batch[middle:])
+        return written + second_written, remaining
+
+    def flush(self):
+        """كتابة كل النشاطات المعلقة في الطابور بإدراج متعدد الصفوف
+
+        الدفعة الفاشلة تُعاد إلى مقدمة الطابور، وبعد max_retries محاولة متتالية (لخطأ غير عابر)
+        تُنصف حتى تنعزل الصفوف المرفوضة فتُسقط مع تسجيلها، فلا يوقف صف واحد سيئ الكاتب كله.
+        """
+        with self._flush_lock:
+            written = 0
+            while True:
+                with self._cond:
+                    if not self._queue:
+                        return written
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+                start = time.monotonic()
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.error(f"خطأ في كتابة دفعة النشاطات ({len(batch)} نشاط): {e}")
+                    with self._cond:
+                        self._failures += 1
+                        self._attempts += 1
+                        isolate = self._attempts >= self.max_retries and not isinstance(e, TRANSIENT_ERRORS)
+                    remaining = batch
+                    if isolate:
+                        isolated, remaining = self._bisect(batch)
+                        written += isolated
+                        with self._cond:
+                            self._written += isolated
+                            if not remaining:
+                                self._attempts = 0
+                    if remaining:
+                        with self._cond:
+                            # إعادة ما لم يُكتب إلى مقدمة الطابور لمحاولة لاحقة
+                            self._queue.extendleft(reversed(remaining))
+                        return written
+                    continue
+
+                elapsed_ms = (time.monotonic() - start) * 1000
+                with self._cond:
+                    self._attempts = 0
+                    self._written += len(batch)
+                    self._flushes += 1
+                    self._flush_time += elapsed_ms
+                    self._last_flush_ms = elapsed_ms
+                    self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+                written += len(batch)
+
+    def stop(self):
+        """إيقاف ثريد التفريغ بعد كتابة ما تبقى في الطابور"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        thread.join(timeout=30)
+        self._thread = None
+        remaining = self.flush()
+        if self._queue:
+            logger.error(f"تعذر كتابة {len(self._queue)} نشاط عند الإيقاف")
+        elif remaining:
+            logger.info(f"تمت كتابة {remaining} نشاط معلق عند الإيقاف")
+
+    def stats(self):
+        """مقاييس الطابور وزمن التفريغ"""
+        with self._cond:
+            return {
+                "mode": self.mode,
+                "queue_depth": len(self._queue),
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "flushes": self._flushes,
+                "failures": self._failures,
+                "overflows": self._overflows,
+                "dropped": self._dropped,
+                "last_flush_ms": self._last_flush_ms,
+                "max_flush_ms": self._max_flush_ms,
+                "avg_flush_ms": (self._flush_time / self._flushes) if self._flushes else 0.0,
+            }
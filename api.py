@@ -1,18 +1,34 @@
+import asyncio
+import hmac
 import logging
-import time
-import os
-import json
+import math
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from database import (
-    get_user, daily_claim, get_referrals, 
-    get_user_activities, get_leaderboard, request_withdrawal,
-    social_media_visit, get_social_media_visits
+from async_database import (
+    get_user_dashboard, daily_claim,
+    get_user_activities_page, iter_user_activities, get_user_activity_summary, get_leaderboard,
+    get_referral_tree, get_top_referrers, request_withdrawal,
+    social_media_visit, get_user_rank,
+    init_async_pool, close_async_pool, load_leaderboard
+)
+from database import activity_writer, live_hub
+from rate_limit import rate_limiter
+from http_cache import StaticAssets, ConditionalJSONMiddleware, FastJSONResponse
+from metrics import registry, HTTPMetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from schemas import (
+    UserResponse, LeaderboardResponse, ActivitiesPage, BootstrapResponse, RankResponse, ActivitySummary,
+    ReferralTree, TopReferrersResponse
+)
+import json_backend
+from fastapi.concurrency import run_in_threadpool
+from config import (
+    SOCIAL_MEDIA_LINKS, ACTIVITIES_MAX_PAGE_SIZE, BOT_MODE, WEBHOOK_SECRET, API_HOST, API_PORT,
+    TRUST_PROXY_HEADERS, IDEMPOTENCY_KEY_MAX_LENGTH, METRICS_ENABLED, METRICS_TOKEN,
+    ACTIVITY_SUMMARY_MAX_DAYS, LIVE_HEARTBEAT_SECONDS, API_SHUTDOWN_TIMEOUT, REFERRAL_TREE_MAX_DEPTH,
+    REFERRAL_TOP_MAX_HOURS
 )
-from config import SOCIAL_MEDIA_LINKS
 
 # إعداد السجلات
 logging.basicConfig(
@@ -25,7 +41,9 @@ logger = logging.getLogger(__name__)
 api = FastAPI(
     title="نظام نقاط Forex Fabric",
     description="واجهة برمجة التطبيقات لنظام النقاط والإحالات",
-    version="1.0.0"
+    version="1.0.0",
+    # تسلسل الاستجابات بواجهة JSON السريعة (orjson إن توفر)
+    default_response_class=FastJSONResponse
 )
 
 # إضافة ميدلوير CORS للسماح بالطلبات من مصادر مختلفة
@@ -37,63 +55,125 @@ api.add_middleware(
     allow_headers=["*"],
 )
 
-# تحميل الملفات الثابتة لتطبيق الويب
-api.mount("/static", StaticFiles(directory="static"), name="static")
+# ETag و 304 وضغط gzip لاستجابات JSON في مسارات /api/
+api.add_middleware(ConditionalJSONMiddleware)
+
+# زمن كل طلب وعدد الاستجابات لكل مسار ورمز حالة (الميدلوير الخارجي ليشمل زمن الضغط)
+if METRICS_ENABLED:
+    api.add_middleware(HTTPMetricsMiddleware, exclude_prefixes=("/api/live/",))
+
+@api.on_event("startup")
+async def startup():
+    """تهيئة الملفات الثابتة وتجمع الاتصالات غير المتزامن ولوحة المتصدرين في الذاكرة عند بدء الخادم"""
+    static_assets.build()
+    await init_async_pool()
+    await load_leaderboard()
+    await live_hub.start()
+    
+    # في وضع الـ webhook يعمل البوت داخل عملية خادم API
+    if BOT_MODE == "webhook":
+        from bot import start_webhook_bot
+        await run_in_threadpool(start_webhook_bot)
+
+@api.on_event("shutdown")
+async def shutdown():
+    """تفريغ النشاطات المعلقة وإغلاق تجمع الاتصالات غير المتزامن عند إيقاف الخادم"""
+    if BOT_MODE == "webhook":
+        from bot import stop_webhook_bot
+        await run_in_threadpool(stop_webhook_bot)
+    await live_hub.stop()
+    activity_writer.stop()
+    await close_async_pool()
+
+# ملفات تطبيق الويب الثابتة: بصمات في العناوين وضغط مسبق عند بدء التشغيل
+static_assets = StaticAssets("static")
+
+def client_ip(request: Request):
+    """عنوان العميل، من X-Forwarded-For عند الثقة بالوكيل العكسي"""
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+def enforce_rate_limit(request: Request, action, user_id):
+    """رفض الطلب برمز 429 قبل الوصول إلى قاعدة البيانات عند تجاوز المعدل"""
+    allowed, retry_after = rate_limiter.check(action, user_id=user_id, ip=client_ip(request))
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="طلبات كثيرة، يرجى المحاولة لاحقًا",
+            headers={"Retry-After": str(max(1, math.ceil(min(retry_after, 3600))))}
+        )
 
 @api.get("/")
-async def root():
+async def root(request: Request):
     """تقديم صفحة تطبيق الويب الرئيسية"""
-    return FileResponse("static/index.html")
+    return static_assets.index_response(request)
+
+@api.get("/static/{path:path}")
+async def static_file(path: str, request: Request):
+    """تقديم ملف ثابت من الذاكرة بأفضل ترميز ضغط يقبله العميل"""
+    return static_assets.asset_response(path, request)
+
+@api.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """مقاييس هذه العملية بصيغة Prometheus"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="غير مصرح")
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
 
-@api.get("/api/user/{user_id}")
+def format_user(user_id, dashboard):
+    """تنسيق بيانات لوحة المستخدم للعرض"""
+    last_claim = dashboard["last_claim_time"]
+    username = dashboard["username"]
+    full_name = dashboard["full_name"]
+    return {
+        "user_id": user_id,
+        "username": username,
+        "full_name": full_name if full_name else username,
+        "points": dashboard["points"],
+        "total_points": dashboard["total_points"],
+        "last_claim_time": last_claim.isoformat() if last_claim else None,
+        "referrals_count": dashboard["referrals_count"],
+        "can_claim": dashboard["can_claim"],
+        "next_claim_time": dashboard["next_claim_time"],
+        "visited_socials": dashboard["visited_socials"],
+        "social_links": SOCIAL_MEDIA_LINKS
+    }
+
+@api.get("/api/user/{user_id}", response_model=UserResponse)
 async def get_user_data(user_id: int):
     """الحصول على بيانات المستخدم بما في ذلك النقاط ووقت آخر مطالبة"""
     try:
-        # الحصول على بيانات المستخدم الأساسية
-        user_data = get_user(user_id)
+        # استعلام واحد للقراءة فقط: بيانات المستخدم والإحالات وأهلية المطالبة والزيارات
+        dashboard = await get_user_dashboard(user_id)
         
-        if not user_data:
+        if not dashboard:
             raise HTTPException(status_code=404, detail="المستخدم غير موجود")
             
-        points, total_points, last_claim, username, full_name = user_data
-        
-        # الحصول على عدد الإحالات
-        referrals_count = get_referrals(user_id)
-        
-        # التحقق من إمكانية المطالبة اليومية
-        can_claim, claim_info = daily_claim(user_id)
-        can_claim_status = can_claim
-        
-        # تحديد وقت المطالبة القادمة
-        next_claim_time = 0
-        if not can_claim and isinstance(claim_info, int):
-            next_claim_time = claim_info
-            
-        # الحصول على المواقع الاجتماعية التي تمت زيارتها
-        visited_socials = get_social_media_visits(user_id)
-            
-        return {
-            "user_id": user_id,
-            "username": username,
-            "full_name": full_name if full_name else username,
-            "points": points,
-            "total_points": total_points,
-            "last_claim_time": last_claim.isoformat() if last_claim else None,
-            "referrals_count": referrals_count,
-            "can_claim": can_claim_status,
-            "next_claim_time": next_claim_time,
-            "visited_socials": visited_socials,
-            "social_links": SOCIAL_MEDIA_LINKS
-        }
+        return format_user(user_id, dashboard)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"خطأ في الحصول على بيانات المستخدم: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def with_activities(response, user_id, activities_limit):
+    """إرفاق أحدث أنشطة المستخدم بنتيجة عملية ناجحة عند طلبها (activities_limit > 0)"""
+    # في وضع الكتابة على دفعات قد لا يكون النشاط الجديد قد كُتب بعد، فيجلبه العميل لاحقًا
+    if activities_limit > 0 and not activity_writer.buffered:
+        response.update(await activities_page(user_id, min(activities_limit, ACTIVITIES_MAX_PAGE_SIZE)))
+    return response
+
 @api.post("/api/daily_claim/{user_id}")
-async def daily_claim_endpoint(user_id: int):
+async def daily_claim_endpoint(user_id: int, request: Request, activities_limit: int = 0):
     """معالجة المطالبة اليومية من تطبيق الويب"""
+    enforce_rate_limit(request, "daily_claim", user_id)
     try:
-        result, data = daily_claim(user_id)
+        result, data = await daily_claim(user_id)
         
         if result is None:
             raise HTTPException(status_code=404, detail="المستخدم غير موجود")
@@ -116,20 +196,23 @@ async def daily_claim_endpoint(user_id: int):
         total_points = data['total_points']
         points_added = data['points_added']
         
-        return {
+        return await with_activities({
             "success": True,
             "message": f"تمت إضافة {points_added} نقطة بنجاح!",
             "points": points,
             "total_points": total_points,
             "points_added": points_added
-        }
+        }, user_id, activities_limit)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"خطأ في معالجة المطالبة اليومية: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api.post("/api/social_visit/{user_id}")
-async def social_media_visit_endpoint(user_id: int, request: Request):
+async def social_media_visit_endpoint(user_id: int, request: Request, activities_limit: int = 0):
     """تسجيل زيارة لموقع تواصل اجتماعي"""
+    enforce_rate_limit(request, "social_visit", user_id)
     try:
         data = await request.json()
         social_type = data.get("social_type")
@@ -137,7 +220,7 @@ async def social_media_visit_endpoint(user_id: int, request: Request):
         if not social_type or social_type not in SOCIAL_MEDIA_LINKS:
             raise HTTPException(status_code=400, detail="نوع موقع التواصل الاجتماعي غير صالح")
             
-        result, data = social_media_visit(user_id, social_type)
+        result, data = await social_media_visit(user_id, social_type)
         
         if not result:
             return {
@@ -150,74 +233,197 @@ async def social_media_visit_endpoint(user_id: int, request: Request):
         total_points = data['total_points']
         points_added = data['points_added']
         
-        return {
+        return await with_activities({
             "success": True,
             "message": f"تمت إضافة {points_added} نقطة بنجاح لزيارة {social_type}!",
             "points": points,
             "total_points": total_points,
             "points_added": points_added
-        }
+        }, user_id, activities_limit)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"خطأ في تسجيل زيارة موقع تواصل اجتماعي: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api.get("/api/activities/{user_id}")
-async def get_activities_endpoint(user_id: int, limit: int = 10):
-    """الحصول على قائمة بالأنشطة السابقة للمستخدم"""
-    try:
-        activities = get_user_activities(user_id, limit)
+def format_activity(activity):
+    """تنسيق صف نشاط للعرض (التفاصيل تصل كقاموس من عمود JSONB مباشرة)"""
+    activity_id, activity_type, points, created_at, details = activity
+    return {
+        "id": activity_id,
+        "activity_type": activity_type,
+        "points": points,
+        "created_at": created_at.isoformat(),
+        "details": details or {}
+    }
+
+async def activities_page(user_id, limit, cursor=None):
+    """صفحة أنشطة منسقة مع مؤشر الصفحة التالية"""
+    activities, next_cursor = await get_user_activities_page(user_id, limit, cursor)
+    return {
+        "activities": [format_activity(activity) for activity in activities],
+        "next_cursor": next_cursor
+    }
+
+def check_activities_limit(limit):
+    """التحقق من حجم صفحة الأنشطة المطلوب"""
+    if limit <= 0 or limit > ACTIVITIES_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"يجب أن يكون الحد بين 1 و {ACTIVITIES_MAX_PAGE_SIZE}")
+
+@api.get("/api/activities/{user_id}", response_model=ActivitiesPage)
+async def get_activities_endpoint(user_id: int, limit: int = 10, cursor: str = None):
+    """الحصول على صفحة من الأنشطة السابقة للمستخدم مع مؤشر الصفحة التالية"""
+    check_activities_limit(limit)
         
-        # تنسيق البيانات للعرض
-        formatted_activities = []
-        for activity in activities:
-            activity_type, points, created_at, details = activity
-            
-            # محاولة تحليل التفاصيل كـ JSON
-            try:
-                if isinstance(details, str):
-                    details_dict = json.loads(details)
-                else:
-                    details_dict = details
-            except:
-                details_dict = {}
-                
-            formatted_activities.append({
-                "activity_type": activity_type,
-                "points": points,
-                "created_at": created_at.isoformat(),
-                "details": details_dict
-            })
-            
-        return {"activities": formatted_activities}
+    try:
+        return await activities_page(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"خطأ في الحصول على أنشطة المستخدم: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api.get("/api/leaderboard")
+@api.get("/api/activities/{user_id}/export")
+async def export_activities_endpoint(user_id: int):
+    """تصدير كامل سجل أنشطة المستخدم بصيغة NDJSON (سطر JSON لكل نشاط) دون تحميله في الذاكرة"""
+    async def generate():
+        async for activity in iter_user_activities(user_id):
+            yield json_backend.dumps_bytes(format_activity(activity)) + b"\n"
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="activities_{user_id}.ndjson"'}
+    )
+
+@api.get("/api/activities/{user_id}/summary", response_model=ActivitySummary)
+async def get_activity_summary_endpoint(user_id: int, days: int = 30):
+    """ملخص نشاطات المستخدم ونقاطه حسب النوع لآخر عدد من الأيام"""
+    if not 1 <= days <= ACTIVITY_SUMMARY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"عدد الأيام يجب أن يكون بين 1 و {ACTIVITY_SUMMARY_MAX_DAYS}")
+
+    summary = await get_user_activity_summary(user_id, days)
+    if summary is None:
+        raise HTTPException(status_code=500, detail="تعذر حساب ملخص الأنشطة")
+    return summary
+
+def format_leaderboard(leaderboard_data):
+    """تنسيق صفوف لوحة المتصدرين للعرض"""
+    return [
+        {
+            "user_id": user_id,
+            "username": username,
+            "points": points,
+            "total_points": total_points
+        }
+        for user_id, username, points, total_points in leaderboard_data
+    ]
+
+@api.get("/api/leaderboard", response_model=LeaderboardResponse)
 async def get_leaderboard_endpoint(limit: int = 10):
     """الحصول على لوحة المتصدرين"""
     try:
-        leaderboard_data = get_leaderboard(limit)
+        leaderboard_data = await get_leaderboard(limit)
+        return {"leaderboard": format_leaderboard(leaderboard_data)}
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على لوحة المتصدرين: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api.get("/api/bootstrap/{user_id}", response_model=BootstrapResponse)
+async def bootstrap_endpoint(user_id: int, leaderboard_limit: int = 10, activities_limit: int = 10):
+    """تحميل كل بيانات تطبيق الويب في طلب واحد: المستخدم ولوحة المتصدرين وأحدث الأنشطة"""
+    check_activities_limit(activities_limit)
+    try:
+        # الأجزاء مستقلة فتُجلب بالتوازي على اتصالات منفصلة من التجمع
+        dashboard, leaderboard_data, activities = await asyncio.gather(
+            get_user_dashboard(user_id),
+            get_leaderboard(leaderboard_limit),
+            activities_page(user_id, activities_limit)
+        )
         
-        # تنسيق البيانات للعرض
-        formatted_leaderboard = []
-        for entry in leaderboard_data:
-            user_id, username, points, total_points = entry
-            formatted_leaderboard.append({
-                "user_id": user_id,
-                "username": username,
-                "points": points,
-                "total_points": total_points
-            })
+        if not dashboard:
+            raise HTTPException(status_code=404, detail="المستخدم غير موجود")
             
-        return {"leaderboard": formatted_leaderboard}
+        return {
+            "user": format_user(user_id, dashboard),
+            "leaderboard": format_leaderboard(leaderboard_data),
+            **activities
+        }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"خطأ في الحصول على لوحة المتصدرين: {e}")
+        logger.error(f"خطأ في تحميل بيانات تطبيق الويب: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api.get("/api/referrals/top", response_model=TopReferrersResponse)
+async def get_top_referrers_endpoint(hours: int = 24, limit: int = 10):
+    """أكثر المستخدمين إحالات خلال آخر عدد من الساعات"""
+    if not 1 <= hours <= REFERRAL_TOP_MAX_HOURS:
+        raise HTTPException(status_code=400, detail=f"عدد الساعات يجب أن يكون بين 1 و {REFERRAL_TOP_MAX_HOURS}")
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="الحد يجب أن يكون بين 1 و 100")
+
+    referrers = await get_top_referrers(hours, limit)
+    if referrers is None:
+        raise HTTPException(status_code=503, detail="فهرس الإحالات غير متاح")
+    return {"hours": hours, "referrers": referrers}
+
+@api.get("/api/referrals/{user_id}/tree", response_model=ReferralTree)
+async def get_referral_tree_endpoint(user_id: int, max_depth: int = 3):
+    """موقع المستخدم في شجرة الإحالات وحجم شبكته في كل مستوى"""
+    if not 1 <= max_depth <= REFERRAL_TREE_MAX_DEPTH:
+        raise HTTPException(status_code=400, detail=f"عدد المستويات يجب أن يكون بين 1 و {REFERRAL_TREE_MAX_DEPTH}")
+
+    tree = await get_referral_tree(user_id, max_depth)
+    if tree is None:
+        raise HTTPException(status_code=503, detail="فهرس الإحالات غير متاح")
+    return tree
+
+@api.get("/api/rank/{user_id}", response_model=RankResponse)
+async def get_rank_endpoint(user_id: int):
+    """الحصول على ترتيب المستخدم في لوحة المتصدرين"""
+    try:
+        rank = await get_user_rank(user_id)
+        
+        if rank is None:
+            raise HTTPException(status_code=404, detail="المستخدم غير موجود")
+            
+        return {"user_id": user_id, "rank": rank}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على ترتيب المستخدم: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api.get("/api/live/{user_id}", include_in_schema=False)
+async def live_updates_endpoint(user_id: int):
+    """قناة Server-Sent Events لتحديثات الرصيد والنشاطات ولوحة المتصدرين
+
+    الأحداث: balance (النقاط والترتيب والنشاط الجديد)، leaderboard (أعلى المتصدرين عند تغيرهم)،
+    resync (فاتت أحداث على العميل فيعيد جلب حالته).
+    """
+    if not live_hub.enabled:
+        raise HTTPException(status_code=404, detail="التحديثات المباشرة معطلة")
+    if not live_hub.has_capacity():
+        raise HTTPException(status_code=503, detail="عدد الاتصالات المباشرة بلغ الحد الأقصى")
+
+    # الاشتراك يُسجل داخل المولد نفسه فيُلغى دائمًا مع انتهاء الاستجابة
+    return StreamingResponse(
+        live_hub.stream(user_id, LIVE_HEARTBEAT_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api.post("/api/withdraw/{user_id}")
-async def withdraw_points(user_id: int, request: Request):
-    """معالجة طلب سحب النقاط"""
+async def withdraw_points(user_id: int, request: Request, activities_limit: int = 0):
+    """معالجة طلب سحب النقاط
+
+    ترويسة Idempotency-Key اختيارية: إعادة الطلب بالمفتاح نفسه تعيد النتيجة الأصلية دون خصم ثانٍ.
+    """
+    enforce_rate_limit(request, "withdraw", user_id)
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="مفتاح منع التكرار غير صالح")
     try:
         data = await request.json()
         amount = data.get("amount")
@@ -226,7 +432,7 @@ async def withdraw_points(user_id: int, request: Request):
         if not amount or not isinstance(amount, int) or amount <= 0:
             raise HTTPException(status_code=400, detail="مبلغ غير صالح")
             
-        result, data = request_withdrawal(user_id, amount, details)
+        result, data = await request_withdrawal(user_id, amount, details, idempotency_key)
         
         if not result:
             return {
@@ -234,21 +440,51 @@ async def withdraw_points(user_id: int, request: Request):
                 "message": str(data)
             }
                 
-        return {
+        response = await with_activities({
             "success": True,
             "message": f"تم تقديم طلب السحب بنجاح! المعرف: {data['withdrawal_id']}",
             "withdrawal_id": data["withdrawal_id"],
             "amount": data["amount"],
             "remaining_points": data["remaining_points"]
-        }
+        }, user_id, activities_limit)
+        if data["replayed"]:
+            return FastJSONResponse(response, headers={"Idempotent-Replayed": "true"})
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"خطأ في معالجة طلب السحب: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-def run_api():
-    """تشغيل خادم FastAPI"""
+@api.post("/telegram/webhook/{secret}")
+async def telegram_webhook(secret: str, request: Request):
+    """استقبال تحديثات تيليجرام في وضع الـ webhook وتمريرها إلى موزع البوت"""
+    if BOT_MODE != "webhook" or not WEBHOOK_SECRET or not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=404, detail="Not Found")
+    # التحقق من ترويسة السر التي يرسلها تيليجرام قبل قراءة جسم الطلب
+    token = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+        
+    from bot import process_webhook_update
+    
+    data = await request.json()
+    try:
+        # المعالجات تُجدول في مجمع عمال البوت، لكن الجدولة قد تنتظر عند امتلاء الطابور
+        await run_in_threadpool(process_webhook_update, data)
+    except Exception as e:
+        logger.error(f"خطأ في معالجة تحديث تيليجرام: {e}")
+    # إعادة 200 دائمًا حتى لا يعيد تيليجرام إرسال التحديث نفسه
+    return {"ok": True}
+
+def run_api(host=API_HOST, port=API_PORT, workers=1):
+    """تشغيل خادم FastAPI في العملية الحالية أو في عدة عمليات عمال"""
     import uvicorn
-    host = "0.0.0.0"
-    port = 5000
-    logger.info(f"بدء تشغيل واجهة API على {host}:{port}")
-    uvicorn.run(api, host=host, port=port)
\ No newline at end of file
+    logger.info(f"بدء تشغيل واجهة API على {host}:{port} ({workers} عامل)")
+    if workers > 1:
+        # يحتاج uvicorn إلى مسار التطبيق ليستورده في كل عملية عامل
+        uvicorn.run(
+            "api:api", host=host, port=port, workers=workers, timeout_graceful_shutdown=API_SHUTDOWN_TIMEOUT
+        )
+    else:
+        uvicorn.run(api, host=host, port=port, timeout_graceful_shutdown=API_SHUTDOWN_TIMEOUT)
\ No newline at end of file
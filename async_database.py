@@ -0,0 +1,834 @@
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timezone, timedelta
+
+import asyncpg
+
+from database import (
+    _dashboard_from_row, after_points_change, encode_activity_cursor, decode_activity_cursor,
+    activity_writer, request_fingerprint, _summary_from_rows, _after_referral, _REFERRAL_EDGES_SQL,
+    _with_usernames, LEADERBOARD_LOAD_SQL
+)
+from leaderboard import leaderboard
+from referral_graph import referral_graph
+from cache import user_cache
+from singleflight import AsyncSingleFlight
+from metrics import registry, timed, db_query_seconds, db_pool_acquire_seconds
+import json_backend
+from config import (
+    DATABASE_URL, DAILY_POINTS, REFERRAL_POINTS, DAILY_CLAIM_COOLDOWN,
+    SOCIAL_MEDIA_POINTS, SOCIAL_MEDIA_LINKS, ACTIVITIES_EXPORT_BATCH_SIZE,
+    ASYNC_DB_POOL_MIN_SIZE, ASYNC_DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE
+)
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+# طبقة وصول غير متزامنة تعكس دوال database.py العامة لاستخدامها من نقاط نهاية FastAPI
+# دون حجب حلقة الأحداث. يبقى database.py المتزامن مستخدمًا في bot.py.
+
+_pool = None
+_pool_lock = None
+
+# دمج القراءات المتطابقة المتزامنة من طلبات API في استعلام واحد
+read_flights = AsyncSingleFlight("async_database")
+
+# زمن دوال الوصول العامة كما يراه المستدعي (يشمل التخزين المؤقت والدمج)
+timed_query = timed(db_query_seconds, "async")
+
+def get_read_coalescing_stats():
+    """عدادات دمج القراءات (الاستعلامات المنفذة والاستدعاءات المدموجة لكل دالة)"""
+    return read_flights.stats()
+
+class _TimedAcquire:
+    """سياق استعارة اتصال يسجل زمن الانتظار"""
+
+    __slots__ = ("_context", "_started")
+
+    def __init__(self, context):
+        self._context = context
+        self._started = None
+
+    async def __aenter__(self):
+        self._started = time.perf_counter()
+        conn = await self._context.__aenter__()
+        _acquire_seconds.observe(time.perf_counter() - self._started)
+        return conn
+
+    async def __aexit__(self, *exc_info):
+        return await self._context.__aexit__(*exc_info)
+
+
+class _TimedPool:
+    """غلاف لتجمع asyncpg يقيس زمن استعارة الاتصالات دون تغيير مواضع الاستخدام"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def acquire(self):
+        return _TimedAcquire(self._pool.acquire())
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+_acquire_seconds = db_pool_acquire_seconds.labels("async")
+
+async def _init_connection(conn):
+    """تسجيل محول JSONB حتى تُستقبل التفاصيل كقواميس مباشرة"""
+    await conn.set_type_codec(
+        'jsonb', encoder=json_backend.dumps, decoder=json_backend.loads, schema='pg_catalog'
+    )
+
+async def init_async_pool():
+    """إنشاء تجمع الاتصالات غير المتزامن (يُستدعى عند بدء تشغيل خادم API)"""
+    global _pool, _pool_lock
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            _pool = _TimedPool(await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=ASYNC_DB_POOL_MIN_SIZE,
+                max_size=ASYNC_DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+                init=_init_connection,
+            ))
+            logger.info(
+                f"تم إنشاء تجمع الاتصالات غير المتزامن ({ASYNC_DB_POOL_MIN_SIZE}-{ASYNC_DB_POOL_MAX_SIZE})"
+            )
+    return _pool
+
+async def get_async_pool():
+    """الحصول على تجمع الاتصالات غير المتزامن وإنشاؤه عند الحاجة"""
+    if _pool is None:
+        return await init_async_pool()
+    return _pool
+
+async def close_async_pool():
+    """إغلاق تجمع الاتصالات غير المتزامن عند إيقاف خادم API"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+def get_async_pool_stats():
+    """مقاييس التجمع غير المتزامن"""
+    if _pool is None:
+        return {"size": 0, "idle": 0, "checked_out": 0}
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        "size": size,
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+        "idle": idle,
+        "checked_out": size - idle,
+    }
+
+async def _log_activity(conn, user_id, activity_type, points, details=None, allow_buffer=True):
+    """تسجيل نشاط عبر طابور الكاتب أو داخل المعاملة الحالية حسب وضع الكاتب (انظر database._log_activity)"""
+    if allow_buffer and activity_writer.buffered and activity_writer.enqueue(user_id, activity_type, points, details):
+        return
+    await conn.execute(
+        'INSERT INTO activities (user_id, activity_type, points, details) VALUES ($1, $2, $3, $4)',
+        user_id, activity_type, points, details if details is not None else {}
+    )
+
+@timed_query
+async def add_user(user_id, username, full_name=None):
+    """إضافة مستخدم جديد إلى قاعدة البيانات أو تجاهله إذا كان موجودًا بالفعل"""
+    try:
+        pool = await get_async_pool()
+        row = await pool.fetchrow(
+            '''
+            INSERT INTO users (user_id, username, full_name, points, total_points)
+            VALUES ($1, $2, $3, 0, 0)
+            ON CONFLICT (user_id)
+            DO UPDATE SET username = $2, full_name = COALESCE($3, users.full_name)
+            RETURNING points, total_points
+            ''',
+            user_id, username, full_name
+        )
+        await _after_points_change(user_id, row[0], row[1], username)
+        logger.info(f"تمت إضافة المستخدم {user_id} ({username}) أو هو موجود بالفعل")
+        return True
+    except Exception as e:
+        logger.error(f"خطأ في إضافة المستخدم: {e}")
+        return False
+
+async def _cache_call(method, *args):
+    """استدعاء التخزين المؤقت؛ الواجهات الشبكية (Redis) تُنفذ خارج حلقة الأحداث"""
+    if user_cache.blocking:
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+    return method(*args)
+
+async def _after_points_change(user_id, points, total_points, username=None, activity=None):
+    """after_points_change مع إبطال ملف المستخدم المخزن مؤقتًا دون حجب حلقة الأحداث"""
+    await _cache_call(user_cache.delete, user_id)
+    after_points_change(user_id, points, total_points, username, activity, invalidate_cache=False)
+
+@timed_query
+async def get_user(user_id):
+    """الحصول على بيانات المستخدم (قراءة عبر التخزين المؤقت ثم قاعدة البيانات)"""
+    hit, cached = await _cache_call(user_cache.get, user_id)
+    if hit:
+        return cached
+    return await _load_user(user_id)
+
+@read_flights.wrap()
+async def _load_user(user_id):
+    """تحميل ملف المستخدم من قاعدة البيانات وتخزينه مؤقتًا"""
+    token = await _cache_call(user_cache.begin_fill, user_id)
+    try:
+        pool = await get_async_pool()
+        row = await pool.fetchrow(
+            'SELECT points, total_points, last_claim_time, username, full_name FROM users WHERE user_id = $1',
+            user_id
+        )
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على بيانات المستخدم: {e}")
+        row = None
+
+    result = tuple(row) if row else None
+    await _cache_call(user_cache.fill, user_id, result, token)
+    return result
+
+@timed_query
+@read_flights.wrap()
+async def get_user_dashboard(user_id):
+    """الحصول على بيانات لوحة المستخدم (الرصيد، الإحالات، أهلية المطالبة، الزيارات) باستعلام واحد للقراءة فقط"""
+    try:
+        pool = await get_async_pool()
+        row = await pool.fetchrow(
+            '''
+            SELECT u.points, u.total_points, u.last_claim_time, u.username, u.full_name,
+                   u.referrals_count,
+                   -- الشرط نفسه الذي يستخدمه UPDATE في daily_claim والتقريب نفسه (CEIL)
+                   CASE
+                       WHEN u.last_claim_time IS NULL
+                            OR u.last_claim_time <= (NOW() AT TIME ZONE 'UTC') - make_interval(secs => $1::INTEGER)
+                       THEN 0
+                       ELSE CEIL($1::INTEGER - EXTRACT(EPOCH FROM ((NOW() AT TIME ZONE 'UTC') - u.last_claim_time)))::INTEGER
+                   END AS next_claim_time,
+                   COALESCE(
+                       (SELECT array_agg(v.social_type) FROM social_media_visits v WHERE v.user_id = u.user_id),
+                       '{}'
+                   ) AS visited_socials
+            FROM users u
+            WHERE u.user_id = $2
+            ''',
+            DAILY_CLAIM_COOLDOWN, user_id
+        )
+        if not row:
+            return None
+        return _dashboard_from_row(tuple(row))
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على لوحة المستخدم: {e}")
+        return None
+
+@timed_query
+async def update_points(user_id, points_to_add, activity_type, details=None):
+    """تحديث نقاط المستخدم وإضافة نشاط جديد"""
+    try:
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    'UPDATE users SET points = points + $1, total_points = total_points + $1 WHERE user_id = $2 RETURNING points, total_points',
+                    points_to_add, user_id
+                )
+                new_points, total_points = row
+
+                if details is None:
+                    details = {}
+
+                await _log_activity(conn, user_id, activity_type, points_to_add, details)
+
+        await _after_points_change(user_id, new_points, total_points, activity=(activity_type, points_to_add, details))
+        logger.info(f"تم تحديث نقاط المستخدم {user_id}: +{points_to_add} نقطة من النشاط {activity_type}")
+
+        return True, {
+            'points': new_points,
+            'total_points': total_points,
+            'points_added': points_to_add
+        }
+    except Exception as e:
+        logger.error(f"خطأ في تحديث النقاط: {e}")
+        return False, str(e)
+
+@timed_query
+async def can_claim_daily(user_id):
+    """التحقق مما إذا كان المستخدم يمكنه المطالبة بالنقاط اليومية"""
+    try:
+        pool = await get_async_pool()
+        row = await pool.fetchrow(
+            'SELECT last_claim_time FROM users WHERE user_id = $1',
+            user_id
+        )
+
+        if not row:
+            return False, "المستخدم غير موجود"
+
+        last_claim = row[0]
+
+        if not last_claim:
+            return True, "المطالبة الأولى"
+
+        current_time = datetime.now(timezone.utc)
+
+        if last_claim.tzinfo is None:
+            last_claim = last_claim.replace(tzinfo=timezone.utc)
+
+        time_since_last_claim = (current_time - last_claim).total_seconds()
+
+        if time_since_last_claim >= DAILY_CLAIM_COOLDOWN:
+            return True, "مؤهل للمطالبة"
+        else:
+            remaining_time = DAILY_CLAIM_COOLDOWN - time_since_last_claim
+            return False, math.ceil(remaining_time)
+    except Exception as e:
+        logger.error(f"خطأ في التحقق من أهلية المطالبة اليومية: {e}")
+        return False, str(e)
+
+# إدراج نشاط المطالبة داخل نفس العبارة في وضع الكتابة المتزامن
+_DAILY_CLAIM_LOGGED_CTE = ''', logged AS (
+                INSERT INTO activities (user_id, activity_type, points, details)
+                SELECT $1, 'daily_claim', $2,
+                       jsonb_build_object('claim_time', to_char(last_claim_time, 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'))
+                FROM claimed
+            )'''
+
+@timed_query
+async def daily_claim(user_id):
+    """معالجة المطالبة اليومية بالنقاط بعبارة شرطية واحدة (تُمنح مرة واحدة فقط حتى مع الطلبات المتزامنة)"""
+    try:
+        pool = await get_async_pool()
+        row = await pool.fetchrow(
+            '''
+            WITH claimed AS (
+                UPDATE users
+                SET points = points + $2,
+                    total_points = total_points + $2,
+                    last_claim_time = NOW() AT TIME ZONE 'UTC'
+                WHERE user_id = $1
+                  AND (last_claim_time IS NULL
+                       OR last_claim_time <= (NOW() AT TIME ZONE 'UTC') - make_interval(secs => $3::INTEGER))
+                RETURNING points, total_points, last_claim_time
+            ){logged_cte}
+            SELECT TRUE, c.points, c.total_points, NULL::INTEGER, c.last_claim_time
+            FROM claimed c
+            UNION ALL
+            SELECT FALSE, u.points, u.total_points,
+                   CASE
+                       -- اللقطة تقول إن المستخدم مؤهل عند بدء العبارة ومع ذلك فشل UPDATE:
+                       -- مطالبة متزامنة سبقتنا فبدأت فترة الانتظار للتو
+                       WHEN u.last_claim_time IS NULL
+                            OR u.last_claim_time <= (NOW() AT TIME ZONE 'UTC') - make_interval(secs => $3::INTEGER)
+                       THEN $3::INTEGER
+                       ELSE CEIL($3::INTEGER - EXTRACT(EPOCH FROM ((NOW() AT TIME ZONE 'UTC') - u.last_claim_time)))::INTEGER
+                   END,
+                   NULL
+            FROM users u
+            WHERE u.user_id = $1 AND NOT EXISTS (SELECT 1 FROM claimed)
+            '''.format(logged_cte='' if activity_writer.buffered else _DAILY_CLAIM_LOGGED_CTE),
+            user_id, DAILY_POINTS, DAILY_CLAIM_COOLDOWN
+        )
+    except Exception as e:
+        logger.error(f"خطأ في معالجة المطالبة اليومية: {e}")
+        return False, str(e)
+
+    if not row:
+        return None, None
+
+    claimed, new_points, total_points, seconds_remaining, claim_time = row
+
+    if not claimed:
+        return False, seconds_remaining
+
+    details = {'claim_time': claim_time.replace(tzinfo=timezone.utc).isoformat()}
+    if activity_writer.buffered:
+        if not activity_writer.enqueue(user_id, 'daily_claim', DAILY_POINTS, details):
+            pool = await get_async_pool()
+            async with pool.acquire() as conn:
+                await _log_activity(conn, user_id, 'daily_claim', DAILY_POINTS, details)
+
+    await _after_points_change(user_id, new_points, total_points, activity=('daily_claim', DAILY_POINTS, details))
+    logger.info(f"تم منح المستخدم {user_id} المكافأة اليومية: {DAILY_POINTS} نقطة")
+
+    return True, {
+        'points': new_points,
+        'total_points': total_points,
+        'points_added': DAILY_POINTS
+    }
+
+@timed_query
+@read_flights.wrap()
+async def get_referrals(user_id):
+    """الحصول على عدد الإحالات للمستخدم (العداد المخزن في جدول المستخدمين)"""
+    try:
+        pool = await get_async_pool()
+        count = await pool.fetchval(
+            'SELECT referrals_count FROM users WHERE user_id = $1',
+            user_id
+        )
+        return count or 0
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على عدد الإحالات: {e}")
+        return 0
+
+@timed_query
+async def add_referral(referrer_id, referred_id):
+    """إضافة إحالة جديدة وتحديث النقاط"""
+    try:
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    'SELECT 1 FROM users WHERE user_id IN ($1, $2)',
+                    referrer_id, referred_id
+                )
+                if len(rows) < 2:
+                    return False, "المستخدمون غير موجودين"
+
+                inserted = await conn.fetchval(
+                    '''
+                    INSERT INTO referrals (referrer_id, referred_id) VALUES ($1, $2)
+                    ON CONFLICT (referrer_id, referred_id) DO NOTHING
+                    RETURNING id
+                    ''',
+                    referrer_id, referred_id
+                )
+                if inserted is None:
+                    return False, "تمت الإحالة بالفعل"
+
+                row = await conn.fetchrow(
+                    'UPDATE users SET points = points + $1, total_points = total_points + $1, referrals_count = referrals_count + 1 WHERE user_id = $2 RETURNING points, total_points',
+                    REFERRAL_POINTS, referrer_id
+                )
+                new_points, total_points = row
+
+                details = {'referred_id': referred_id}
+                await _log_activity(conn, referrer_id, 'referral', REFERRAL_POINTS, details)
+
+        await _after_points_change(referrer_id, new_points, total_points, activity=('referral', REFERRAL_POINTS, details))
+        _after_referral(referrer_id, referred_id)
+        logger.info(f"تمت إضافة إحالة جديدة: {referrer_id} أحال {referred_id} (+{REFERRAL_POINTS} نقطة)")
+
+        return True, {
+            'points': new_points,
+            'total_points': total_points,
+            'points_added': REFERRAL_POINTS
+        }
+    except Exception as e:
+        logger.error(f"خطأ في إضافة الإحالة: {e}")
+        return False, str(e)
+
+async def load_referral_graph():
+    """بناء فهرس الإحالات في الذاكرة من جدول الإحالات"""
+    if not referral_graph.begin_refresh():
+        return False
+    try:
+        pool = await get_async_pool()
+        rows = await pool.fetch(_REFERRAL_EDGES_SQL)
+        referral_graph.load([tuple(row) for row in rows])
+        logger.info(f"تم تحميل فهرس الإحالات في الذاكرة ({len(rows)} إحالة)")
+        return True
+    except Exception as e:
+        referral_graph.cancel_refresh()
+        logger.error(f"خطأ في تحميل فهرس الإحالات: {e}")
+        return False
+
+@timed_query
+async def get_referral_tree(user_id, max_depth=3):
+    """موقع المستخدم في شجرة الإحالات (العمق وسلسلة المحيلين) وحجم شبكته في كل مستوى"""
+    if referral_graph.is_stale():
+        await load_referral_graph()
+    if not referral_graph.loaded:
+        return None
+    return referral_graph.tree(user_id, max_depth)
+
+@timed_query
+async def get_top_referrers(hours=24, limit=10):
+    """أكثر المستخدمين إحالات خلال آخر عدد من الساعات"""
+    if referral_graph.is_stale():
+        await load_referral_graph()
+    if not referral_graph.loaded:
+        return None
+    counts = referral_graph.top_referrers(time.time() - hours * 3600, limit)
+    if not counts:
+        return []
+    try:
+        pool = await get_async_pool()
+        rows = await pool.fetch(
+            'SELECT user_id, username FROM users WHERE user_id = ANY($1::bigint[])',
+            [user_id for user_id, _ in counts]
+        )
+        usernames = {row[0]: row[1] for row in rows}
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على أسماء المحيلين: {e}")
+        usernames = {}
+    return _with_usernames(counts, usernames)
+
+@timed_query
+@read_flights.wrap()
+async def get_user_activities(user_id, limit=10):
+    """الحصول على آخر أنشطة المستخدم"""
+    try:
+        pool = await get_async_pool()
+        rows = await pool.fetch(
+            '''
+            SELECT activity_type, points, created_at, details
+            FROM activities
+            WHERE user_id = $1
+            ORDER BY created_at DESC
+            LIMIT $2
+            ''',
+            user_id, limit
+        )
+        return [tuple(row) for row in rows]
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على أنشطة المستخدم: {e}")
+        return []
+
+@timed_query
+@read_flights.wrap()
+async def get_user_activities_page(user_id, limit=10, cursor=None):
+    """الحصول على صفحة من أنشطة المستخدم بترقيم المفاتيح على (created_at, id) مع مؤشر الصفحة التالية"""
+    if cursor:
+        created_at, activity_id = decode_activity_cursor(cursor)
+        query = '''
+            SELECT id, activity_type, points, created_at, details
+            FROM activities
+            WHERE user_id = $1 AND (created_at, id) < ($3, $4)
+            ORDER BY created_at DESC, id DESC
+            LIMIT $2
+        '''
+        args = (user_id, limit + 1, created_at, activity_id)
+    else:
+        query = '''
+            SELECT id, activity_type, points, created_at, details
+            FROM activities
+            WHERE user_id = $1
+            ORDER BY created_at DESC, id DESC
+            LIMIT $2
+        '''
+        args = (user_id, limit + 1)
+
+    try:
+        pool = await get_async_pool()
+        rows = [tuple(row) for row in await pool.fetch(query, *args)]
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على صفحة أنشطة المستخدم: {e}")
+        return [], None
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_activity_cursor(last[3], last[0])
+    return rows, next_cursor
+
+@timed_query
+@read_flights.wrap()
+async def get_user_activity_summary(user_id, days=30):
+    """ملخص نشاطات المستخدم لآخر عدد من الأيام (انظر database.get_user_activity_summary)"""
+    start = datetime.now().date() - timedelta(days=days - 1)
+    try:
+        pool = await get_async_pool()
+        rows = await pool.fetch(
+            '''
+            WITH state AS (
+                SELECT GREATEST(
+                    COALESCE((SELECT complete_through + 1 FROM activity_rollup_state WHERE name = 'daily'), $2),
+                    $2
+                ) AS raw_from
+            ), combined AS (
+                SELECT r.activity_type, r.activity_count, r.points
+                FROM activity_daily_rollups r, state
+                WHERE r.user_id = $1 AND r.day >= $2 AND r.day < state.raw_from
+                UNION ALL
+                SELECT a.activity_type, 1, a.points
+                FROM activities a, state
+                WHERE a.user_id = $1 AND a.created_at >= state.raw_from
+            )
+            SELECT activity_type, SUM(activity_count)::bigint, SUM(points)::bigint
+            FROM combined
+            GROUP BY activity_type
+            ORDER BY 3 DESC
+            ''',
+            user_id, start
+        )
+        return _summary_from_rows(days, [tuple(row) for row in rows])
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على ملخص أنشطة المستخدم: {e}")
+        return None
+
+async def iter_user_activities(user_id, batch_size=ACTIVITIES_EXPORT_BATCH_SIZE):
+    """المرور على كامل سجل أنشطة المستخدم عبر مؤشر على الخادم بذاكرة محدودة"""
+    pool = await get_async_pool()
+    async with pool.acquire() as conn:
+        # مؤشرات asyncpg تتطلب معاملة وتجلب الصفوف على دفعات بحجم prefetch
+        async with conn.transaction():
+            async for row in conn.cursor(
+                '''
+                SELECT id, activity_type, points, created_at, details
+                FROM activities
+                WHERE user_id = $1
+                ORDER BY created_at DESC, id DESC
+                ''',
+                user_id,
+                prefetch=batch_size
+            ):
+                yield tuple(row)
+
+@timed_query
+async def social_media_visit(user_id, social_type):
+    """تسجيل زيارة لموقع تواصل اجتماعي وإضافة نقاط (مرة واحدة فقط)"""
+    if social_type not in SOCIAL_MEDIA_LINKS:
+        return False, "نوع موقع التواصل الاجتماعي غير معروف"
+
+    try:
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # تسجيل الزيارة مرة واحدة فقط
+                inserted = await conn.fetchval(
+                    '''
+                    INSERT INTO social_media_visits (user_id, social_type) VALUES ($1, $2)
+                    ON CONFLICT (user_id, social_type) DO NOTHING
+                    RETURNING id
+                    ''',
+                    user_id, social_type
+                )
+                if inserted is None:
+                    return False, "تمت الزيارة بالفعل"
+
+                points_to_add = SOCIAL_MEDIA_POINTS
+                row = await conn.fetchrow(
+                    'UPDATE users SET points = points + $1, total_points = total_points + $1 WHERE user_id = $2 RETURNING points, total_points',
+                    points_to_add, user_id
+                )
+                new_points, total_points = row
+
+                details = {'social_type': social_type, 'url': SOCIAL_MEDIA_LINKS[social_type]}
+                await _log_activity(conn, user_id, f'social_{social_type}', points_to_add, details)
+
+        await _after_points_change(
+            user_id, new_points, total_points, activity=(f'social_{social_type}', points_to_add, details)
+        )
+        logger.info(f"المستخدم {user_id} قام بزيارة {social_type} (+{points_to_add} نقطة)")
+
+        return True, {
+            'points': new_points,
+            'total_points': total_points,
+            'points_added': points_to_add
+        }
+    except Exception as e:
+        logger.error(f"خطأ في تسجيل زيارة موقع تواصل اجتماعي: {e}")
+        return False, str(e)
+
+@timed_query
+@read_flights.wrap()
+async def get_social_media_visits(user_id):
+    """الحصول على قائمة بالمواقع التي زارها المستخدم بالفعل"""
+    try:
+        pool = await get_async_pool()
+        rows = await pool.fetch(
+            'SELECT social_type FROM social_media_visits WHERE user_id = $1',
+            user_id
+        )
+        return [row[0] for row in rows]
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على زيارات مواقع التواصل الاجتماعي: {e}")
+        return []
+
+async def load_leaderboard():
+    """بناء لوحة المتصدرين في الذاكرة من جدول المستخدمين"""
+    if not leaderboard.begin_refresh():
+        return False
+    try:
+        pool = await get_async_pool()
+        rows = await pool.fetch(LEADERBOARD_LOAD_SQL)
+        # بناء اللوحة لعدد كبير من المستخدمين خارج حلقة الأحداث حتى لا يوقف الطلبات الأخرى
+        await asyncio.get_running_loop().run_in_executor(None, leaderboard.load, rows)
+        logger.info(f"تم تحميل لوحة المتصدرين في الذاكرة ({len(rows)} مستخدم)")
+        return True
+    except Exception as e:
+        leaderboard.cancel_refresh()
+        logger.error(f"خطأ في تحميل لوحة المتصدرين: {e}")
+        return False
+
+@timed_query
+async def get_leaderboard(limit=10):
+    """الحصول على لوحة المتصدرين"""
+    if leaderboard.is_stale():
+        await load_leaderboard()
+    if leaderboard.loaded:
+        return leaderboard.top(limit)
+    return await _query_leaderboard(limit)
+
+@read_flights.wrap(user_scoped=False)
+async def _query_leaderboard(limit):
+    """لوحة المتصدرين من قاعدة البيانات عندما لا تكون محملة في الذاكرة"""
+    try:
+        pool = await get_async_pool()
+        rows = await pool.fetch(
+            '''
+            SELECT user_id, username, points, total_points
+            FROM users
+            ORDER BY points DESC
+            LIMIT $1
+            ''',
+            limit
+        )
+        return [tuple(row) for row in rows]
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على لوحة المتصدرين: {e}")
+        return []
+
+@timed_query
+async def get_user_rank(user_id):
+    """الحصول على ترتيب المستخدم في لوحة المتصدرين (يبدأ من 1)"""
+    if leaderboard.is_stale():
+        await load_leaderboard()
+    if leaderboard.loaded:
+        return leaderboard.rank(user_id)
+    return await _query_user_rank(user_id)
+
+@read_flights.wrap()
+async def _query_user_rank(user_id):
+    """ترتيب المستخدم من قاعدة البيانات عندما لا تكون اللوحة محملة في الذاكرة"""
+    try:
+        pool = await get_async_pool()
+        return await pool.fetchval(
+            '''
+            SELECT (
+                SELECT COUNT(*) FROM users u
+                WHERE u.points > me.points OR (u.points = me.points AND u.user_id < me.user_id)
+            ) + 1
+            FROM users me
+            WHERE me.user_id = $1
+            ''',
+            user_id
+        )
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على ترتيب المستخدم: {e}")
+        return None
+
+@timed_query
+async def request_withdrawal(user_id, amount, details=None, idempotency_key=None):
+    """تسجيل طلب سحب النقاط بخصم مشروط ذري، مع إعادة النتيجة المحفوظة عند تكرار مفتاح منع التكرار
+
+    يعيد (True, النتيجة) مع 'replayed' عند إعادة طلب سابق، أو (False, رسالة الخطأ).
+    """
+    if details is None:
+        details = {}
+
+    try:
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                committed, outcome = await _withdraw_in_transaction(conn, user_id, amount, details, idempotency_key)
+            except Exception:
+                await transaction.rollback()
+                raise
+            if committed:
+                await transaction.commit()
+            else:
+                # التراجع يحرر مفتاح منع التكرار فيمكن إعادة المحاولة
+                await transaction.rollback()
+
+        if not committed:
+            return outcome
+        result, new_points, total_points = outcome
+        if new_points is None:
+            return True, dict(result, replayed=True)
+
+        await _after_points_change(
+            user_id, new_points, total_points,
+            activity=('withdrawal', -amount, {'withdrawal_id': result['withdrawal_id']})
+        )
+        logger.info(f"تم تسجيل طلب سحب للمستخدم {user_id}: {amount} نقطة (معرف الطلب: {result['withdrawal_id']})")
+        return True, dict(result, replayed=False)
+    except Exception as e:
+        logger.error(f"خطأ في تسجيل طلب السحب: {e}")
+        return False, str(e)
+
+async def _withdraw_in_transaction(conn, user_id, amount, details, idempotency_key):
+    """خطوات السحب داخل معاملة مفتوحة؛ يعيد (تثبيت؟، النتيجة)"""
+    if idempotency_key:
+        request_hash = request_fingerprint('withdrawal', {'amount': amount, 'details': details})
+        # ينتظر الإدراج انتهاء أي معاملة أخرى تحمل المفتاح نفسه قبل أن يقرر
+        inserted = await conn.fetchval(
+            '''
+            INSERT INTO idempotency_keys (user_id, idempotency_key, operation, request_hash)
+            VALUES ($1, $2, 'withdrawal', $3)
+            ON CONFLICT (user_id, idempotency_key) DO NOTHING
+            RETURNING user_id
+            ''',
+            user_id, idempotency_key, request_hash
+        )
+        if inserted is None:
+            stored = await conn.fetchrow(
+                '''
+                SELECT operation, request_hash, response FROM idempotency_keys
+                WHERE user_id = $1 AND idempotency_key = $2
+                ''',
+                user_id, idempotency_key
+            )
+            if stored['operation'] != 'withdrawal' or stored['request_hash'] != request_hash:
+                return False, (False, "مفتاح منع التكرار مستخدم لطلب مختلف")
+            if stored['response'] is None:
+                return False, (False, "الطلب الأصلي لم يكتمل بعد")
+            return True, (stored['response'], None, None)
+
+    # خصم مشروط في عبارة واحدة: لا يمكن لطلبين متزامنين تجاوز الرصيد
+    debited = await conn.fetchrow(
+        '''
+        UPDATE users SET points = points - $1
+        WHERE user_id = $2 AND points >= $1
+        RETURNING points, total_points
+        ''',
+        amount, user_id
+    )
+    if debited is None:
+        exists = await conn.fetchval('SELECT 1 FROM users WHERE user_id = $1', user_id)
+        return False, (False, "رصيد غير كافٍ" if exists else "المستخدم غير موجود")
+
+    new_points, total_points = debited
+
+    # تسجيل طلب السحب وقيده في سجل النشاطات داخل المعاملة نفسها
+    withdrawal_id = await conn.fetchval(
+        '''
+        INSERT INTO withdrawals (user_id, amount, details)
+        VALUES ($1, $2, $3)
+        RETURNING id
+        ''',
+        user_id, amount, details
+    )
+    await _log_activity(
+        conn, user_id, 'withdrawal', -amount,
+        dict(details, withdrawal_id=withdrawal_id), allow_buffer=False
+    )
+
+    result = {
+        'withdrawal_id': withdrawal_id,
+        'amount': amount,
+        'remaining_points': new_points
+    }
+    if idempotency_key:
+        await conn.execute(
+            'UPDATE idempotency_keys SET response = $1 WHERE user_id = $2 AND idempotency_key = $3',
+            result, user_id, idempotency_key
+        )
+    return True, (result, new_points, total_points)
+
+# مصادر مقاييس طبقة الوصول غير المتزامنة في عمليات خادم API
+registry.register_stats("async_db_pool", get_async_pool_stats)
+registry.register_stats("read_coalescing_async", get_read_coalescing_stats)
@@ -1,16 +1,22 @@
 import logging
-import time
-import os
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Updater, CommandHandler, CallbackContext, CallbackQueryHandler
-import json
+import re
+from queue import Queue
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import Updater, Dispatcher, CommandHandler, CallbackContext, CallbackQueryHandler
 
 from database import (
-    add_user, get_user, daily_claim, can_claim_daily, get_referrals,
-    add_referral, get_user_activities, add_task_completion, reset_user_points,
+    add_user, get_user, daily_claim, get_referrals,
+    add_referral, get_user_activities, get_leaderboard, get_user_rank,
     social_media_visit, get_social_media_visits
 )
-from config import SOCIAL_MEDIA_LINKS, WEBAPP_URL, 8125867347:AAFEh8OYVL-JpYGj1l6RRCXBqE7tG0WOzQQ
+from config import (
+    SOCIAL_MEDIA_LINKS, WEBAPP_URL, TELEGRAM_TOKEN, TELEGRAM_API_URL,
+    BOT_WORKERS, BOT_MAX_PENDING_UPDATES, BOT_ENQUEUE_TIMEOUT,
+    WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_AUTO_SET
+)
+from bot_concurrency import KeyedWorkerPool, run_concurrently
+from rate_limit import rate_limiter
+from metrics import registry
 
 # إعداد السجلات
 logging.basicConfig(
@@ -19,6 +25,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# الرد على الطلبات المرفوضة بسبب تجاوز المعدل
+RATE_LIMITED_MESSAGE = "⏳ طلبات كثيرة، يرجى المحاولة بعد قليل."
+
 def start(update: Update, context: CallbackContext):
     """أمر البدء - تسجيل المستخدم وتوفير الرابط لتطبيق الويب"""
     user = update.message.from_user
@@ -52,9 +61,26 @@ def start(update: Update, context: CallbackContext):
         reply_markup=reply_markup
     )
 
+def callback_action(data):
+    """اسم الإجراء المستخدم في تحديد المعدل لبيانات زر تفاعلي، أو None للأزرار التي لا تكتب"""
+    if data == "daily_claim":
+        return "daily_claim"
+    if data.startswith("social_"):
+        return "social_visit"
+    if data.startswith("withdraw"):
+        return "withdraw"
+    # أزرار التنقل والعرض لا تخضع لتحديد المعدل
+    return None
+
 def handle_callback(update: Update, context: CallbackContext):
     """التعامل مع الأزرار التفاعلية"""
     query = update.callback_query
+    
+    # رفض الضغط المتكرر على أزرار الكتابة (المطالبة، الزيارة، السحب) قبل الوصول إلى قاعدة البيانات
+    action = callback_action(query.data)
+    if action is not None and not rate_limiter.check(action, user_id=query.from_user.id)[0]:
+        query.answer(RATE_LIMITED_MESSAGE)
+        return
     query.answer()
     
     if query.data == "daily_claim":
@@ -96,6 +122,9 @@ def daily_claim_handler(update: Update, context: CallbackContext):
 def daily_claim_command(update: Update, context: CallbackContext):
     """السماح للمستخدمين بالمطالبة بالنقاط اليومية"""
     user_id = update.message.from_user.id
+    if not rate_limiter.check("daily_claim", user_id=user_id)[0]:
+        update.message.reply_text(RATE_LIMITED_MESSAGE)
+        return
     result, data = daily_claim(user_id)
     
     if not result:
@@ -308,8 +337,6 @@ def help_command(update: Update, context: CallbackContext):
 
 def leaderboard_command(update: Update, context: CallbackContext):
     """عرض لوحة المتصدرين"""
-    from database import get_leaderboard
-    
     leaderboard = get_leaderboard(10)  # عرض أفضل 10 مستخدمين
     
     if not leaderboard:
@@ -322,6 +349,11 @@ def leaderboard_command(update: Update, context: CallbackContext):
         medal = '🥇' if i == 1 else '🥈' if i == 2 else '🥉' if i == 3 else f"{i}."
         message += f"{medal} {username}: {points} نقطة\n"
     
+    # ترتيب المستخدم الحالي من اللوحة في الذاكرة
+    rank = get_user_rank(update.message.from_user.id)
+    if rank:
+        message += f"\n📍 ترتيبك الحالي: {rank}"
+    
     update.message.reply_text(message)
 
 def process_referral(update: Update, context: CallbackContext):
@@ -344,25 +376,111 @@ def process_referral(update: Update, context: CallbackContext):
         )
     # عدم إظهار رسالة خطأ للمستخدم المحال إذا كانت الإحالة موجودة بالفعل
 
-def start_bot():
-    """تهيئة وتشغيل بوت تيليجرام"""
-    logger.info("جاري تشغيل البوت...")
+# مجمع العمال الذي ينفذ معالجات البوت بالتوازي
+handler_pool = None
+
+def get_bot_handler_stats():
+    """مقاييس معالجة تحديثات البوت (طول الطابور وزمن المعالجة لكل أمر)"""
+    if handler_pool is None:
+        return {}
+    return handler_pool.stats()
+
+def register_handlers(dispatcher):
+    """تسجيل معالجات الأوامر والأزرار لتعمل بالتوازي مع ترتيب تحديثات كل مستخدم"""
+    global handler_pool
+    handler_pool = KeyedWorkerPool(workers=BOT_WORKERS, max_pending=BOT_MAX_PENDING_UPDATES)
+    # زمن المعالجة لكل أمر وانتظار الطابور في عملية البوت (أو عملية خادم API في وضع الـ webhook)
+    registry.register_stats("bot_handlers", get_bot_handler_stats)
     
-    updater = Updater(TELEGRAM_TOKEN)
-    dispatcher = updater.dispatcher
+    def concurrent(callback):
+        return run_concurrently(handler_pool, callback, timeout=BOT_ENQUEUE_TIMEOUT)
     
     # إضافة معالجات الأوامر
-    dispatcher.add_handler(CommandHandler("start", start))
-    dispatcher.add_handler(CommandHandler("daily_claim", daily_claim_command))
-    dispatcher.add_handler(CommandHandler("balance", balance_command))
-    dispatcher.add_handler(CommandHandler("referral", referral_command))
-    dispatcher.add_handler(CommandHandler("tasks", tasks_command))
-    dispatcher.add_handler(CommandHandler("history", history_command))
-    dispatcher.add_handler(CommandHandler("help", help_command))
-    dispatcher.add_handler(CommandHandler("leaderboard", leaderboard_command))
+    dispatcher.add_handler(CommandHandler("start", concurrent(start)))
+    dispatcher.add_handler(CommandHandler("daily_claim", concurrent(daily_claim_command)))
+    dispatcher.add_handler(CommandHandler("balance", concurrent(balance_command)))
+    dispatcher.add_handler(CommandHandler("referral", concurrent(referral_command)))
+    dispatcher.add_handler(CommandHandler("tasks", concurrent(tasks_command)))
+    dispatcher.add_handler(CommandHandler("history", concurrent(history_command)))
+    dispatcher.add_handler(CommandHandler("help", concurrent(help_command)))
+    dispatcher.add_handler(CommandHandler("leaderboard", concurrent(leaderboard_command)))
     
     # إضافة معالج الأزرار
-    dispatcher.add_handler(CallbackQueryHandler(handle_callback))
+    dispatcher.add_handler(CallbackQueryHandler(concurrent(handle_callback)))
+    
+    logger.info(f"معالجات البوت تعمل على {BOT_WORKERS} عامل (حد الطابور: {BOT_MAX_PENDING_UPDATES})")
+
+# الموزع المستخدم في وضع الـ webhook (تصل التحديثات عبر خادم FastAPI)
+webhook_dispatcher = None
+
+# القيم المسموحة لـ secret_token في setWebhook
+WEBHOOK_SECRET_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
+def check_webhook_secret():
+    """رفض بدء وضع الـ webhook دون سر حقيقي صالح لترويسة تيليجرام"""
+    if WEBHOOK_SECRET in ("", "change-me"):
+        raise RuntimeError("يجب تعيين WEBHOOK_SECRET بقيمة سرية عشوائية قبل تشغيل البوت بوضع الـ webhook")
+    if not WEBHOOK_SECRET_PATTERN.fullmatch(WEBHOOK_SECRET):
+        raise RuntimeError("WEBHOOK_SECRET يجب أن يتكون من 1 إلى 256 حرفًا من A-Z و a-z و 0-9 و _ و -")
+
+def webhook_path():
+    """مسار استقبال تحديثات تيليجرام على خادم API"""
+    return f"/telegram/webhook/{WEBHOOK_SECRET}"
+
+def register_webhook(bot=None):
+    """تسجيل عنوان الـ webhook لدى تيليجرام"""
+    if not WEBHOOK_URL:
+        logger.warning("لم يتم تعيين WEBHOOK_URL؛ لن يتم تسجيل الـ webhook لدى تيليجرام")
+        return False
+    check_webhook_secret()
+    bot = bot or Bot(TELEGRAM_TOKEN, base_url=TELEGRAM_API_URL)
+    # يرسل تيليجرام السر نفسه في ترويسة X-Telegram-Bot-Api-Secret-Token مع كل تحديث
+    bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}{webhook_path()}", secret_token=WEBHOOK_SECRET)
+    logger.info(f"تم تسجيل الـ webhook على {WEBHOOK_URL.rstrip('/')}/telegram/webhook/***")
+    return True
+
+def start_webhook_bot():
+    """تهيئة موزع البوت لوضع الـ webhook وتسجيل العنوان لدى تيليجرام"""
+    global webhook_dispatcher
+    if webhook_dispatcher is not None:
+        return webhook_dispatcher
+    check_webhook_secret()
+    
+    bot = Bot(TELEGRAM_TOKEN, base_url=TELEGRAM_API_URL)
+    # لا يُشغّل ثريد الموزع: التحديثات تُمرر مباشرة إلى process_update من مسار الـ webhook
+    dispatcher = Dispatcher(bot, Queue(), workers=0, use_context=True)
+    register_handlers(dispatcher)
+    
+    if WEBHOOK_AUTO_SET:
+        register_webhook(bot)
+    
+    webhook_dispatcher = dispatcher
+    logger.info("تم تشغيل البوت بوضع الـ webhook")
+    return dispatcher
+
+def process_webhook_update(data):
+    """تمرير تحديث وارد من تيليجرام (JSON) إلى موزع البوت"""
+    if webhook_dispatcher is None:
+        raise RuntimeError("البوت لا يعمل بوضع الـ webhook")
+    update = Update.de_json(data, webhook_dispatcher.bot)
+    webhook_dispatcher.process_update(update)
+
+def stop_webhook_bot():
+    """إنهاء معالجات البوت الجارية في وضع الـ webhook"""
+    global webhook_dispatcher
+    if webhook_dispatcher is None:
+        return
+    webhook_dispatcher = None
+    handler_pool.shutdown()
+
+def start_bot():
+    """تهيئة وتشغيل بوت تيليجرام بوضع الاستطلاع (polling)"""
+    logger.info("جاري تشغيل البوت...")
+    
+    updater = Updater(TELEGRAM_TOKEN, base_url=TELEGRAM_API_URL)
+    dispatcher = updater.dispatcher
+    
+    register_handlers(dispatcher)
     
     # بدء البوت
     updater.start_polling()
@@ -370,3 +488,6 @@ def start_bot():
     
     # إبقاء البوت قيد التشغيل
     updater.idle()
+    
+    # إنهاء المعالجات الجارية قبل الخروج
+    handler_pool.shutdown()
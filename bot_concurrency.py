@@ -0,0 +1,129 @@
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import LatencyHistogram
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+
+class KeyedWorkerPool:
+    """مجمع عمال محدود الحجم ينفذ المهام بالتوازي مع الحفاظ على ترتيب مهام المفتاح الواحد"""
+
+    def __init__(self, workers=8, max_pending=1000, name="bot-handler"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._cond = threading.Condition()
+        # مفتاح -> طابور المهام المنتظرة خلف المهمة الجارية لنفس المفتاح
+        self._chains = {}
+        self._pending = 0
+        self._running = 0
+        self._rejected = 0
+        self._shutdown = False
+
+        self.queue_wait = LatencyHistogram()
+        self.handler_latency = {}
+        self._latency_lock = threading.Lock()
+
+    def _histogram(self, name):
+        with self._latency_lock:
+            histogram = self.handler_latency.get(name)
+            if histogram is None:
+                histogram = self.handler_latency[name] = LatencyHistogram()
+            return histogram
+
+    def submit(self, key, name, fn, *args, timeout=None):
+        """جدولة مهمة؛ تنتظر حتى يتوفر مكان في الطابور وتعيد False عند انتهاء المهلة"""
+        task = (name, fn, args, time.monotonic())
+        with self._cond:
+            # الضغط العكسي: عدم قبول تحديثات جديدة قبل تفريغ جزء من الطابور
+            if not self._cond.wait_for(
+                lambda: self._shutdown or self._pending < self.max_pending, timeout
+            ) or self._shutdown:
+                self._rejected += 1
+                return False
+            self._pending += 1
+            chain = self._chains.get(key)
+            if chain is not None:
+                # مهمة لنفس المستخدم قيد التنفيذ: تنتظر دورها بالترتيب
+                chain.append(task)
+                return True
+            self._chains[key] = deque()
+        self._executor.submit(self._drain, key, task)
+        return True
+
+    def _drain(self, key, task):
+        """تنفيذ مهام المفتاح الواحد بالتتابع حتى يفرغ طابوره"""
+        while task is not None:
+            name, fn, args, enqueued_at = task
+            started = time.monotonic()
+            with self._cond:
+                self._pending -= 1
+                self._running += 1
+                self._cond.notify()
+            self.queue_wait.observe(started - enqueued_at)
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception(f"خطأ غير متوقع في معالج البوت {name}")
+            finally:
+                self._histogram(name).observe(time.monotonic() - started)
+                with self._cond:
+                    self._running -= 1
+                    chain = self._chains[key]
+                    if chain:
+                        task = chain.popleft()
+                    else:
+                        del self._chains[key]
+                        task = None
+
+    def shutdown(self, wait=True):
+        """إيقاف المجمع بعد إنهاء المهام الجارية"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        """مقاييس الضغط العكسي: طول الطابور والمهام الجارية وزمن المعالجة لكل أمر"""
+        with self._cond:
+            stats = {
+                "workers": self.workers,
+                "queue_length": self._pending,
+                "running": self._running,
+                "active_users": len(self._chains),
+                "rejected": self._rejected,
+            }
+        stats["queue_wait"] = self.queue_wait.snapshot()
+        with self._latency_lock:
+            histograms = dict(self.handler_latency)
+        stats["handler_latency"] = {name: h.snapshot() for name, h in histograms.items()}
+        return stats
+
+
+def _update_user_key(update):
+    """مفتاح الترتيب: معرف المستخدم أو المحادثة صاحبة التحديث"""
+    if update is not None:
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+def run_concurrently(pool, callback, name=None, timeout=None):
+    """تغليف معالج بوت ليعمل في مجمع العمال مع الحفاظ على ترتيب تحديثات المستخدم الواحد"""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    def wrapper(update, context, *args):
+        key = _update_user_key(update)
+        if not pool.submit(key, name, callback, update, context, *args, timeout=timeout):
+            logger.warning(f"تم رفض تحديث للمعالج {name}: طابور المعالجة ممتلئ")
+
+    return wrapper
@@ -0,0 +1,296 @@
+import itertools
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from config import CACHE_BACKEND, CACHE_REDIS_URL, USER_CACHE_MAX_SIZE, USER_CACHE_TTL
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class CacheBackend:
+    """الواجهة المشتركة لواجهات التخزين المؤقت الخلفية"""
+
+    # shared: القيم مشتركة بين العمليات (فلا تحتاج إبطالًا من العمليات الأخرى)
+    # blocking: الاستدعاءات عبر الشبكة فيجب تنفيذها خارج حلقة الأحداث في الطبقة غير المتزامنة
+    shared = False
+    blocking = False
+
+    def get(self, key):
+        """إرجاع (هل وُجد، القيمة)"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def begin_fill(self, key):
+        """بدء تحميل قيمة مفقودة وإرجاع رمز يُمرر إلى fill"""
+        return None
+
+    def fill(self, key, value, token, ttl=None):
+        """تخزين قيمة محملة من المصدر ما لم تُبطل أثناء التحميل (None تنهي التحميل دون تخزين)"""
+        if value is not None:
+            self.set(key, value, ttl)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """قراءة عبر التخزين المؤقت: إرجاع القيمة المخزنة أو تحميلها وتخزينها"""
+        hit, value = self.get(key)
+        if hit:
+            return value
+        token = self.begin_fill(key)
+        value = None
+        try:
+            value = loader()
+        finally:
+            self.fill(key, value, token, ttl)
+        return value
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class LocalLRUCache(CacheBackend):
+    """تخزين مؤقت محلي محدود الحجم (LRU) مع مدة صلاحية، آمن بين الثريدات"""
+
+    def __init__(self, max_size=10000, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # رموز التحميل الجارية: الإبطال يحذف الرمز فيُرفض تخزين القيمة القديمة
+        self._fills = {}
+        self._tokens = itertools.count(1)
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._stale_fills = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self._misses += 1
+                return False, None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return True, value
+
+    def _store(self, key, value, ttl):
+        """تخزين قيمة مع إخلاء الأقدم استخدامًا عند الامتلاء (يُستدعى مع حيازة القفل)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self._evictions += 1
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._fills.pop(key, None)
+            self._store(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._fills.pop(key, None)
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._fills.clear()
+
+    def begin_fill(self, key):
+        with self._lock:
+            token = next(self._tokens)
+            self._fills[key] = token
+            return token
+
+    def fill(self, key, value, token, ttl=None):
+        with self._lock:
+            if value is None:
+                if self._fills.get(key) == token:
+                    del self._fills[key]
+                return
+            if self._fills.get(key) != token:
+                # أُبطل المفتاح أثناء التحميل فالقيمة قد تكون قديمة
+                self._stale_fills += 1
+                return
+            del self._fills[key]
+            self._store(key, value, ttl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "local",
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+                "stale_fills": self._stale_fills,
+            }
+
+
+class RedisCache(CacheBackend):
+    """تخزين مؤقت مشترك على خادم متوافق مع Redis لعمليات متعددة
+
+    لكل مفتاح عداد جيل يزيده الإبطال؛ التحميل يحفظ الجيل عند بدئه ولا يُخزن ناتجه إلا إذا
+    لم يتغير الجيل (فحص وكتابة ذريان بسكربت Lua)، فلا تعيد قراءة بدأت قبل الإبطال القيمة القديمة.
+    """
+
+    shared = True
+    blocking = True
+
+    # KEYS: المفتاح، عداد الجيل. ARGV: الجيل عند بدء التحميل، القيمة، المدة بالمللي ثانية
+    _FILL_SCRIPT = '''
+        if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+            redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+            return 1
+        end
+        return 0
+    '''
+
+    def __init__(self, url, ttl=30.0, prefix="ff:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("حزمة redis غير مثبتة؛ ثبّتها لاستخدام CACHE_BACKEND=redis") from e
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._fill_script = self._client.register_script(self._FILL_SCRIPT)
+        # عداد الجيل يبقى أطول بكثير من أي تحميل حتى لا ينتهي بين بدء التحميل وتخزينه
+        self._generation_ttl_ms = int(max(60.0, ttl * 10) * 1000)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._stale_fills = 0
+        self._errors = 0
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def _generation_key(self, key):
+        return f"{self.prefix}gen:{key}"
+
+    def get(self, key):
+        try:
+            raw = self._client.get(self._key(key))
+        except Exception as e:
+            logger.warning(f"خطأ في قراءة التخزين المؤقت: {e}")
+            with self._lock:
+                self._errors += 1
+                self._misses += 1
+            return False, None
+        with self._lock:
+            if raw is None:
+                self._misses += 1
+                return False, None
+            self._hits += 1
+        return True, pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            self._client.set(self._key(key), pickle.dumps(value), px=int(ttl * 1000))
+        except Exception as e:
+            logger.warning(f"خطأ في الكتابة إلى التخزين المؤقت: {e}")
+            with self._lock:
+                self._errors += 1
+
+    def delete(self, key):
+        try:
+            pipeline = self._client.pipeline()
+            pipeline.delete(self._key(key))
+            pipeline.incr(self._generation_key(key))
+            pipeline.pexpire(self._generation_key(key), self._generation_ttl_ms)
+            pipeline.execute()
+            with self._lock:
+                self._invalidations += 1
+        except Exception as e:
+            logger.warning(f"خطأ في إبطال التخزين المؤقت: {e}")
+            with self._lock:
+                self._errors += 1
+
+    def clear(self):
+        for key in self._client.scan_iter(match=f"{self.prefix}*"):
+            self._client.delete(key)
+
+    def begin_fill(self, key):
+        try:
+            return self._client.get(self._generation_key(key)) or b"0"
+        except Exception as e:
+            logger.warning(f"خطأ في قراءة جيل التخزين المؤقت: {e}")
+            with self._lock:
+                self._errors += 1
+            return None
+
+    def fill(self, key, value, token, ttl=None):
+        if value is None or token is None:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            stored = self._fill_script(
+                keys=[self._key(key), self._generation_key(key)],
+                args=[token, pickle.dumps(value), int(ttl * 1000)]
+            )
+        except Exception as e:
+            logger.warning(f"خطأ في الكتابة إلى التخزين المؤقت: {e}")
+            with self._lock:
+                self._errors += 1
+            return
+        if not stored:
+            # أُبطل المفتاح أثناء التحميل فالقيمة قد تكون قديمة
+            with self._lock:
+                self._stale_fills += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "redis",
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": 0,
+                "invalidations": self._invalidations,
+                "stale_fills": self._stale_fills,
+                "errors": self._errors,
+            }
+
+
+def create_cache(backend=CACHE_BACKEND, max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL, prefix="ff:"):
+    """إنشاء واجهة التخزين المؤقت حسب الإعدادات"""
+    if backend == "redis":
+        return RedisCache(CACHE_REDIS_URL, ttl=ttl, prefix=prefix)
+    if backend != "local":
+        raise ValueError(f"واجهة تخزين مؤقت غير معروفة: {backend}")
+    return LocalLRUCache(max_size=max_size, ttl=ttl)
+
+
+# التخزين المؤقت لملفات المستخدمين (get_user) المشترك بين البوت وخادم API
+user_cache = create_cache(prefix="ff:user:")
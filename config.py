@@ -29,3 +29,111 @@ SOCIAL_MEDIA_LINKS = {
     "website": "http://www.forexfabric.com/",
     "support": "http://t.me/ForexFabric_support"
 }
+
+# إعدادات تجمع اتصالات قاعدة البيانات
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))  # مهلة انتظار اتصال متاح (بالثواني)
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "300"))  # إخلاء الاتصالات الخاملة بعد هذه المدة
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))  # فحص الاتصال الخامل لأكثر من هذه المدة قبل استعارته
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "3600"))  # إعادة تدوير الاتصال بعد هذه المدة
+
+# إعدادات تجمع الاتصالات غير المتزامن لخادم API
+ASYNC_DB_POOL_MIN_SIZE = int(os.environ.get("ASYNC_DB_POOL_MIN_SIZE", "2"))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get("ASYNC_DB_POOL_MAX_SIZE", "20"))
+
+# لوحة المتصدرين في الذاكرة: مدة إعادة المزامنة الكاملة مع قاعدة البيانات (بالثواني، 0 لتعطيلها)
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get("LEADERBOARD_REFRESH_SECONDS", "300"))
+
+# التخزين المؤقت لملفات المستخدمين: "local" داخل العملية أو "redis" لمشاركته بين عدة عمليات
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "local")
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+USER_CACHE_MAX_SIZE = int(os.environ.get("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "30"))  # بالثواني
+
+# سجل النشاطات: الحد الأقصى لحجم الصفحة وحجم دفعة التصدير من المؤشر على الخادم
+ACTIVITIES_MAX_PAGE_SIZE = int(os.environ.get("ACTIVITIES_MAX_PAGE_SIZE", "100"))
+ACTIVITIES_EXPORT_BATCH_SIZE = int(os.environ.get("ACTIVITIES_EXPORT_BATCH_SIZE", "1000"))
+
+# كاتب سجل النشاطات: "sync" داخل معاملة العملية الأصلية (اتساق صارم) أو "buffered" لكتابة النشاطات على دفعات
+ACTIVITY_WRITER_MODE = os.environ.get("ACTIVITY_WRITER_MODE", "sync")
+ACTIVITY_WRITER_BATCH_SIZE = int(os.environ.get("ACTIVITY_WRITER_BATCH_SIZE", "500"))
+ACTIVITY_WRITER_FLUSH_INTERVAL = float(os.environ.get("ACTIVITY_WRITER_FLUSH_INTERVAL", "1.0"))  # بالثواني
+ACTIVITY_WRITER_MAX_QUEUE = int(os.environ.get("ACTIVITY_WRITER_MAX_QUEUE", "50000"))
+ACTIVITY_WRITER_MAX_RETRIES = int(os.environ.get("ACTIVITY_WRITER_MAX_RETRIES", "3"))  # محاولات الدفعة الفاشلة قبل عزل صفوفها المرفوضة
+
+# التزامن في بوت تيليجرام: عدد العمال والحد الأقصى للتحديثات المنتظرة قبل الضغط العكسي
+# يُفضل ألا يتجاوز BOT_WORKERS قيمة DB_POOL_MAX_SIZE
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "8"))
+BOT_MAX_PENDING_UPDATES = int(os.environ.get("BOT_MAX_PENDING_UPDATES", "1000"))
+BOT_ENQUEUE_TIMEOUT = float(os.environ.get("BOT_ENQUEUE_TIMEOUT", "5"))  # مهلة انتظار مكان في الطابور (بالثواني)
+
+# طريقة استقبال تحديثات تيليجرام: "polling" (افتراضيًا) أو "webhook" عبر خادم FastAPI
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")  # العنوان العام لخادم API، مثل https://example.com
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")  # مطلوب في وضع الـ webhook: جزء سري في المسار وقيمة ترويسة X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_AUTO_SET = os.environ.get("WEBHOOK_AUTO_SET", "1") == "1"  # تسجيل الـ webhook لدى تيليجرام عند البدء
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org/bot")  # يمكن توجيهه إلى خادم تيليجرام وهمي للاختبار
+
+# إعدادات تشغيل خادم API
+API_HOST = os.environ.get("API_HOST", "0.0.0.0")
+API_PORT = int(os.environ.get("API_PORT", "5000"))
+API_WORKERS = int(os.environ.get("API_WORKERS", "1"))  # عدد عمليات خادم API (كل عملية بتجمع اتصالات وتخزين مؤقت خاص بها)
+API_SHUTDOWN_TIMEOUT = int(os.environ.get("API_SHUTDOWN_TIMEOUT", "10"))  # مهلة إنهاء الطلبات الجارية عند الإيقاف (اتصالات SSE لا تنتهي من تلقاء نفسها)
+
+# تحديد معدل مسارات الكتابة (المطالبة اليومية، زيارة المواقع، السحب) بدلاء الرموز
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "local")  # "local" لكل عملية أو "redis" مشترك بين العمليات
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", CACHE_REDIS_URL)
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_USER_RATE = float(os.environ.get("RATE_LIMIT_USER_RATE", "0.5"))  # رموز بالثانية لكل مستخدم وإجراء
+RATE_LIMIT_USER_BURST = int(os.environ.get("RATE_LIMIT_USER_BURST", "5"))
+RATE_LIMIT_IP_RATE = float(os.environ.get("RATE_LIMIT_IP_RATE", "5"))  # رموز بالثانية لكل عنوان IP وإجراء
+RATE_LIMIT_IP_BURST = int(os.environ.get("RATE_LIMIT_IP_BURST", "30"))
+RATE_LIMIT_GLOBAL_RATE = float(os.environ.get("RATE_LIMIT_GLOBAL_RATE", "0"))  # سقف عام لمجموع طلبات الكتابة (0 لتعطيله)
+RATE_LIMIT_GLOBAL_BURST = int(os.environ.get("RATE_LIMIT_GLOBAL_BURST", "500"))
+TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS", "0") == "1"  # أخذ عنوان العميل من X-Forwarded-For خلف وكيل عكسي
+
+# التخزين المؤقت والضغط لاستجابات HTTP
+STATIC_COMPRESS_MIN_SIZE = int(os.environ.get("STATIC_COMPRESS_MIN_SIZE", "512"))  # أصغر ملف ثابت يُضغط مسبقًا (بالبايت)
+JSON_COMPRESS_MIN_SIZE = int(os.environ.get("JSON_COMPRESS_MIN_SIZE", "1024"))  # أصغر استجابة JSON تُضغط بـ gzip (بالبايت)
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")  # "auto" (orjson إن توفر) أو "orjson" أو "stdlib"
+
+# منع تكرار طلبات السحب
+IDEMPOTENCY_KEY_MAX_LENGTH = 255  # مطابق لطول العمود idempotency_keys.idempotency_key
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", "24"))  # مدة الاحتفاظ بالمفاتيح قبل حذفها بمهمة الصيانة
+
+# منح النقاط بالجملة (grants.py)
+GRANT_CHUNK_SIZE = int(os.environ.get("GRANT_CHUNK_SIZE", "5000"))  # عدد الصفوف في كل دفعة COPY ومعاملة
+
+# مقاييس الأداء (metrics.py)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"  # تسجيل زمن طلبات HTTP وعرض /metrics
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")  # إن عُيّن يُطلب في الترويسة Authorization: Bearer لقراءة /metrics
+BOT_METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", "0"))  # منفذ /metrics لعملية البوت في وضع polling (0 لتعطيله)
+
+# تقسيم سجل النشاطات وأرشفته (ledger.py)
+ACTIVITIES_PARTITION_MONTHS_AHEAD = int(os.environ.get("ACTIVITIES_PARTITION_MONTHS_AHEAD", "3"))  # أقسام شهرية تُنشأ مسبقًا للأشهر القادمة
+ACTIVITIES_RETENTION_MONTHS = int(os.environ.get("ACTIVITIES_RETENTION_MONTHS", "12"))  # الأقسام الأقدم تُؤرشف إلى ملفات ثم تُحذف
+ACTIVITIES_ARCHIVE_DIR = os.environ.get("ACTIVITIES_ARCHIVE_DIR", "archive/activities")  # مجلد ملفات الأرشيف المضغوطة
+ACTIVITY_SUMMARY_MAX_DAYS = int(os.environ.get("ACTIVITY_SUMMARY_MAX_DAYS", "365"))  # أقصى مدة لملخص النشاطات في /api/activities/{id}/summary
+
+# التحديثات المباشرة عبر Server-Sent Events (live_updates.py)
+LIVE_UPDATES_ENABLED = os.environ.get("LIVE_UPDATES_ENABLED", "1") == "1"  # قناة /api/live/{user_id} لتحديثات الرصيد والنشاطات ولوحة المتصدرين
+LIVE_UPDATES_NOTIFY = os.environ.get("LIVE_UPDATES_NOTIFY", "1") == "1"  # نقل التحديثات بين العمليات عبر LISTEN/NOTIFY في PostgreSQL
+LIVE_UPDATES_CHANNEL = os.environ.get("LIVE_UPDATES_CHANNEL", "points_updates")  # اسم قناة NOTIFY
+LIVE_MAX_CONNECTIONS = int(os.environ.get("LIVE_MAX_CONNECTIONS", "50000"))  # أقصى عدد اتصالات مباشرة لكل عملية API
+LIVE_MAX_PENDING_EVENTS = int(os.environ.get("LIVE_MAX_PENDING_EVENTS", "32"))  # أحداث معلقة لكل اتصال قبل مطالبة العميل بإعادة المزامنة
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get("LIVE_HEARTBEAT_SECONDS", "25"))  # فاصل نبض الاتصالات الخاملة عبر الوكلاء
+LIVE_LEADERBOARD_INTERVAL = float(os.environ.get("LIVE_LEADERBOARD_INTERVAL", "2"))  # أقل فاصل بين بثين لتغير أعلى المتصدرين
+LIVE_LEADERBOARD_SIZE = int(os.environ.get("LIVE_LEADERBOARD_SIZE", "10"))  # عدد المتصدرين في حدث leaderboard
+LIVE_PRESENCE_INTERVAL = float(os.environ.get("LIVE_PRESENCE_INTERVAL", "2"))  # فاصل تحديث حضور الاشتراكات بين العمليات لتخطي NOTIFY عند غيابها
+
+# شبكة الإحالات وكشف الاحتيال (referral_graph.py و referral_fraud.py)
+REFERRAL_GRAPH_REFRESH_SECONDS = int(os.environ.get("REFERRAL_GRAPH_REFRESH_SECONDS", "600"))  # إعادة بناء فهرس الإحالات في الذاكرة لالتقاط إحالات العمليات الأخرى (0 لتعطيلها)
+REFERRAL_TREE_MAX_DEPTH = int(os.environ.get("REFERRAL_TREE_MAX_DEPTH", "10"))  # أقصى عدد مستويات في /api/referrals/{id}/tree
+REFERRAL_TOP_MAX_HOURS = int(os.environ.get("REFERRAL_TOP_MAX_HOURS", "720"))  # أقصى نافذة زمنية لأعلى المحيلين
+REFERRAL_FRAUD_BURST_MINUTES = int(os.environ.get("REFERRAL_FRAUD_BURST_MINUTES", "10"))  # نافذة رصد اندفاع الإحالات
+REFERRAL_FRAUD_BURST_LIMIT = int(os.environ.get("REFERRAL_FRAUD_BURST_LIMIT", "10"))  # إحالات حسابات جديدة في النافذة تعد اندفاعًا كاملًا
+REFERRAL_FRAUD_FRESH_MINUTES = int(os.environ.get("REFERRAL_FRAUD_FRESH_MINUTES", "60"))  # عمر الحساب عند إحالته الذي يعد فيه جديدًا
+REFERRAL_FRAUD_MIN_REFERRALS = int(os.environ.get("REFERRAL_FRAUD_MIN_REFERRALS", "5"))  # أقل عدد إحالات مباشرة لتقييم المحيل
+REFERRAL_FRAUD_THRESHOLD = float(os.environ.get("REFERRAL_FRAUD_THRESHOLD", "0.6"))  # الدرجة التي يُعلَّم عندها المحيل مشبوهًا
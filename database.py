@@ -1,14 +1,37 @@
 import logging
+import math
 import time
 import os
+import threading
 import psycopg2
 import psycopg2.extras
 import json
+import base64
+import hashlib
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 from config import (
-    DATABASE_URL, DAILY_POINTS, REFERRAL_POINTS, TASK_POINTS, 
-    DAILY_CLAIM_COOLDOWN, SOCIAL_MEDIA_POINTS, SOCIAL_MEDIA_LINKS
+    DATABASE_URL, DAILY_POINTS, REFERRAL_POINTS,
+    DAILY_CLAIM_COOLDOWN, SOCIAL_MEDIA_POINTS, SOCIAL_MEDIA_LINKS,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE,
+    DB_POOL_HEALTH_CHECK_INTERVAL, DB_POOL_MAX_LIFETIME, ACTIVITIES_EXPORT_BATCH_SIZE,
+    ACTIVITY_WRITER_MODE, ACTIVITY_WRITER_BATCH_SIZE, ACTIVITY_WRITER_FLUSH_INTERVAL,
+    ACTIVITY_WRITER_MAX_QUEUE, ACTIVITY_WRITER_MAX_RETRIES, IDEMPOTENCY_KEY_TTL_HOURS, LIVE_UPDATES_ENABLED, LIVE_UPDATES_NOTIFY,
+    LIVE_UPDATES_CHANNEL, LIVE_MAX_CONNECTIONS, LIVE_MAX_PENDING_EVENTS, LIVE_LEADERBOARD_INTERVAL,
+    LIVE_LEADERBOARD_SIZE, LIVE_PRESENCE_INTERVAL
 )
+from db_pool import ConnectionPool
+from metrics import registry, timed, db_query_seconds, db_pool_acquire_seconds
+from leaderboard import leaderboard
+from referral_graph import referral_graph
+from cache import user_cache
+from activity_writer import ActivityWriter
+from live_updates import LiveHub
+from singleflight import SingleFlight, forget_user
+import json_backend
+
+# قراءة أعمدة JSONB بواجهة JSON السريعة في كل الاتصالات
+psycopg2.extras.register_default_jsonb(globally=True, loads=json_backend.loads)
 
 # إعداد السجلات
 logging.basicConfig(
@@ -17,79 +40,133 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """الحصول على تجمع الاتصالات المشترك (يُنشأ مرة واحدة لكل عملية)"""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        # الاتصالات لا تُشارك بين العمليات بعد fork
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                max_idle=DB_POOL_MAX_IDLE,
+                health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                on_acquire=db_pool_acquire_seconds.labels("sync").observe,
+            )
+        return _pool
+
+def get_pool_stats():
+    """مقاييس تجمع الاتصالات (المستعارة، المنتظرة، المنشأة، المعاد تدويرها)"""
+    return get_pool().stats()
+
+def close_pool():
+    """إغلاق تجمع الاتصالات عند إيقاف التطبيق"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+@contextmanager
 def get_db_connection():
-    """مدير السياق للحصول على اتصال قاعدة البيانات"""
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        return conn
-    except Exception as e:
-        logger.error(f"خطأ في الاتصال بقاعدة البيانات: {e}")
-        raise
+    """مدير السياق للحصول على اتصال من التجمع (تثبيت المعاملة عند النجاح والتراجع عند الخطأ)"""
+    with get_pool().connection() as conn:
+        yield conn
 
+@contextmanager
 def get_db_cursor():
     """مدير السياق للحصول على مؤشر قاعدة البيانات"""
-    conn = get_db_connection()
-    return conn, conn.cursor()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            yield conn, cursor
+
+# كاتب النشاطات المشترك بين ثريد البوت وثريد خادم API
+activity_writer = ActivityWriter(
+    get_db_connection,
+    mode=ACTIVITY_WRITER_MODE,
+    batch_size=ACTIVITY_WRITER_BATCH_SIZE,
+    flush_interval=ACTIVITY_WRITER_FLUSH_INTERVAL,
+    max_queue=ACTIVITY_WRITER_MAX_QUEUE,
+    max_retries=ACTIVITY_WRITER_MAX_RETRIES,
+)
+
+# موزع التحديثات المباشرة لعملاء /api/live (يُربط بحلقة أحداث خادم API عند بدئه)
+live_hub = LiveHub(
+    get_db_connection,
+    DATABASE_URL,
+    channel=LIVE_UPDATES_CHANNEL,
+    enabled=LIVE_UPDATES_ENABLED,
+    notify=LIVE_UPDATES_NOTIFY,
+    max_connections=LIVE_MAX_CONNECTIONS,
+    max_pending=LIVE_MAX_PENDING_EVENTS,
+    leaderboard_interval=LIVE_LEADERBOARD_INTERVAL,
+    leaderboard_size=LIVE_LEADERBOARD_SIZE,
+    presence_interval=LIVE_PRESENCE_INTERVAL,
+)
+
+def _log_activity(cursor, user_id, activity_type, points, details=None, allow_buffer=True):
+    """تسجيل نشاط عبر طابور الكاتب أو داخل المعاملة الحالية حسب وضع الكاتب
+
+    allow_buffer=False يفرض الكتابة داخل المعاملة (قيود الدفتر التي يجب أن تُثبَّت مع العملية).
+    """
+    if allow_buffer and activity_writer.buffered and activity_writer.enqueue(user_id, activity_type, points, details):
+        return
+    cursor.execute(
+        'INSERT INTO activities (user_id, activity_type, points, details) VALUES (%s, %s, %s, %s)',
+        (user_id, activity_type, points, json_backend.dumps(details if details is not None else {}))
+    )
+
+def get_activity_writer_stats():
+    """مقاييس كاتب النشاطات (عمق الطابور وزمن التفريغ)"""
+    return activity_writer.stats()
+
+def after_points_change(user_id, points, total_points, username=None, activity=None, invalidate_cache=True):
+    """تحديث الحالة في الذاكرة بعد أي تغيير في نقاط المستخدم ونشره للعملاء المتصلين
+
+    activity: (النوع، النقاط، التفاصيل) للنشاط المسبب للتغيير إن وُجد.
+    invalidate_cache=False عندما أبطل المستدعي ملف المستخدم بنفسه (الطبقة غير المتزامنة).
+    """
+    # إبطال ملف المستخدم المخزن مؤقتًا قبل أي تحديث آخر
+    if invalidate_cache:
+        user_cache.delete(user_id)
+    # القراءات الجارية للمستخدم بدأت قبل الكتابة فلا يشاركها المستدعون الجدد
+    forget_user(user_id)
+    if leaderboard.loaded:
+        leaderboard.update(user_id, points, total_points, username)
+    live_hub.publish_points(user_id, points, total_points, activity)
+
+# دمج القراءات المتطابقة المتزامنة من ثريدات البوت في استعلام واحد
+read_flights = SingleFlight("database")
+
+# زمن دوال الوصول العامة كما يراه المستدعي (يشمل التخزين المؤقت والدمج)
+timed_query = timed(db_query_seconds, "sync")
+
+def get_read_coalescing_stats():
+    """عدادات دمج القراءات (الاستعلامات المنفذة والاستدعاءات المدموجة لكل دالة)"""
+    return read_flights.stats()
 
 def create_table():
-    """إنشاء جداول قاعدة البيانات إذا لم تكن موجودة"""
-    conn, cur = get_db_cursor()
+    """تهيئة مخطط قاعدة البيانات بتطبيق الترحيلات المعلقة (انظر migrations.py)"""
+    from migrations import run_migrations
     try:
-        # جدول المستخدمين
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username VARCHAR(255) NOT NULL,
-                full_name VARCHAR(255),
-                points INTEGER DEFAULT 0,
-                total_points INTEGER DEFAULT 0,
-                last_claim_time TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # جدول الإحالات
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS referrals (
-                id SERIAL PRIMARY KEY,
-                referrer_id BIGINT REFERENCES users(user_id),
-                referred_id BIGINT REFERENCES users(user_id),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(referrer_id, referred_id)
-            )
-        ''')
-
-        # جدول النشاطات
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS activities (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT REFERENCES users(user_id),
-                activity_type VARCHAR(50) NOT NULL,
-                points INTEGER NOT NULL,
-                details JSONB DEFAULT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # جدول مواقع التواصل الاجتماعي
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS social_media_visits (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT REFERENCES users(user_id),
-                social_type VARCHAR(50) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, social_type)
-            )
-        ''')
-
-        logger.info("تم إنشاء جداول قاعدة البيانات بنجاح")
+        run_migrations()
+        # أقسام سجل النشاطات للشهر الحالي والأشهر القادمة (تُستكمل أيضًا بمهمة الصيانة الدورية)
+        from ledger import ensure_activity_partitions
+        ensure_activity_partitions()
+        logger.info("تم تهيئة جداول قاعدة البيانات بنجاح")
     except Exception as e:
         logger.error(f"خطأ في إنشاء الجداول: {e}")
-    finally:
-        cur.close()
-        conn.close()
 
+@timed_query
 def add_user(user_id, username, full_name=None):
     """إضافة مستخدم جديد إلى قاعدة البيانات أو تجاهله إذا كان موجودًا بالفعل"""
     try:
@@ -101,17 +178,30 @@ def add_user(user_id, username, full_name=None):
                     VALUES (%s, %s, %s, 0, 0)
                     ON CONFLICT (user_id) 
                     DO UPDATE SET username = %s, full_name = COALESCE(%s, users.full_name)
+                    RETURNING points, total_points
                     ''',
                     (user_id, username, full_name, username, full_name)
                 )
+                points, total_points = cursor.fetchone()
+                after_points_change(user_id, points, total_points, username)
                 logger.info(f"تمت إضافة المستخدم {user_id} ({username}) أو هو موجود بالفعل")
                 return True
     except Exception as e:
         logger.error(f"خطأ في إضافة المستخدم: {e}")
         return False
 
+@timed_query
 def get_user(user_id):
-    """الحصول على بيانات المستخدم من قاعدة البيانات"""
+    """الحصول على بيانات المستخدم (قراءة عبر التخزين المؤقت ثم قاعدة البيانات)"""
+    hit, cached = user_cache.get(user_id)
+    if hit:
+        return cached
+    return _load_user(user_id)
+
+@read_flights.wrap()
+def _load_user(user_id):
+    """تحميل ملف المستخدم من قاعدة البيانات وتخزينه مؤقتًا"""
+    token = user_cache.begin_fill(user_id)
     try:
         with get_db_cursor() as (conn, cursor):
             cursor.execute(
@@ -119,11 +209,69 @@ def get_user(user_id):
                 (user_id,)
             )
             result = cursor.fetchone()
-        return result
     except Exception as e:
         logger.error(f"خطأ في الحصول على بيانات المستخدم: {e}")
+        result = None
+
+    user_cache.fill(user_id, result, token)
+    return result
+
+def get_user_cache_stats():
+    """عدادات التخزين المؤقت لملفات المستخدمين (الإصابات، الإخفاقات، الإخلاءات)"""
+    return user_cache.stats()
+
+@timed_query
+@read_flights.wrap()
+def get_user_dashboard(user_id):
+    """الحصول على بيانات لوحة المستخدم (الرصيد، الإحالات، أهلية المطالبة، الزيارات) باستعلام واحد للقراءة فقط"""
+    try:
+        with get_db_cursor() as (conn, cursor):
+            cursor.execute(
+                '''
+                SELECT u.points, u.total_points, u.last_claim_time, u.username, u.full_name,
+                       u.referrals_count,
+                       -- الشرط نفسه الذي يستخدمه UPDATE في daily_claim والتقريب نفسه (CEIL)
+                       CASE
+                           WHEN u.last_claim_time IS NULL
+                                OR u.last_claim_time <= (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %(cooldown)s)
+                           THEN 0
+                           ELSE CEIL(%(cooldown)s - EXTRACT(EPOCH FROM ((NOW() AT TIME ZONE 'UTC') - u.last_claim_time)))::INTEGER
+                       END AS next_claim_time,
+                       COALESCE(
+                           (SELECT array_agg(v.social_type) FROM social_media_visits v WHERE v.user_id = u.user_id),
+                           '{}'
+                       ) AS visited_socials
+                FROM users u
+                WHERE u.user_id = %(user_id)s
+                ''',
+                {'user_id': user_id, 'cooldown': DAILY_CLAIM_COOLDOWN}
+            )
+            result = cursor.fetchone()
+
+        if not result:
+            return None
+
+        return _dashboard_from_row(result)
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على لوحة المستخدم: {e}")
         return None
 
+def _dashboard_from_row(row):
+    """تحويل صف استعلام لوحة المستخدم إلى قاموس"""
+    points, total_points, last_claim, username, full_name, referrals_count, next_claim_time, visited_socials = row
+    return {
+        'points': points,
+        'total_points': total_points,
+        'last_claim_time': last_claim,
+        'username': username,
+        'full_name': full_name,
+        'referrals_count': referrals_count,
+        'can_claim': next_claim_time == 0,
+        'next_claim_time': next_claim_time,
+        'visited_socials': list(visited_socials),
+    }
+
+@timed_query
 def update_points(user_id, points_to_add, activity_type, details=None):
     """تحديث نقاط المستخدم وإضافة نشاط جديد"""
     try:
@@ -140,12 +288,10 @@ def update_points(user_id, points_to_add, activity_type, details=None):
                 if details is None:
                     details = {}
                 
-                cursor.execute(
-                    'INSERT INTO activities (user_id, activity_type, points, details) VALUES (%s, %s, %s, %s)',
-                    (user_id, activity_type, points_to_add, json.dumps(details))
-                )
+                _log_activity(cursor, user_id, activity_type, points_to_add, details)
                 
                 conn.commit()
+                after_points_change(user_id, new_points, total_points, activity=(activity_type, points_to_add, details))
                 
                 logger.info(f"تم تحديث نقاط المستخدم {user_id}: +{points_to_add} نقطة من النشاط {activity_type}")
                 
@@ -158,50 +304,80 @@ def update_points(user_id, points_to_add, activity_type, details=None):
         logger.error(f"خطأ في تحديث النقاط: {e}")
         return False, str(e)
 
+# إدراج نشاط المطالبة داخل نفس العبارة في وضع الكتابة المتزامن
+_DAILY_CLAIM_LOGGED_CTE = ''', logged AS (
+                    INSERT INTO activities (user_id, activity_type, points, details)
+                    SELECT %(user_id)s, 'daily_claim', %(points)s,
+                           jsonb_build_object('claim_time', to_char(last_claim_time, 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'))
+                    FROM claimed
+                )'''
+
+@timed_query
 def daily_claim(user_id):
-    """معالجة المطالبة اليومية بالنقاط"""
-    # الحصول على بيانات المستخدم
-    user_data = get_user(user_id)
-    if not user_data:
-        return None, None
-    
-    # التحقق مما إذا كان يمكن للمستخدم المطالبة بالمكافأة اليومية
-    can_claim, claim_info = can_claim_daily(user_id)
-    
-    if not can_claim:
-        return False, claim_info
-    
-    # إضافة النقاط للمستخدم وتحديث وقت آخر مطالبة
+    """معالجة المطالبة اليومية بالنقاط بعبارة شرطية واحدة (تُمنح مرة واحدة فقط حتى مع الطلبات المتزامنة)"""
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                # تحديث النقاط ووقت آخر مطالبة
-                current_time = datetime.now(timezone.utc)
-                cursor.execute(
-                    'UPDATE users SET points = points + %s, total_points = total_points + %s, last_claim_time = %s WHERE user_id = %s RETURNING points, total_points',
-                    (DAILY_POINTS, DAILY_POINTS, current_time, user_id)
-                )
-                new_points, total_points = cursor.fetchone()
-                
-                # تسجيل نشاط المطالبة اليومية
-                cursor.execute(
-                    'INSERT INTO activities (user_id, activity_type, points, details) VALUES (%s, %s, %s, %s)',
-                    (user_id, 'daily_claim', DAILY_POINTS, json.dumps({'claim_time': current_time.isoformat()}))
-                )
-                
-                conn.commit()
-                
-                logger.info(f"تم منح المستخدم {user_id} المكافأة اليومية: {DAILY_POINTS} نقطة")
-                
-                return True, {
-                    'points': new_points,
-                    'total_points': total_points,
-                    'points_added': DAILY_POINTS
-                }
+        with get_db_cursor() as (conn, cursor):
+            # شرط فترة الانتظار جزء من UPDATE نفسه، لذا لا يمر إلا طلب واحد عند التزامن
+            cursor.execute(
+                '''
+                WITH claimed AS (
+                    UPDATE users
+                    SET points = points + %(points)s,
+                        total_points = total_points + %(points)s,
+                        last_claim_time = NOW() AT TIME ZONE 'UTC'
+                    WHERE user_id = %(user_id)s
+                      AND (last_claim_time IS NULL
+                           OR last_claim_time <= (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %(cooldown)s))
+                    RETURNING points, total_points, last_claim_time
+                ){logged_cte}
+                SELECT TRUE, c.points, c.total_points, NULL::INTEGER, c.last_claim_time
+                FROM claimed c
+                UNION ALL
+                SELECT FALSE, u.points, u.total_points,
+                       CASE
+                           -- اللقطة تقول إن المستخدم مؤهل عند بدء العبارة ومع ذلك فشل UPDATE:
+                           -- مطالبة متزامنة سبقتنا فبدأت فترة الانتظار للتو
+                           WHEN u.last_claim_time IS NULL
+                                OR u.last_claim_time <= (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %(cooldown)s)
+                           THEN %(cooldown)s
+                           ELSE CEIL(%(cooldown)s - EXTRACT(EPOCH FROM ((NOW() AT TIME ZONE 'UTC') - u.last_claim_time)))::INTEGER
+                       END,
+                       NULL
+                FROM users u
+                WHERE u.user_id = %(user_id)s AND NOT EXISTS (SELECT 1 FROM claimed)
+                '''.format(logged_cte='' if activity_writer.buffered else _DAILY_CLAIM_LOGGED_CTE),
+                {'user_id': user_id, 'points': DAILY_POINTS, 'cooldown': DAILY_CLAIM_COOLDOWN}
+            )
+            result = cursor.fetchone()
     except Exception as e:
         logger.error(f"خطأ في معالجة المطالبة اليومية: {e}")
         return False, str(e)
 
+    # المستخدم غير موجود
+    if not result:
+        return None, None
+
+    claimed, new_points, total_points, seconds_remaining, claim_time = result
+
+    if not claimed:
+        return False, seconds_remaining
+
+    details = {'claim_time': claim_time.replace(tzinfo=timezone.utc).isoformat()}
+    if activity_writer.buffered:
+        if not activity_writer.enqueue(user_id, 'daily_claim', DAILY_POINTS, details):
+            with get_db_cursor() as (conn, cursor):
+                _log_activity(cursor, user_id, 'daily_claim', DAILY_POINTS, details)
+
+    after_points_change(user_id, new_points, total_points, activity=('daily_claim', DAILY_POINTS, details))
+    logger.info(f"تم منح المستخدم {user_id} المكافأة اليومية: {DAILY_POINTS} نقطة")
+
+    return True, {
+        'points': new_points,
+        'total_points': total_points,
+        'points_added': DAILY_POINTS
+    }
+
+@timed_query
 def can_claim_daily(user_id):
     """التحقق مما إذا كان المستخدم يمكنه المطالبة بالنقاط اليومية"""
     try:
@@ -232,17 +408,19 @@ def can_claim_daily(user_id):
                 return True, "مؤهل للمطالبة"
             else:
                 remaining_time = DAILY_CLAIM_COOLDOWN - time_since_last_claim
-                return False, int(remaining_time)
+                return False, math.ceil(remaining_time)
     except Exception as e:
         logger.error(f"خطأ في التحقق من أهلية المطالبة اليومية: {e}")
         return False, str(e)
 
+@timed_query
+@read_flights.wrap()
 def get_referrals(user_id):
-    """الحصول على عدد الإحالات للمستخدم"""
+    """الحصول على عدد الإحالات للمستخدم (العداد المخزن في جدول المستخدمين)"""
     try:
         with get_db_cursor() as (conn, cursor):
             cursor.execute(
-                'SELECT COUNT(*) FROM referrals WHERE referrer_id = %s',
+                'SELECT referrals_count FROM users WHERE user_id = %s',
                 (user_id,)
             )
             result = cursor.fetchone()
@@ -251,6 +429,60 @@ def get_referrals(user_id):
         logger.error(f"خطأ في الحصول على عدد الإحالات: {e}")
         return 0
 
+def reconcile_referral_counts(fix=True, sample_size=20):
+    """إعادة حساب عدادات الإحالات من جدول الإحالات دفعة واحدة والإبلاغ عن الانحراف"""
+    try:
+        with get_db_cursor() as (conn, cursor):
+            cursor.execute(
+                '''
+                CREATE TEMP TABLE referral_count_drift ON COMMIT DROP AS
+                SELECT u.user_id, u.referrals_count AS stored, COALESCE(a.actual, 0) AS actual
+                FROM users u
+                LEFT JOIN (
+                    SELECT referrer_id, COUNT(*) AS actual
+                    FROM referrals
+                    GROUP BY referrer_id
+                ) a ON a.referrer_id = u.user_id
+                WHERE u.referrals_count <> COALESCE(a.actual, 0)
+                '''
+            )
+            cursor.execute(
+                'SELECT user_id, stored, actual FROM referral_count_drift ORDER BY ABS(actual - stored) DESC LIMIT %s',
+                (sample_size,)
+            )
+            sample = cursor.fetchall()
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(ABS(actual - stored)), 0) FROM referral_count_drift')
+            drifted_users, total_drift = cursor.fetchone()
+
+            fixed = 0
+            if fix and drifted_users:
+                cursor.execute(
+                    '''
+                    UPDATE users u
+                    SET referrals_count = d.actual
+                    FROM referral_count_drift d
+                    WHERE u.user_id = d.user_id
+                    '''
+                )
+                fixed = cursor.rowcount
+
+        logger.info(
+            f"مطابقة عدادات الإحالات: {drifted_users} مستخدم بانحراف إجمالي {total_drift}، تم تصحيح {fixed}"
+        )
+        return {
+            'drifted_users': drifted_users,
+            'total_drift': int(total_drift),
+            'fixed': fixed,
+            'sample': [
+                {'user_id': user_id, 'stored': stored, 'actual': actual}
+                for user_id, stored, actual in sample
+            ],
+        }
+    except Exception as e:
+        logger.error(f"خطأ في مطابقة عدادات الإحالات: {e}")
+        return None
+
+@timed_query
 def add_referral(referrer_id, referred_id):
     """إضافة إحالة جديدة وتحديث النقاط"""
     try:
@@ -274,21 +506,20 @@ def add_referral(referrer_id, referred_id):
                     conn.rollback()
                     return False, "تمت الإحالة بالفعل"
                 
-                # تحديث نقاط المستخدم المحيل
+                # تحديث نقاط المستخدم المحيل وعداد إحالاته في نفس المعاملة
                 cursor.execute(
-                    'UPDATE users SET points = points + %s, total_points = total_points + %s WHERE user_id = %s RETURNING points, total_points',
+                    'UPDATE users SET points = points + %s, total_points = total_points + %s, referrals_count = referrals_count + 1 WHERE user_id = %s RETURNING points, total_points',
                     (REFERRAL_POINTS, REFERRAL_POINTS, referrer_id)
                 )
                 new_points, total_points = cursor.fetchone()
                 
                 # تسجيل نشاط الإحالة
                 details = {'referred_id': referred_id}
-                cursor.execute(
-                    'INSERT INTO activities (user_id, activity_type, points, details) VALUES (%s, %s, %s, %s)',
-                    (referrer_id, 'referral', REFERRAL_POINTS, json.dumps(details))
-                )
+                _log_activity(cursor, referrer_id, 'referral', REFERRAL_POINTS, details)
                 
                 conn.commit()
+                after_points_change(referrer_id, new_points, total_points, activity=('referral', REFERRAL_POINTS, details))
+                _after_referral(referrer_id, referred_id)
                 
                 logger.info(f"تمت إضافة إحالة جديدة: {referrer_id} أحال {referred_id} (+{REFERRAL_POINTS} نقطة)")
                 
@@ -301,6 +532,75 @@ def add_referral(referrer_id, referred_id):
         logger.error(f"خطأ في إضافة الإحالة: {e}")
         return False, str(e)
 
+def _after_referral(referrer_id, referred_id):
+    """إضافة الإحالة الجديدة إلى فهرس الإحالات في الذاكرة دون إعادة بنائه"""
+    if referral_graph.loaded:
+        referral_graph.add(referrer_id, referred_id)
+
+# صفوف فهرس الإحالات بترتيب الإنشاء ليكون أول محيل هو الأب في الشجرة
+_REFERRAL_EDGES_SQL = '''
+    SELECT referrer_id, referred_id, EXTRACT(EPOCH FROM created_at)::float8
+    FROM referrals
+    WHERE referrer_id IS NOT NULL AND referred_id IS NOT NULL
+    ORDER BY created_at, id
+'''
+
+def load_referral_graph():
+    """بناء فهرس الإحالات في الذاكرة من جدول الإحالات"""
+    if not referral_graph.begin_refresh():
+        return False
+    try:
+        with get_db_cursor() as (conn, cursor):
+            cursor.execute(_REFERRAL_EDGES_SQL)
+            rows = cursor.fetchall()
+        referral_graph.load(rows)
+        logger.info(f"تم تحميل فهرس الإحالات في الذاكرة ({len(rows)} إحالة)")
+        return True
+    except Exception as e:
+        referral_graph.cancel_refresh()
+        logger.error(f"خطأ في تحميل فهرس الإحالات: {e}")
+        return False
+
+@timed_query
+def get_referral_tree(user_id, max_depth=3):
+    """موقع المستخدم في شجرة الإحالات (العمق وسلسلة المحيلين) وحجم شبكته في كل مستوى"""
+    if referral_graph.is_stale():
+        load_referral_graph()
+    if not referral_graph.loaded:
+        return None
+    return referral_graph.tree(user_id, max_depth)
+
+def _with_usernames(counts, usernames):
+    """تنسيق أعلى المحيلين مع أسمائهم"""
+    return [
+        {'user_id': user_id, 'username': usernames.get(user_id), 'referrals': count}
+        for user_id, count in counts
+    ]
+
+@timed_query
+def get_top_referrers(hours=24, limit=10):
+    """أكثر المستخدمين إحالات خلال آخر عدد من الساعات"""
+    if referral_graph.is_stale():
+        load_referral_graph()
+    if not referral_graph.loaded:
+        return None
+    counts = referral_graph.top_referrers(time.time() - hours * 3600, limit)
+    if not counts:
+        return []
+    try:
+        with get_db_cursor() as (conn, cursor):
+            cursor.execute(
+                'SELECT user_id, username FROM users WHERE user_id = ANY(%s)',
+                ([user_id for user_id, _ in counts],)
+            )
+            usernames = dict(cursor.fetchall())
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على أسماء المحيلين: {e}")
+        usernames = {}
+    return _with_usernames(counts, usernames)
+
+@timed_query
+@read_flights.wrap()
 def get_user_activities(user_id, limit=10):
     """الحصول على آخر أنشطة المستخدم"""
     try:
@@ -321,6 +621,125 @@ def get_user_activities(user_id, limit=10):
         logger.error(f"خطأ في الحصول على أنشطة المستخدم: {e}")
         return []
 
+def encode_activity_cursor(created_at, activity_id):
+    """ترميز موضع آخر نشاط في الصفحة كمؤشر نصي للصفحة التالية"""
+    raw = f"{created_at.isoformat()}|{activity_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_activity_cursor(cursor):
+    """فك ترميز مؤشر الصفحة إلى (وقت الإنشاء، المعرف)؛ يرفع ValueError إذا كان غير صالح"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, activity_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(activity_id)
+    except Exception as e:
+        raise ValueError("مؤشر صفحة غير صالح") from e
+
+@timed_query
+@read_flights.wrap()
+def get_user_activities_page(user_id, limit=10, cursor=None):
+    """الحصول على صفحة من أنشطة المستخدم بترقيم المفاتيح على (created_at, id) مع مؤشر الصفحة التالية"""
+    params = [user_id]
+    keyset = ''
+    if cursor:
+        created_at, activity_id = decode_activity_cursor(cursor)
+        keyset = 'AND (created_at, id) < (%s, %s)'
+        params += [created_at, activity_id]
+    params.append(limit + 1)
+
+    try:
+        with get_db_cursor() as (conn, db_cursor):
+            db_cursor.execute(
+                f'''
+                SELECT id, activity_type, points, created_at, details
+                FROM activities
+                WHERE user_id = %s {keyset}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+                ''',
+                params
+            )
+            rows = db_cursor.fetchall()
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على صفحة أنشطة المستخدم: {e}")
+        return [], None
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_activity_cursor(last[3], last[0])
+    return rows, next_cursor
+
+# الأيام المكتملة من جدول التجميع (انظر ledger.refresh_activity_rollups) وما بعدها من الصفوف الخام
+_ACTIVITY_SUMMARY_SQL = '''
+    WITH state AS (
+        SELECT GREATEST(
+            COALESCE((SELECT complete_through + 1 FROM activity_rollup_state WHERE name = 'daily'), %(start)s),
+            %(start)s
+        ) AS raw_from
+    ), combined AS (
+        SELECT r.activity_type, r.activity_count, r.points
+        FROM activity_daily_rollups r, state
+        WHERE r.user_id = %(user_id)s AND r.day >= %(start)s AND r.day < state.raw_from
+        UNION ALL
+        SELECT a.activity_type, 1, a.points
+        FROM activities a, state
+        WHERE a.user_id = %(user_id)s AND a.created_at >= state.raw_from
+    )
+    SELECT activity_type, SUM(activity_count)::bigint, SUM(points)::bigint
+    FROM combined
+    GROUP BY activity_type
+    ORDER BY 3 DESC
+'''
+
+def _summary_from_rows(days, rows):
+    """تنسيق صفوف الملخص (النوع، العدد، النقاط)"""
+    return {
+        'days': days,
+        'total_activities': sum(count for _, count, _ in rows),
+        'total_points': sum(points for _, _, points in rows),
+        'by_type': [
+            {'activity_type': activity_type, 'count': count, 'points': points}
+            for activity_type, count, points in rows
+        ],
+    }
+
+@timed_query
+@read_flights.wrap()
+def get_user_activity_summary(user_id, days=30):
+    """ملخص نشاطات المستخدم لآخر عدد من الأيام من جدول التجميع اليومي، مع الصفوف الخام للأيام غير المجمعة فقط"""
+    start = datetime.now().date() - timedelta(days=days - 1)
+    try:
+        with get_db_cursor() as (conn, cursor):
+            cursor.execute(
+                _ACTIVITY_SUMMARY_SQL,
+                {'user_id': user_id, 'start': start}
+            )
+            return _summary_from_rows(days, cursor.fetchall())
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على ملخص أنشطة المستخدم: {e}")
+        return None
+
+def iter_user_activities(user_id, batch_size=ACTIVITIES_EXPORT_BATCH_SIZE):
+    """المرور على كامل سجل أنشطة المستخدم عبر مؤشر على الخادم بذاكرة محدودة"""
+    with get_db_connection() as conn:
+        # المؤشر المسمى يجلب الصفوف من الخادم على دفعات بدلاً من تحميلها كلها
+        with conn.cursor(name=f"activities_export_{user_id}") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(
+                '''
+                SELECT id, activity_type, points, created_at, details
+                FROM activities
+                WHERE user_id = %s
+                ORDER BY created_at DESC, id DESC
+                ''',
+                (user_id,)
+            )
+            for row in cursor:
+                yield row
+
+@timed_query
 def social_media_visit(user_id, social_type):
     """تسجيل زيارة لموقع تواصل اجتماعي وإضافة نقاط (مرة واحدة فقط)"""
     if social_type not in SOCIAL_MEDIA_LINKS:
@@ -353,12 +772,12 @@ def social_media_visit(user_id, social_type):
                 
                 # تسجيل النشاط
                 details = {'social_type': social_type, 'url': SOCIAL_MEDIA_LINKS[social_type]}
-                cursor.execute(
-                    'INSERT INTO activities (user_id, activity_type, points, details) VALUES (%s, %s, %s, %s)',
-                    (user_id, f'social_{social_type}', points_to_add, json.dumps(details))
-                )
+                _log_activity(cursor, user_id, f'social_{social_type}', points_to_add, details)
                 
                 conn.commit()
+                after_points_change(
+                    user_id, new_points, total_points, activity=(f'social_{social_type}', points_to_add, details)
+                )
                 
                 logger.info(f"المستخدم {user_id} قام بزيارة {social_type} (+{points_to_add} نقطة)")
                 
@@ -371,6 +790,8 @@ def social_media_visit(user_id, social_type):
         logger.error(f"خطأ في تسجيل زيارة موقع تواصل اجتماعي: {e}")
         return False, str(e)
 
+@timed_query
+@read_flights.wrap()
 def get_social_media_visits(user_id):
     """الحصول على قائمة بالمواقع التي زارها المستخدم بالفعل"""
     try:
@@ -385,8 +806,41 @@ def get_social_media_visits(user_id):
         logger.error(f"خطأ في الحصول على زيارات مواقع التواصل الاجتماعي: {e}")
         return []
 
+# الترتيب في قاعدة البيانات بترتيب مفاتيح اللوحة نفسه (-النقاط، معرف المستخدم) فلا يُعاد ترتيبه في Python
+LEADERBOARD_LOAD_SQL = '''
+    SELECT user_id, username, COALESCE(points, 0), COALESCE(total_points, 0)
+    FROM users
+    ORDER BY COALESCE(points, 0) DESC, user_id
+'''
+
+def load_leaderboard():
+    """بناء لوحة المتصدرين في الذاكرة من جدول المستخدمين"""
+    if not leaderboard.begin_refresh():
+        return False
+    try:
+        with get_db_cursor() as (conn, cursor):
+            cursor.execute(LEADERBOARD_LOAD_SQL)
+            rows = cursor.fetchall()
+        leaderboard.load(rows)
+        logger.info(f"تم تحميل لوحة المتصدرين في الذاكرة ({len(rows)} مستخدم)")
+        return True
+    except Exception as e:
+        leaderboard.cancel_refresh()
+        logger.error(f"خطأ في تحميل لوحة المتصدرين: {e}")
+        return False
+
+@timed_query
 def get_leaderboard(limit=10):
     """الحصول على لوحة المتصدرين"""
+    if leaderboard.is_stale():
+        load_leaderboard()
+    if leaderboard.loaded:
+        return leaderboard.top(limit)
+    return _query_leaderboard(limit)
+
+@read_flights.wrap(user_scoped=False)
+def _query_leaderboard(limit):
+    """لوحة المتصدرين من قاعدة البيانات عندما لا تكون محملة في الذاكرة"""
     try:
         with get_db_cursor() as (conn, cursor):
             cursor.execute(
@@ -398,67 +852,162 @@ def get_leaderboard(limit=10):
                 ''',
                 (limit,)
             )
-            leaderboard = cursor.fetchall()
-            return leaderboard
+            leaderboard_data = cursor.fetchall()
+            return leaderboard_data
     except Exception as e:
         logger.error(f"خطأ في الحصول على لوحة المتصدرين: {e}")
         return []
 
-def request_withdrawal(user_id, amount, details=None):
-    """تسجيل طلب سحب النقاط"""
+@timed_query
+def get_user_rank(user_id):
+    """الحصول على ترتيب المستخدم في لوحة المتصدرين (يبدأ من 1)"""
+    if leaderboard.is_stale():
+        load_leaderboard()
+    if leaderboard.loaded:
+        return leaderboard.rank(user_id)
+    return _query_user_rank(user_id)
+
+@read_flights.wrap()
+def _query_user_rank(user_id):
+    """ترتيب المستخدم من قاعدة البيانات عندما لا تكون اللوحة محملة في الذاكرة"""
+    try:
+        with get_db_cursor() as (conn, cursor):
+            # نفس ترتيب اللوحة في الذاكرة: النقاط تنازليًا ثم معرف المستخدم تصاعديًا
+            cursor.execute(
+                '''
+                SELECT (
+                    SELECT COUNT(*) FROM users u
+                    WHERE u.points > me.points OR (u.points = me.points AND u.user_id < me.user_id)
+                ) + 1
+                FROM users me
+                WHERE me.user_id = %s
+                ''',
+                (user_id,)
+            )
+            result = cursor.fetchone()
+            return result[0] if result else None
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على ترتيب المستخدم: {e}")
+        return None
+
+def request_fingerprint(operation, payload):
+    """بصمة محتوى الطلب لاكتشاف إعادة استخدام مفتاح منع التكرار لطلب مختلف"""
+    canonical = json.dumps({"operation": operation, "payload": payload}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+@timed_query
+def request_withdrawal(user_id, amount, details=None, idempotency_key=None):
+    """تسجيل طلب سحب النقاط بخصم مشروط ذري، مع إعادة النتيجة المحفوظة عند تكرار مفتاح منع التكرار
+
+    يعيد (True, النتيجة) مع 'replayed' عند إعادة طلب سابق، أو (False, رسالة الخطأ).
+    """
     if details is None:
         details = {}
         
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                # التحقق من وجود رصيد كافٍ
+                if idempotency_key:
+                    request_hash = request_fingerprint('withdrawal', {'amount': amount, 'details': details})
+                    # ينتظر الإدراج انتهاء أي معاملة أخرى تحمل المفتاح نفسه قبل أن يقرر
+                    cursor.execute(
+                        '''
+                        INSERT INTO idempotency_keys (user_id, idempotency_key, operation, request_hash)
+                        VALUES (%s, %s, 'withdrawal', %s)
+                        ON CONFLICT (user_id, idempotency_key) DO NOTHING
+                        RETURNING user_id
+                        ''',
+                        (user_id, idempotency_key, request_hash)
+                    )
+                    if cursor.fetchone() is None:
+                        cursor.execute(
+                            '''
+                            SELECT operation, request_hash, response FROM idempotency_keys
+                            WHERE user_id = %s AND idempotency_key = %s
+                            ''',
+                            (user_id, idempotency_key)
+                        )
+                        operation, stored_hash, response = cursor.fetchone()
+                        if operation != 'withdrawal' or stored_hash != request_hash:
+                            return False, "مفتاح منع التكرار مستخدم لطلب مختلف"
+                        if response is None:
+                            return False, "الطلب الأصلي لم يكتمل بعد"
+                        return True, dict(response, replayed=True)
+                
+                # خصم مشروط في عبارة واحدة: لا يمكن لطلبين متزامنين تجاوز الرصيد
                 cursor.execute(
-                    'SELECT points FROM users WHERE user_id = %s',
-                    (user_id,)
+                    '''
+                    UPDATE users SET points = points - %s
+                    WHERE user_id = %s AND points >= %s
+                    RETURNING points, total_points
+                    ''',
+                    (amount, user_id, amount)
                 )
-                result = cursor.fetchone()
-                
-                if not result:
-                    return False, "المستخدم غير موجود"
-                    
-                current_points = result[0]
+                debited = cursor.fetchone()
                 
-                if current_points < amount:
+                if not debited:
+                    # التراجع يحرر مفتاح منع التكرار فيمكن إعادة المحاولة بعد شحن الرصيد
+                    conn.rollback()
+                    cursor.execute('SELECT 1 FROM users WHERE user_id = %s', (user_id,))
+                    if cursor.fetchone() is None:
+                        return False, "المستخدم غير موجود"
                     return False, "رصيد غير كافٍ"
+                    
+                new_points, total_points = debited
                 
-                # خصم النقاط من المستخدم
-                cursor.execute(
-                    'UPDATE users SET points = points - %s WHERE user_id = %s',
-                    (amount, user_id)
-                )
-                
-                # تسجيل النشاط
-                cursor.execute(
-                    'INSERT INTO activities (user_id, activity_type, points, details) VALUES (%s, %s, %s, %s)',
-                    (user_id, 'withdrawal', -amount, json.dumps(details))
-                )
-                
-                # تسجيل طلب السحب
+                # تسجيل طلب السحب وقيده في سجل النشاطات داخل المعاملة نفسها
                 cursor.execute(
                     '''
                     INSERT INTO withdrawals (user_id, amount, details)
                     VALUES (%s, %s, %s)
                     RETURNING id
                     ''',
-                    (user_id, amount, json.dumps(details))
+                    (user_id, amount, json_backend.dumps(details))
                 )
                 withdrawal_id = cursor.fetchone()[0]
+                _log_activity(
+                    cursor, user_id, 'withdrawal', -amount,
+                    dict(details, withdrawal_id=withdrawal_id), allow_buffer=False
+                )
                 
-                conn.commit()
-                
-                logger.info(f"تم تسجيل طلب سحب للمستخدم {user_id}: {amount} نقطة (معرف الطلب: {withdrawal_id})")
-                
-                return True, {
+                result = {
                     'withdrawal_id': withdrawal_id,
                     'amount': amount,
-                    'remaining_points': current_points - amount
+                    'remaining_points': new_points
                 }
+                if idempotency_key:
+                    cursor.execute(
+                        'UPDATE idempotency_keys SET response = %s WHERE user_id = %s AND idempotency_key = %s',
+                        (json_backend.dumps(result), user_id, idempotency_key)
+                    )
+                
+        after_points_change(
+            user_id, new_points, total_points, activity=('withdrawal', -amount, {'withdrawal_id': withdrawal_id})
+        )
+        logger.info(f"تم تسجيل طلب سحب للمستخدم {user_id}: {amount} نقطة (معرف الطلب: {withdrawal_id})")
+        
+        return True, dict(result, replayed=False)
     except Exception as e:
         logger.error(f"خطأ في تسجيل طلب السحب: {e}")
-        return False, str(e)
\ No newline at end of file
+        return False, str(e)
+
+def purge_idempotency_keys(max_age_hours=IDEMPOTENCY_KEY_TTL_HOURS):
+    """حذف مفاتيح منع التكرار الأقدم من المدة المحددة وإرجاع عددها"""
+    try:
+        with get_db_cursor() as (conn, cursor):
+            # created_at يُملأ بالتوقيت المحلي للجلسة مثل LOCALTIMESTAMP
+            cursor.execute(
+                'DELETE FROM idempotency_keys WHERE created_at < LOCALTIMESTAMP - make_interval(hours => %s)',
+                (max_age_hours,)
+            )
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"خطأ في حذف مفاتيح منع التكرار القديمة: {e}")
+        return None
+
+# مصادر المقاييس المشتركة بين عملية البوت وعمليات خادم API
+registry.register_stats("db_pool", get_pool_stats)
+registry.register_stats("user_cache", get_user_cache_stats)
+registry.register_stats("activity_writer", get_activity_writer_stats)
+registry.register_stats("read_coalescing_sync", get_read_coalescing_stats)
+registry.register_stats("live_updates", live_hub.stats)
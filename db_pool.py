@@ -0,0 +1,253 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """انتهت مهلة انتظار اتصال متاح في التجمع"""
+
+
+class _PoolEntry:
+    """بيانات تعريفية لاتصال مُدار داخل التجمع"""
+
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """تجمع اتصالات PostgreSQL آمن للاستخدام بين عدة ثريدات (البوت وخادم API)"""
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=10.0,
+                 max_idle=300.0, health_check_interval=30.0, max_lifetime=3600.0,
+                 on_acquire=None):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("إعدادات حجم التجمع غير صالحة")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+        # يُستدعى بزمن انتظار كل استعارة ناجحة (بالثواني) لتسجيله في المقاييس
+        self.on_acquire = on_acquire
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._closed = False
+        self._pid = os.getpid()
+
+        # عدادات المقاييس
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+
+    @property
+    def pid(self):
+        """معرف العملية التي أنشأت التجمع"""
+        return self._pid
+
+    def _connect(self):
+        """فتح اتصال جديد بقاعدة البيانات"""
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = False
+        with self._cond:
+            self._created += 1
+        return _PoolEntry(conn)
+
+    def _discard(self, entry):
+        """إغلاق اتصال وإخراجه من التجمع (يُستدعى مع حيازة القفل)"""
+        self._size -= 1
+        self._recycled += 1
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        self._cond.notify()
+
+    def _evict_idle(self, now):
+        """إخلاء الاتصالات الخاملة لفترة طويلة مع الإبقاء على الحد الأدنى (يُستدعى مع حيازة القفل)"""
+        # أقدم الاتصالات استخدامًا في بداية الطابور
+        while self._idle and self._size > self.min_size:
+            entry = self._idle[0]
+            if now - entry.last_used < self.max_idle:
+                break
+            self._idle.popleft()
+            self._discard(entry)
+
+    def _is_healthy(self, entry, now):
+        """فحص صلاحية الاتصال قبل تسليمه للمستدعي"""
+        conn = entry.conn
+        if conn.closed:
+            return False
+        if self.max_lifetime and now - entry.created_at >= self.max_lifetime:
+            return False
+        if now - entry.last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """استعارة اتصال من التجمع مع الانتظار حتى انتهاء المهلة إذا كان ممتلئًا"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            entry = None
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("تجمع الاتصالات مغلق")
+
+                while True:
+                    now = time.monotonic()
+                    self._evict_idle(now)
+                    if self._idle:
+                        # آخر اتصال أُعيد هو الأكثر دفئًا
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"لا يوجد اتصال متاح بعد {self.timeout} ثانية "
+                            f"(المستخدم حاليًا: {len(self._in_use)})"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if entry is None:
+                try:
+                    entry = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(entry, time.monotonic()):
+                with self._cond:
+                    self._discard(entry)
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._in_use[id(entry.conn)] = entry
+                self._checkouts += 1
+                self._wait_time += waited
+            if self.on_acquire is not None:
+                self.on_acquire(waited)
+            return entry.conn
+
+    def putconn(self, conn, discard=False):
+        """إعادة اتصال إلى التجمع أو إغلاقه إذا لم يعد صالحًا"""
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            raise ValueError("الاتصال لا ينتمي إلى هذا التجمع")
+
+        if not discard and not conn.closed:
+            try:
+                # عدم ترك معاملة مفتوحة على اتصال مشترك
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._discard(entry)
+                return
+            entry.last_used = time.monotonic()
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """مدير سياق يستعير اتصالًا ويثبّت المعاملة عند النجاح ويتراجع عنها عند الخطأ"""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def warmup(self):
+        """فتح الحد الأدنى من الاتصالات مسبقًا"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                entry = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def close(self):
+        """إغلاق جميع الاتصالات الخاملة ومنع الاستعارة الجديدة"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._cond.notify_all()
+
+    def stats(self):
+        """مقاييس التجمع الحالية"""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "size": self._size,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "checked_out": len(self._in_use),
+                "waiting": self._waiting,
+                "created": self._created,
+                "recycled": self._recycled,
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": (self._wait_time / checkouts * 1000) if checkouts else 0.0,
+            }
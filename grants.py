@@ -0,0 +1,242 @@
+import csv
+import io
+import itertools
+import logging
+import time
+
+import json_backend
+from database import get_db_connection, after_points_change
+from config import GRANT_CHUNK_SIZE
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+# منح النقاط بالجملة للحملات والتوزيعات الإدارية: كل دفعة تُنسخ بـ COPY إلى جدول مؤقت
+# ثم تُطبق بعبارة واحدة (تسجيل المنحة، UPDATE ... FROM على المستخدمين، وإدراج النشاطات).
+# جدول grant_campaign_items يضمن منح كل مستخدم مرة واحدة لكل حملة، فإعادة التشغيل آمنة.
+
+_CREATE_STAGING_SQL = '''
+    CREATE TEMP TABLE IF NOT EXISTS grant_staging (
+        user_id BIGINT NOT NULL,
+        points INTEGER NOT NULL,
+        activity_type VARCHAR(50) NOT NULL,
+        details JSONB NOT NULL
+    ) ON COMMIT DELETE ROWS
+'''
+
+_APPLY_CHUNK_SQL = '''
+    WITH staged AS (
+        SELECT DISTINCT ON (s.user_id) s.user_id, s.points, s.activity_type, s.details
+        FROM grant_staging s
+        JOIN users u ON u.user_id = s.user_id
+        ORDER BY s.user_id
+    ), claimed AS (
+        INSERT INTO grant_campaign_items (campaign_id, user_id, points)
+        SELECT %(campaign_id)s, user_id, points FROM staged
+        ON CONFLICT (campaign_id, user_id) DO NOTHING
+        RETURNING user_id
+    ), credited AS (
+        UPDATE users u
+        SET points = u.points + s.points, total_points = u.total_points + s.points
+        FROM staged s
+        JOIN claimed c ON c.user_id = s.user_id
+        WHERE u.user_id = s.user_id
+        RETURNING u.user_id, u.points, u.total_points, s.points AS granted, s.activity_type
+    ), logged AS (
+        INSERT INTO activities (user_id, activity_type, points, details)
+        SELECT s.user_id, s.activity_type, s.points,
+               s.details || jsonb_build_object('campaign_id', %(campaign_id)s)
+        FROM staged s
+        JOIN claimed c ON c.user_id = s.user_id
+    )
+    SELECT user_id, points, total_points, granted, activity_type FROM credited
+'''
+
+
+def read_grants_csv(path, activity_type="campaign"):
+    """قراءة ملف CSV بأعمدة user_id,points[,activity_type[,details]] (مع سطر عناوين أو دونه)"""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or row[0].strip().lower() == "user_id":
+                continue
+            details = json_backend.loads(row[3]) if len(row) > 3 and row[3].strip() else {}
+            yield (
+                int(row[0]),
+                int(row[1]),
+                row[2].strip() if len(row) > 2 and row[2].strip() else activity_type,
+                details,
+            )
+
+
+def _copy_chunk(cursor, chunk):
+    """نسخ الدفعة إلى الجدول المؤقت بصيغة CSV عبر COPY"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for user_id, points, activity_type, details in chunk:
+        writer.writerow((user_id, points, activity_type, json_backend.dumps(details or {})))
+    buffer.seek(0)
+    cursor.copy_expert(
+        'COPY grant_staging (user_id, points, activity_type, details) FROM STDIN WITH (FORMAT csv)',
+        buffer
+    )
+
+
+def _start_campaign(cursor, campaign_id, description, resume=True):
+    """تسجيل الحملة أو استئنافها؛ يعيد حالتها وعدد الصفوف المعالجة سابقًا (بقفل صف الحملة)
+
+    مع resume=False تُصفّر نقطة الاستئناف تحت القفل نفسه لأن المسح يبدأ من أول المصدر.
+    """
+    cursor.execute(
+        '''
+        INSERT INTO grant_campaigns (campaign_id, description)
+        VALUES (%s, %s)
+        ON CONFLICT (campaign_id) DO NOTHING
+        ''',
+        (campaign_id, description)
+    )
+    cursor.execute(
+        'SELECT status, rows_processed, rows_applied FROM grant_campaigns WHERE campaign_id = %s FOR UPDATE',
+        (campaign_id,)
+    )
+    status, rows_processed, rows_applied = cursor.fetchone()
+    if not resume and rows_processed and status != "completed":
+        cursor.execute(
+            'UPDATE grant_campaigns SET rows_processed = 0, updated_at = CURRENT_TIMESTAMP WHERE campaign_id = %s',
+            (campaign_id,)
+        )
+        rows_processed = 0
+    return status, rows_processed, rows_applied
+
+
+def _lock_campaign(cursor, campaign_id, offset):
+    """قفل صف الحملة حتى نهاية معاملة الدفعة والتحقق من أن نقطة الاستئناف لم تتقدم من تشغيل آخر"""
+    cursor.execute(
+        'SELECT rows_processed FROM grant_campaigns WHERE campaign_id = %s FOR UPDATE',
+        (campaign_id,)
+    )
+    rows_processed = cursor.fetchone()[0]
+    if rows_processed != offset:
+        raise RuntimeError(
+            f"تشغيل آخر للحملة {campaign_id} يعمل بالتوازي (الصفوف المعالجة {rows_processed} والمتوقع {offset})"
+        )
+
+
+def _apply_chunk(campaign_id, chunk, offset):
+    """تطبيق دفعة واحدة في معاملة واحدة مع تقديم نقطة الاستئناف؛ يعيد صفوف المستخدمين الممنوحين"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            # التشغيلات المتزامنة للحملة نفسها تنتظر هنا، ثم يتوقف المتأخر منها بدل مضاعفة rows_processed
+            _lock_campaign(cursor, campaign_id, offset)
+            cursor.execute(_CREATE_STAGING_SQL)
+            _copy_chunk(cursor, chunk)
+            cursor.execute(_APPLY_CHUNK_SQL, {"campaign_id": campaign_id})
+            credited = cursor.fetchall()
+            cursor.execute(
+                '''
+                UPDATE grant_campaigns
+                SET rows_processed = rows_processed + %s, rows_applied = rows_applied + %s, updated_at = CURRENT_TIMESTAMP
+                WHERE campaign_id = %s
+                ''',
+                (len(chunk), len(credited), campaign_id)
+            )
+    return credited
+
+
+def bulk_grant(campaign_id, rows, chunk_size=GRANT_CHUNK_SIZE, description=None, resume=True):
+    """منح النقاط بالجملة لحملة من مصدر (user_id, points, activity_type, details) ويعيد تقريرًا بالإنتاجية
+
+    التشغيل قابل للاستئناف: مع resume=True تُتخطى الصفوف التي عولجت في تشغيل سابق
+    (بافتراض المصدر نفسه بالترتيب نفسه)، ومع resume=False تُصفّر نقطة الاستئناف ويُعاد المرور
+    على المصدر كاملًا دون منح أي مستخدم مرتين. المستخدمون غير الموجودين يُتخطون.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            status, rows_processed, rows_applied = _start_campaign(cursor, campaign_id, description, resume)
+
+    report = {
+        "campaign_id": campaign_id,
+        "status": status,
+        "rows_read": 0,
+        "rows_skipped": 0,
+        "rows_applied": 0,
+        "chunks": 0,
+        "elapsed_seconds": 0.0,
+        "rows_per_second": 0.0,
+    }
+    if status == "completed":
+        logger.info(f"الحملة {campaign_id} مكتملة مسبقًا ({rows_applied} منحة)، لا شيء للتطبيق")
+        report["total_applied"] = rows_applied
+        return report
+
+    offset = rows_processed
+    rows = iter(rows)
+    if resume and rows_processed:
+        report["rows_skipped"] = sum(1 for _ in itertools.islice(rows, rows_processed))
+        logger.info(f"استئناف الحملة {campaign_id} بعد {report['rows_skipped']} صف معالج سابقًا")
+
+    started = time.monotonic()
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        credited = _apply_chunk(campaign_id, chunk, offset)
+        offset += len(chunk)
+        for user_id, points, total_points, granted, activity_type in credited:
+            after_points_change(
+                user_id, points, total_points, activity=(activity_type, granted, {"campaign_id": campaign_id})
+            )
+
+        report["rows_read"] += len(chunk)
+        report["rows_applied"] += len(credited)
+        report["chunks"] += 1
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"الحملة {campaign_id}: دفعة {report['chunks']} - {report['rows_read']} صف "
+            f"({report['rows_read'] / elapsed if elapsed else 0:.0f} صف/ث)"
+        )
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                '''
+                UPDATE grant_campaigns
+                SET status = 'completed', completed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE campaign_id = %s
+                RETURNING rows_applied
+                ''',
+                (campaign_id,)
+            )
+            report["total_applied"] = cursor.fetchone()[0]
+
+    elapsed = time.monotonic() - started
+    report["status"] = "completed"
+    report["elapsed_seconds"] = round(elapsed, 3)
+    report["rows_per_second"] = round(report["rows_read"] / elapsed, 1) if elapsed else 0.0
+    logger.info(
+        f"اكتملت الحملة {campaign_id}: {report['rows_applied']} منحة من {report['rows_read']} صف "
+        f"في {report['elapsed_seconds']} ث ({report['rows_per_second']} صف/ث)"
+    )
+    return report
+
+
+def get_campaign(campaign_id):
+    """حالة حملة منح وعدد المنح المطبقة"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT campaign_id, description, status, rows_processed, rows_applied,
+                       created_at, updated_at, completed_at
+                FROM grant_campaigns WHERE campaign_id = %s
+                ''',
+                (campaign_id,)
+            )
+            row = cursor.fetchone()
+    if row is None:
+        return None
+    columns = ("campaign_id", "description", "status", "rows_processed", "rows_applied",
+               "created_at", "updated_at", "completed_at")
+    return {
+        name: value.isoformat() if hasattr(value, "isoformat") else value
+        for name, value in zip(columns, row)
+    }
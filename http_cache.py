@@ -0,0 +1,268 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse, Response
+
+try:
+    import brotli
+except ImportError:  # ضغط brotli اختياري؛ يُكتفى بـ gzip عند غياب الحزمة
+    brotli = None
+
+import json_backend
+from config import STATIC_COMPRESS_MIN_SIZE, JSON_COMPRESS_MIN_SIZE
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+# الأصول ذات البصمة في عنوانها لا يتغير محتواها أبدًا
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# الصفحة الرئيسية والعناوين دون بصمة تُعاد مصادقتها في كل طلب عبر ETag
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+_STATIC_REFERENCE = re.compile(r'(?P<attr>href|src)="/static/(?P<path>[^"?#]+)"')
+
+
+def parse_if_none_match(value):
+    """قائمة وسوم ETag في ترويسة If-None-Match"""
+    if not value:
+        return set()
+    return {tag.strip() for tag in value.split(",")}
+
+
+def etag_matches(etag, if_none_match):
+    """مقارنة ضعيفة كما في RFC 9110 (تجاهل البادئة W/)"""
+    tags = parse_if_none_match(if_none_match)
+    if "*" in tags:
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return any((tag[2:] if tag.startswith("W/") else tag) == bare for tag in tags)
+
+
+def accepted_encodings(accept_encoding):
+    """الترميزات التي يقبلها العميل (مع استبعاد q=0)"""
+    encodings = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(name)
+    return encodings
+
+
+def content_etag(body):
+    """وسم ETag ضعيف من بصمة المحتوى (يشمل كل ترميزات الضغط للتمثيل نفسه)"""
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+class FastJSONResponse(JSONResponse):
+    """استجابة JSON تُسلسل بواجهة json_backend (orjson إن توفر)
+
+    تُستخدم كفئة الاستجابة الافتراضية: تعيد نقاط النهاية قواميس فيتحقق منها FastAPI
+    مقابل response_model ثم تُسلسل هنا. إرجاعها مباشرة يتجاوز هذا التحقق، فيقتصر ذلك
+    على المسارات التي تحتاج ترويسات خاصة ولا تعلن نموذجًا.
+    """
+
+    def render(self, content):
+        return json_backend.dumps_bytes(content)
+
+
+class StaticAsset:
+    """ملف ثابت محمّل في الذاكرة مع نسخه المضغوطة مسبقًا"""
+
+    __slots__ = ("path", "digest", "etag", "media_type", "variants")
+
+    def __init__(self, path, body, media_type):
+        self.path = path
+        self.digest = hashlib.sha256(body).hexdigest()[:12]
+        self.etag = f'W/"{self.digest}"'
+        self.media_type = media_type
+        # الترميز -> المحتوى؛ "identity" للمحتوى الأصلي
+        self.variants = {"identity": body}
+
+    def compress(self, min_size):
+        """تجهيز نسخ gzip و brotli إذا كانت أصغر من الأصل"""
+        body = self.variants["identity"]
+        if len(body) < min_size or not self.media_type.startswith(COMPRESSIBLE_TYPES):
+            return
+        gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(gzipped) < len(body):
+            self.variants["gzip"] = gzipped
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants["br"] = compressed
+
+    def fingerprinted_path(self):
+        """المسار مع البصمة قبل الامتداد، مثل app.3f2a9c1b7d4e.js"""
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{self.digest}{ext}"
+
+    def response(self, request_headers, immutable):
+        """استجابة 200 أو 304 بأفضل ترميز يقبله العميل"""
+        cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        headers = {"ETag": self.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(self.etag, request_headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+
+        accepted = accepted_encodings(request_headers.get("accept-encoding"))
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                headers["Content-Encoding"] = encoding
+                return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+        return Response(self.variants["identity"], media_type=self.media_type, headers=headers)
+
+
+class StaticAssets:
+    """الملفات الثابتة بعناوين ذات بصمة وتخزين مؤقت طويل وضغط مسبق عند بدء التشغيل"""
+
+    def __init__(self, directory, url_prefix="/static", index="index.html",
+                 compress_min_size=STATIC_COMPRESS_MIN_SIZE):
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+        self.index = index
+        self.compress_min_size = compress_min_size
+        self._assets = {}
+        self._fingerprinted = {}
+        self._index = None
+
+    def build(self):
+        """قراءة الملفات وحساب البصمات وضغطها وإعادة كتابة مراجعها في الصفحة الرئيسية"""
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                full_path = os.path.join(root, name)
+                rel_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                if rel_path == self.index:
+                    continue
+                with open(full_path, "rb") as f:
+                    body = f.read()
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                asset = StaticAsset(rel_path, body, media_type)
+                asset.compress(self.compress_min_size)
+                assets[rel_path] = asset
+
+        self._assets = assets
+        self._fingerprinted = {asset.fingerprinted_path(): asset for asset in assets.values()}
+
+        with open(os.path.join(self.directory, self.index), "rb") as f:
+            html = f.read().decode("utf-8")
+        index = StaticAsset(self.index, self._rewrite_references(html).encode("utf-8"), "text/html")
+        index.compress(self.compress_min_size)
+        self._index = index
+
+        compressed = sum(1 for asset in assets.values() if len(asset.variants) > 1)
+        logger.info(
+            f"تم تجهيز {len(assets)} ملف ثابت ({compressed} مضغوط مسبقًا"
+            f"{'، مع brotli' if brotli is not None else '، gzip فقط'})"
+        )
+
+    def _rewrite_references(self, html):
+        """استبدال عناوين /static/... في الصفحة بعناوينها ذات البصمة"""
+        def replace(match):
+            asset = self._assets.get(match.group("path"))
+            if asset is None:
+                return match.group(0)
+            return f'{match.group("attr")}="{self.url(asset.path)}"'
+        return _STATIC_REFERENCE.sub(replace, html)
+
+    def url(self, path):
+        """عنوان الأصل ذي البصمة (أو العنوان العادي إن لم يكن معروفًا)"""
+        asset = self._assets.get(path)
+        if asset is None:
+            return f"{self.url_prefix}/{path}"
+        return f"{self.url_prefix}/{asset.fingerprinted_path()}"
+
+    def index_response(self, request):
+        """الصفحة الرئيسية: تُعاد مصادقتها دائمًا لأنها تحمل بصمات الأصول الحالية"""
+        return self._index.response(request.headers, immutable=False)
+
+    def asset_response(self, path, request):
+        """أصل ثابت: تخزين دائم بعنوان البصمة، وإعادة مصادقة بالعنوان العادي"""
+        asset = self._fingerprinted.get(path)
+        if asset is not None:
+            return asset.response(request.headers, immutable=True)
+        asset = self._assets.get(path)
+        if asset is None:
+            # بصمة قديمة من صفحة مخزنة أثناء نشر إصدار جديد: تقديم المحتوى الحالي دون تخزين دائم
+            root, ext = os.path.splitext(path)
+            stem, _, digest = root.rpartition(".")
+            asset = self._assets.get(f"{stem}{ext}") if stem and digest else None
+        if asset is None:
+            return Response(status_code=404)
+        return asset.response(request.headers, immutable=False)
+
+
+class ConditionalJSONMiddleware:
+    """ميدلوير ASGI يضيف ETag من بصمة المحتوى لاستجابات JSON ويرد 304 ويضغطها بـ gzip"""
+
+    def __init__(self, app, path_prefix="/api/", compress_min_size=JSON_COMPRESS_MIN_SIZE):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.compress_min_size = compress_min_size
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "GET"
+                or not scope["path"].startswith(self.path_prefix)):
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        start_message = None
+        passthrough = False
+        chunks = []
+
+        async def buffered_send(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                # الاستجابات المتدفقة (مثل تصدير NDJSON) والأخطاء تمر كما هي
+                if message["status"] != 200 or not headers.get("content-type", "").startswith("application/json"):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                await self._send_json(start_message, b"".join(chunks), request_headers, send)
+
+        await self.app(scope, receive, buffered_send)
+
+    async def _send_json(self, start_message, body, request_headers, send):
+        etag = content_etag(body)
+        headers = MutableHeaders(raw=list(start_message["headers"]))
+        headers["ETag"] = etag
+        headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        headers.append("Vary", "Accept-Encoding")
+
+        if etag_matches(etag, request_headers.get("if-none-match")):
+            del headers["Content-Length"]
+            del headers["Content-Type"]
+            await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if len(body) >= self.compress_min_size and "gzip" in accepted_encodings(request_headers.get("accept-encoding")):
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        headers["Content-Length"] = str(len(body))
+        await send({"type": "http.response.start", "status": 200, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,61 @@
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+
+from config import JSON_BACKEND
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+# واجهة JSON موحدة لاستجابات API وأعمدة JSONB: orjson إن توفر، وإلا مكتبة json القياسية.
+# الدالتان dumps و dumps_bytes تنتجان JSON مضغوطًا (دون مسافات) بترميز UTF-8 دون تهريب الأحرف العربية.
+
+
+def _default(obj):
+    """تحويل الأنواع غير المدعومة مباشرة (التواريخ كـ ISO 8601 وغيرها كنص)"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+
+def _load_orjson():
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+_orjson = None
+if JSON_BACKEND in ("auto", "orjson"):
+    _orjson = _load_orjson()
+    if _orjson is None and JSON_BACKEND == "orjson":
+        raise RuntimeError("حزمة orjson غير مثبتة؛ ثبّتها لاستخدام JSON_BACKEND=orjson")
+elif JSON_BACKEND != "stdlib":
+    raise ValueError(f"واجهة JSON غير معروفة: {JSON_BACKEND}")
+
+if _orjson is not None:
+    backend_name = "orjson"
+    _OPTIONS = _orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        return _orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj):
+        return _orjson.dumps(obj, default=_default, option=_OPTIONS).decode("utf-8")
+
+    loads = _orjson.loads
+else:
+    backend_name = "stdlib"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+
+    def dumps(obj):
+        return _encoder.encode(obj)
+
+    def dumps_bytes(obj):
+        return _encoder.encode(obj).encode("utf-8")
+
+    loads = json.loads
@@ -0,0 +1,188 @@
+import bisect
+import threading
+import time
+
+from config import LEADERBOARD_REFRESH_SECONDS
+
+
+class SortedKeys:
+    """قائمة مرتبة مقسمة إلى كتل صغيرة: الإدراج والحذف ينقلان كتلة واحدة فقط بدل القائمة كلها"""
+
+    def __init__(self, load=1000):
+        self._load = load
+        self._buckets = []
+        # آخر (أكبر) مفتاح في كل كتلة لاختيار الكتلة بالبحث الثنائي
+        self._maxes = []
+        self._len = 0
+
+    @classmethod
+    def from_sorted(cls, keys, load=1000):
+        """بناء القائمة من مفاتيح مرتبة مسبقًا دون إعادة ترتيب"""
+        result = cls(load)
+        result._buckets = [keys[i:i + load] for i in range(0, len(keys), load)]
+        result._maxes = [bucket[-1] for bucket in result._buckets]
+        result._len = len(keys)
+        return result
+
+    def add(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            return
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+        bucket = self._buckets[i]
+        bisect.insort(bucket, key)
+        self._maxes[i] = bucket[-1]
+        self._len += 1
+        if len(bucket) > 2 * self._load:
+            # تقسيم الكتلة الكبيرة إلى نصفين
+            self._buckets[i:i + 1] = [bucket[:self._load], bucket[self._load:]]
+            self._maxes[i:i + 1] = [bucket[self._load - 1], bucket[-1]]
+
+    def remove(self, key):
+        """حذف مفتاح إن وُجد؛ يعيد True عند الحذف"""
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        bucket = self._buckets[i]
+        j = bisect.bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            return False
+        del bucket[j]
+        self._len -= 1
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+        return True
+
+    def index(self, key):
+        """موضع المفتاح (أو موضع إدراجه) في الترتيب الكامل"""
+        i = bisect.bisect_left(self._maxes, key)
+        position = sum(len(bucket) for bucket in self._buckets[:i])
+        if i < len(self._buckets):
+            position += bisect.bisect_left(self._buckets[i], key)
+        return position
+
+    def head(self, limit):
+        """أول limit مفتاح"""
+        result = []
+        for bucket in self._buckets:
+            if len(result) >= limit:
+                break
+            result.extend(bucket[:limit - len(result)])
+        return result
+
+    def __len__(self):
+        return self._len
+
+
+class Leaderboard:
+    """لوحة متصدرين مرتبة في الذاكرة تُحدَّث تدريجيًا مع كل تغيير في النقاط"""
+
+    def __init__(self, refresh_seconds=LEADERBOARD_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        # مفاتيح مرتبة (-النقاط، معرف المستخدم) بحيث يكون الأعلى نقاطًا أولاً
+        self._keys = SortedKeys()
+        # معرف المستخدم -> (اسم المستخدم، النقاط، إجمالي النقاط)
+        self._entries = {}
+        self._loaded_at = None
+        self._refreshing = False
+
+    @property
+    def loaded(self):
+        """هل تم بناء اللوحة من قاعدة البيانات"""
+        return self._loaded_at is not None
+
+    def is_stale(self):
+        """هل حان وقت إعادة المزامنة مع قاعدة البيانات (تحديثات من عمليات أخرى)"""
+        if self._loaded_at is None:
+            return True
+        if not self.refresh_seconds:
+            return False
+        return time.monotonic() - self._loaded_at >= self.refresh_seconds
+
+    def begin_refresh(self):
+        """حجز إعادة البناء لمستدعٍ واحد فقط لتجنب تكرار المسح الكامل"""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            return True
+
+    def load(self, rows):
+        """إعادة بناء اللوحة من صفوف (معرف المستخدم، اسم المستخدم، النقاط، إجمالي النقاط)
+
+        الصفوف مرتبة مسبقًا من قاعدة البيانات (النقاط تنازليًا ثم معرف المستخدم) فلا تُرتب هنا،
+        وتُستبدل اللوحة كاملة دفعة واحدة تحت القفل.
+        """
+        entries = {}
+        keys = []
+        for user_id, username, points, total_points in rows:
+            entries[user_id] = (username, points or 0, total_points or 0)
+            keys.append((-(points or 0), user_id))
+        keys = SortedKeys.from_sorted(keys)
+        with self._lock:
+            self._entries = entries
+            self._keys = keys
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+
+    def cancel_refresh(self):
+        """إلغاء حجز إعادة البناء بعد فشلها"""
+        with self._lock:
+            self._refreshing = False
+
+    def update(self, user_id, points, total_points=None, username=None):
+        """تحديث نقاط مستخدم وإعادة موضعته في الترتيب"""
+        with self._lock:
+            old = self._entries.get(user_id)
+            if old is not None:
+                old_username, old_points, old_total = old
+                self._keys.remove((-old_points, user_id))
+            else:
+                old_username, old_total = None, 0
+
+            self._entries[user_id] = (
+                username if username is not None else old_username,
+                points,
+                total_points if total_points is not None else old_total,
+            )
+            self._keys.add((-points, user_id))
+
+    def remove(self, user_id):
+        """حذف مستخدم من اللوحة"""
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old is None:
+                return
+            self._keys.remove((-old[1], user_id))
+
+    def top(self, limit=10):
+        """أعلى المستخدمين بصيغة صفوف get_leaderboard"""
+        with self._lock:
+            result = []
+            for _, user_id in self._keys.head(limit):
+                username, points, total_points = self._entries[user_id]
+                result.append((user_id, username, points, total_points))
+            return result
+
+    def rank(self, user_id):
+        """ترتيب المستخدم (يبدأ من 1) أو None إذا لم يكن موجودًا"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            return self._keys.index((-entry[1], user_id)) + 1
+
+    def __len__(self):
+        return len(self._keys)
+
+
+# اللوحة المشتركة بين ثريد البوت وثريد خادم API
+leaderboard = Leaderboard()
@@ -0,0 +1,332 @@
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+
+from database import get_db_connection
+from config import ACTIVITIES_PARTITION_MONTHS_AHEAD, ACTIVITIES_RETENTION_MONTHS, ACTIVITIES_ARCHIVE_DIR
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+# سجل النشاطات جدول مقسم شهريًا حسب created_at (الترحيل 9): الإدراج يصل إلى قسم الشهر الحالي
+# الصغير وفهرسه، واستعلامات السجل الحديث تقرأ الأقسام من الأحدث وتتوقف عند LIMIT.
+# الأقسام الباردة تُجمّع في activity_daily_rollups ثم تُؤرشف إلى ملفات CSV مضغوطة وتُحذف.
+
+_PARTITION_NAME = re.compile(r"^activities_p(\d{4})(\d{2})$")
+
+ROLLUP_STATE_NAME = "daily"
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"activities_p{month:%Y%m}"
+
+
+def list_activity_partitions(cursor):
+    """الأقسام الشهرية المرفقة بجدول النشاطات: [(الاسم، بداية الشهر)] مرتبة زمنيًا"""
+    cursor.execute(
+        '''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'activities'::regclass
+        '''
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def _create_partition(cursor, month):
+    """إنشاء قسم شهر ونقل صفوفه من القسم الافتراضي إن وُجدت ثم إرفاقه"""
+    name = partition_name(month)
+    start, end = month, add_months(month, 1)
+    cursor.execute(f'CREATE TABLE {name} (LIKE activities INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    # الإرفاق يفشل إن بقي في القسم الافتراضي صف من نطاق القسم الجديد
+    cursor.execute(
+        f'''
+        WITH moved AS (
+            DELETE FROM activities_default
+            WHERE created_at >= %s AND created_at < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        ''',
+        (start, end)
+    )
+    moved = cursor.rowcount
+    cursor.execute(f"ALTER TABLE activities ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+    return moved
+
+
+def ensure_activity_partitions(months_ahead=ACTIVITIES_PARTITION_MONTHS_AHEAD):
+    """إنشاء أقسام الشهر الحالي والأشهر القادمة الناقصة؛ يعيد أسماء الأقسام المنشأة"""
+    created = []
+    today = datetime.now().date()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            existing = {month for _, month in list_activity_partitions(cursor)}
+        conn.commit()
+
+        for offset in range(months_ahead + 1):
+            month = add_months(month_start(today), offset)
+            if month in existing:
+                continue
+            # كل قسم في معاملة مستقلة حتى لا يمنع فشل أحدها إنشاء البقية
+            with conn.cursor() as cursor:
+                moved = _create_partition(cursor, month)
+            conn.commit()
+            created.append(partition_name(month))
+            if moved:
+                logger.warning(f"تم نقل {moved} نشاط من القسم الافتراضي إلى {partition_name(month)}")
+
+    if created:
+        logger.info(f"تم إنشاء أقسام النشاطات: {', '.join(created)}")
+    return created
+
+
+def _archived_months(cursor):
+    """بدايات الأشهر التي لم تعد صفوفها الخام في الجدول: المؤرشفة (المحذوفة) والمفصولة قيد الأرشفة"""
+    cursor.execute('SELECT range_start FROM activity_archives')
+    months = {month_start(row[0]) for row in cursor.fetchall()}
+    months.update(month for _, month in list_detached_partitions(cursor))
+    return sorted(months)
+
+
+def refresh_activity_rollups(since=None):
+    """إعادة حساب التجميع اليومي لكل مستخدم ونوع نشاط من يوم since (أو آخر يوم مكتمل) حتى اليوم
+
+    يُعاد حساب اليوم الأخير المكتمل أيضًا لالتقاط النشاطات المتأخرة من كاتب النشاطات المؤجل.
+    أيام الأشهر المؤرشفة أو المفصولة لا تُمس: تجميعها هو السجل الوحيد الباقي منها.
+    """
+    today = datetime.now().date()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if since is None:
+                cursor.execute(
+                    'SELECT complete_through FROM activity_rollup_state WHERE name = %s',
+                    (ROLLUP_STATE_NAME,)
+                )
+                row = cursor.fetchone()
+                if row is not None:
+                    since = row[0]
+                else:
+                    cursor.execute('SELECT MIN(created_at)::date FROM activities')
+                    since = cursor.fetchone()[0] or today
+
+            archived = [month for month in _archived_months(cursor) if add_months(month, 1) > since]
+            if archived:
+                logger.warning(
+                    f"تخطي التجميع اليومي للأشهر المؤرشفة أو المفصولة: {', '.join(f'{m:%Y-%m}' for m in archived)}"
+                )
+            params = {"since": since, "archived": archived}
+            cursor.execute(
+                '''
+                DELETE FROM activity_daily_rollups
+                WHERE day >= %(since)s AND NOT (date_trunc('month', day)::date = ANY(%(archived)s::date[]))
+                ''',
+                params
+            )
+            cursor.execute(
+                '''
+                INSERT INTO activity_daily_rollups (user_id, day, activity_type, activity_count, points)
+                SELECT user_id, created_at::date, activity_type, COUNT(*), SUM(points)
+                FROM activities
+                WHERE created_at >= %(since)s AND user_id IS NOT NULL
+                  AND NOT (date_trunc('month', created_at)::date = ANY(%(archived)s::date[]))
+                GROUP BY user_id, created_at::date, activity_type
+                ''',
+                params
+            )
+            rows = cursor.rowcount
+            cursor.execute(
+                '''
+                INSERT INTO activity_rollup_state (name, complete_through)
+                VALUES (%s, %s)
+                ON CONFLICT (name) DO UPDATE
+                SET complete_through = EXCLUDED.complete_through, updated_at = CURRENT_TIMESTAMP
+                ''',
+                (ROLLUP_STATE_NAME, today - timedelta(days=1))
+            )
+
+    logger.info(f"تم تحديث التجميع اليومي للنشاطات من {since}: {rows} صف")
+    return {
+        "since": since.isoformat(),
+        "complete_through": (today - timedelta(days=1)).isoformat(),
+        "rows": rows,
+        "skipped_months": [month.isoformat() for month in archived],
+    }
+
+
+def list_detached_partitions(cursor):
+    """أقسام فُصلت في تشغيل أرشفة سابق لم يكتمل (جداول مستقلة بأسماء الأقسام)"""
+    cursor.execute(
+        '''
+        SELECT relname FROM pg_class
+        WHERE relkind = 'r' AND NOT relispartition AND relname ~ '^activities_p[0-9]{6}$'
+        '''
+    )
+    detached = []
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_NAME.match(name)
+        detached.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(detached, key=lambda item: item[1])
+
+
+def _archive_partition(name, month, archive_dir, attached=True):
+    """فصل قسم ونسخه إلى ملف CSV مضغوط والتحقق من عدد صفوفه ثم حذفه"""
+    start, end = month, add_months(month, 1)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    temp_path = f"{path}.partial"
+
+    if attached:
+        # معاملة قصيرة: قفل الجدول الأب يُحرر قبل النسخ فلا تنتظر الإدراجات الجديدة
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE activities DETACH PARTITION {name}')
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {name}')
+            expected = cursor.fetchone()[0]
+            with gzip.open(temp_path, "wt", encoding="utf-8", newline="") as f:
+                cursor.copy_expert(
+                    f'COPY (SELECT id, user_id, activity_type, points, details, created_at FROM {name} '
+                    f'ORDER BY created_at, id) TO STDOUT WITH (FORMAT csv, HEADER true)',
+                    f
+                )
+
+    digest = hashlib.sha256()
+    with open(temp_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    # عد السجلات لا الأسطر: حقل details قد يحتوي أسطرًا جديدة داخل علامات الاقتباس
+    with gzip.open(temp_path, "rt", encoding="utf-8", newline="") as f:
+        archived = sum(1 for _ in csv.reader(f)) - 1
+    if archived != expected:
+        os.remove(temp_path)
+        raise RuntimeError(f"عدد صفوف الأرشيف {archived} لا يطابق القسم {name} ({expected})")
+    os.replace(temp_path, path)
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                '''
+                INSERT INTO activity_archives (partition_name, range_start, range_end, row_count, file_path, sha256)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (partition_name) DO UPDATE
+                SET row_count = EXCLUDED.row_count, file_path = EXCLUDED.file_path,
+                    sha256 = EXCLUDED.sha256, archived_at = CURRENT_TIMESTAMP
+                ''',
+                (name, start, end, expected, os.path.abspath(path), digest.hexdigest())
+            )
+            cursor.execute(f'DROP TABLE {name}')
+    return {"partition": name, "rows": expected, "file": path, "sha256": digest.hexdigest()}
+
+
+def archive_activity_partitions(retention_months=ACTIVITIES_RETENTION_MONTHS, archive_dir=ACTIVITIES_ARCHIVE_DIR,
+                                dry_run=False):
+    """أرشفة الأقسام الأقدم من مدة الاحتفاظ بعد تحديث تجميعها اليومي؛ يعيد تقريرًا بما أُرشف
+
+    القسم يُفصل أولًا ثم يُنسخ ويُحذف؛ إن توقف التشغيل بعد الفصل يكمل التشغيل التالي أرشفته.
+    """
+    cutoff = add_months(month_start(datetime.now().date()), -retention_months)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cold = [
+                (name, month, True) for name, month in list_activity_partitions(cursor)
+                if add_months(month, 1) <= cutoff
+            ]
+            leftovers = [(name, month, False) for name, month in list_detached_partitions(cursor)]
+    pending = sorted(leftovers + cold, key=lambda item: item[1])
+    report = {"cutoff": cutoff.isoformat(), "partitions": [name for name, _, _ in pending], "archived": []}
+    if dry_run or not pending:
+        return report
+
+    # التجميع اليومي يبقى بعد حذف الصفوف الخام فيجب أن يغطي الأقسام الباردة أولًا
+    if cold:
+        refresh_activity_rollups(since=cold[0][1])
+
+    for name, month, attached in pending:
+        result = _archive_partition(name, month, archive_dir, attached=attached)
+        report["archived"].append(result)
+        logger.info(f"تمت أرشفة {name}: {result['rows']} نشاط في {result['file']}")
+    return report
+
+
+def restore_activity_archive(path):
+    """إعادة تحميل ملف أرشيف إلى جدول النشاطات (ينشئ قسم الشهر ويرفقه)"""
+    name = os.path.basename(path).split(".", 1)[0]
+    match = _PARTITION_NAME.match(name)
+    if not match:
+        raise ValueError(f"اسم ملف أرشيف غير متوقع: {path}")
+    month = date(int(match.group(1)), int(match.group(2)), 1)
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if month not in {m for _, m in list_activity_partitions(cursor)}:
+                _create_partition(cursor, month)
+            with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+                cursor.copy_expert(
+                    'COPY activities (id, user_id, activity_type, points, details, created_at) '
+                    'FROM STDIN WITH (FORMAT csv, HEADER true)',
+                    f
+                )
+            restored = cursor.rowcount
+            cursor.execute('DELETE FROM activity_archives WHERE partition_name = %s', (name,))
+    logger.info(f"تمت استعادة {restored} نشاط من {path}")
+    return {"partition": name, "rows": restored}
+
+
+def ledger_status():
+    """الأقسام الحالية وأحجامها وحالة التجميع اليومي والأرشيفات"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            partitions = list_activity_partitions(cursor)
+            sizes = {}
+            if partitions:
+                cursor.execute(
+                    '''
+                    SELECT relname, reltuples::bigint, pg_total_relation_size(oid)
+                    FROM pg_class WHERE relname = ANY(%s)
+                    ''',
+                    ([name for name, _ in partitions] + ['activities_default'],)
+                )
+                sizes = {name: (rows, size) for name, rows, size in cursor.fetchall()}
+            cursor.execute('SELECT COUNT(*) FROM activities_default')
+            default_rows = cursor.fetchone()[0]
+            cursor.execute('SELECT complete_through FROM activity_rollup_state WHERE name = %s', (ROLLUP_STATE_NAME,))
+            state = cursor.fetchone()
+            cursor.execute('SELECT partition_name, row_count, file_path FROM activity_archives ORDER BY range_start')
+            archives = cursor.fetchall()
+    return {
+        "partitions": [
+            {"name": name, "month": month.isoformat(),
+             "estimated_rows": sizes.get(name, (0, 0))[0], "bytes": sizes.get(name, (0, 0))[1]}
+            for name, month in partitions
+        ],
+        "default_partition_rows": default_rows,
+        "rollups_complete_through": state[0].isoformat() if state else None,
+        "archives": [{"partition": name, "rows": rows, "file": path} for name, rows, path in archives],
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(ledger_status(), ensure_ascii=False, indent=2))
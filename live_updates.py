@@ -0,0 +1,465 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+import asyncpg
+import psycopg2.extras
+
+import json_backend
+from cache import user_cache
+from leaderboard import leaderboard
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+# كل تغيير في النقاط يُوزع على اشتراكات عملية خادم API نفسها مباشرة، ويُرسل عبر
+# NOTIFY إلى العمليات الأخرى (عمال API الآخرون وعملية البوت في وضع polling).
+# الاشتراك الخامل لا يملك إلا طابورًا صغيرًا وحدثًا، فيتسع العامل لعشرات الآلاف منها.
+
+NOTIFY_SQL = 'SELECT pg_notify(v.channel, v.payload) FROM (VALUES %s) AS v(channel, payload)'
+
+# كل عملية API لديها اتصالات مباشرة (أو تخزين مؤقت محلي لملفات المستخدمين يحتاج الإبطال) تحمل
+# قفلًا استشاريًا مشتركًا على اتصال الاستماع، فيعرف الناشرون من pg_locks هل توجد عملية أخرى
+# تستحق إرسال NOTIFY إليها
+PRESENCE_LOCK_KEY = 720250002
+PRESENCE_SQL = '''
+    SELECT EXISTS (
+        SELECT 1 FROM pg_locks
+        WHERE locktype = 'advisory' AND classid = 0 AND objid = %s AND objsubid = 1 AND granted AND pid <> %s
+    )
+'''
+
+# حد حجم رسالة NOTIFY في PostgreSQL هو 8000 بايت
+NOTIFY_MAX_PAYLOAD = 7900
+
+# تعليمة إعادة الاتصال للمتصفح وتعليق نبض يبقي الاتصال مفتوحًا عبر الوكلاء
+STREAM_PREAMBLE = b"retry: 5000\n\n"
+HEARTBEAT_FRAME = b": ping\n\n"
+
+
+def encode_event(event, data):
+    """ترميز حدث بصيغة Server-Sent Events"""
+    return b"event: " + event.encode() + b"\ndata: " + json_backend.dumps_bytes(data) + b"\n\n"
+
+
+RESYNC_FRAME = encode_event("resync", {})
+
+
+class Subscription:
+    """اتصال مشترك واحد: طابور محدود من الأحداث المرمزة وحدث إيقاظ"""
+
+    __slots__ = ("user_id", "_frames", "_wakeup", "overflowed")
+
+    def __init__(self, user_id, max_pending):
+        self.user_id = user_id
+        self._frames = deque(maxlen=max_pending)
+        self._wakeup = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, frame):
+        """إضافة حدث؛ العميل البطيء يفقد الأقدم ويُطلب منه إعادة المزامنة. يعيد True عند الإسقاط"""
+        dropped = len(self._frames) == self._frames.maxlen
+        if dropped:
+            self.overflowed = True
+        self._frames.append(frame)
+        self._wakeup.set()
+        return dropped
+
+    async def next_frames(self, timeout):
+        """انتظار الأحداث المعلقة حتى المهلة؛ يعيد قائمة فارغة عند انقضائها"""
+        if not self._frames:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        frames = list(self._frames)
+        self._frames.clear()
+        if self.overflowed:
+            self.overflowed = False
+            frames = [RESYNC_FRAME]
+        return frames
+
+
+class LiveHub:
+    """موزع التحديثات المباشرة (الرصيد والنشاطات ولوحة المتصدرين) على اشتراكات المستخدمين"""
+
+    def __init__(self, connection_factory, dsn, channel="points_updates", enabled=True, notify=True,
+                 max_connections=50000, max_pending=32, leaderboard_interval=2.0, leaderboard_size=10,
+                 notify_batch_size=500, max_outbox=20000, presence_interval=2.0):
+        self._connection_factory = connection_factory
+        self._dsn = dsn
+        self.channel = channel
+        self.enabled = enabled
+        self.notify = notify
+        self.max_connections = max_connections
+        self.max_pending = max_pending
+        self.leaderboard_interval = leaderboard_interval
+        self.leaderboard_size = leaderboard_size
+        self.notify_batch_size = notify_batch_size
+        self.max_outbox = max_outbox
+        self.presence_interval = presence_interval
+        # يميز رسائل هذه العملية فلا تُوزع مرتين عند استقبالها عبر LISTEN
+        self.origin = uuid.uuid4().hex
+
+        # معرف المستخدم -> مجموعة الاشتراكات (تُعدل من حلقة الأحداث فقط)
+        self._subscribers = {}
+        self._connections = 0
+        self._loop = None
+        self._tasks = []
+        self._listening = False
+        self._leaderboard_dirty = False
+        self._last_leaderboard = None
+
+        # طابور رسائل NOTIFY وثريد إرسالها لكل عملية
+        self._outbox = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+        # هل لدى عملية أخرى اشتراكات (نتيجة آخر فحص لـ pg_locks ووقته)، ومعرف اتصال الاستماع لاستثناء قفلنا
+        self._peers_present = True
+        self._presence_checked_at = None
+        self._listener_pid = 0
+
+        # عدادات المقاييس
+        self._published = 0
+        self._delivered = 0
+        self._overflows = 0
+        self._rejected = 0
+        self._notify_sent = 0
+        self._notify_dropped = 0
+        self._notify_skipped = 0
+        self._notify_failures = 0
+        self._notify_received = 0
+
+    # الاشتراكات (داخل حلقة أحداث خادم API)
+
+    def has_capacity(self):
+        """فحص مبدئي قبل بدء الاستجابة: هل يتسع الموزع لاتصال جديد"""
+        if self._connections >= self.max_connections:
+            self._rejected += 1
+            return False
+        return True
+
+    def subscribe(self, user_id):
+        """تسجيل اتصال جديد للمستخدم؛ يعيد None عند بلوغ الحد الأقصى للاتصالات"""
+        if self._connections >= self.max_connections:
+            self._rejected += 1
+            return None
+        subscription = Subscription(user_id, self.max_pending)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        self._connections += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """إلغاء تسجيل اتصال منتهٍ"""
+        subscriptions = self._subscribers.get(subscription.user_id)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscribers[subscription.user_id]
+        self._connections -= 1
+
+    async def stream(self, user_id, heartbeat):
+        """مولد جسم استجابة SSE: الأحداث فور وصولها ونبض عند الخمول
+
+        الاشتراك يُسجل عند بدء إرسال الاستجابة فعليًا ويُلغى عند انتهائها بأي سبب،
+        فلا يبقى اشتراك معلق إذا انقطع العميل أو فشلت الاستجابة قبل بدء المولد.
+        """
+        subscription = self.subscribe(user_id)
+        if subscription is None:
+            # امتلأت الاتصالات بعد الفحص المبدئي؛ ينهي المتصفح الاستجابة الفارغة ويعيد المحاولة لاحقًا
+            return
+        try:
+            yield STREAM_PREAMBLE
+            while True:
+                frames = await subscription.next_frames(heartbeat)
+                yield b"".join(frames) if frames else HEARTBEAT_FRAME
+        finally:
+            self.unsubscribe(subscription)
+
+    # النشر (من أي ثريد أو عملية)
+
+    def publish_points(self, user_id, points, total_points, activity=None):
+        """نشر تغيير في رصيد المستخدم مع النشاط المسبب له (النوع، النقاط، التفاصيل) إن وُجد"""
+        if not self.enabled or not (self._subscribers or self._peers_listening()):
+            return
+        data = {"points": points, "total_points": total_points}
+        if activity is not None:
+            activity_type, delta, details = activity
+            data["activity"] = {
+                "activity_type": activity_type,
+                "points": delta,
+                "created_at": datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+                "details": details or {},
+            }
+        self.publish(user_id, "balance", data)
+
+    def publish(self, user_id, event, data):
+        """توزيع حدث على اشتراكات المستخدم في هذه العملية وإرساله إلى العمليات الأخرى"""
+        if not self.enabled:
+            return
+        self._published += 1
+        loop = self._loop
+        if loop is not None:
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                self._dispatch(user_id, event, data)
+            else:
+                loop.call_soon_threadsafe(self._dispatch, user_id, event, data)
+        if self.notify and self._peers_listening():
+            self._enqueue_notify(user_id, event, data)
+
+    def _dispatch(self, user_id, event, data):
+        """تسليم الحدث لاشتراكات المستخدم (داخل حلقة الأحداث)"""
+        if event == "balance":
+            self._leaderboard_dirty = True
+        subscriptions = self._subscribers.get(user_id)
+        if not subscriptions:
+            return
+        if event == "balance" and leaderboard.loaded:
+            data = dict(data, rank=leaderboard.rank(user_id))
+        frame = encode_event(event, data)
+        for subscription in subscriptions:
+            if subscription.push(frame):
+                self._overflows += 1
+        self._delivered += len(subscriptions)
+
+    def _broadcast(self, frame):
+        """تسليم حدث مرمز مرة واحدة لكل الاشتراكات"""
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                if subscription.push(frame):
+                    self._overflows += 1
+        self._delivered += self._connections
+
+    # NOTIFY بين العمليات
+
+    def _peers_listening(self):
+        """هل لدى عملية أخرى اشتراكات مباشرة؛ يُفترض نعم حتى يتحقق ثريد الإرسال مجددًا بعد انقضاء الفاصل"""
+        if not self.notify:
+            return False
+        checked_at = self._presence_checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.presence_interval:
+            return True
+        return self._peers_present
+
+    def _ensure_started(self):
+        """تشغيل ثريد الإرسال مرة واحدة لكل عملية"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="live-notify", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop_notifier)
+
+    def _enqueue_notify(self, user_id, event, data):
+        """إضافة الحدث إلى طابور NOTIFY؛ التحديثات المباشرة بأفضل جهد فيُسقط الفائض"""
+        payload = json_backend.dumps({"o": self.origin, "u": user_id, "e": event, "d": data})
+        if len(payload.encode()) > NOTIFY_MAX_PAYLOAD and "activity" in data:
+            data = {key: value for key, value in data.items() if key != "activity"}
+            payload = json_backend.dumps({"o": self.origin, "u": user_id, "e": event, "d": data})
+        self._ensure_started()
+        with self._cond:
+            if len(self._outbox) >= self.max_outbox:
+                self._notify_dropped += 1
+                return
+            self._outbox.append(payload)
+            # الثريد يفرغ الطابور كاملًا في كل دورة فيكفي إيقاظه عند أول رسالة
+            if len(self._outbox) == 1:
+                self._cond.notify()
+
+    def _run(self):
+        """حلقة ثريد الإرسال: ترسل ما تجمع في الطابور بعبارة واحدة لكل دفعة"""
+        while True:
+            with self._cond:
+                while not self._stopping and not self._outbox:
+                    self._cond.wait()
+                stopping = self._stopping
+            self._flush_notify()
+            if stopping:
+                return
+
+    def _flush_notify(self):
+        """إرسال رسائل NOTIFY المعلقة على دفعات في معاملة لكل دفعة"""
+        while True:
+            with self._cond:
+                if not self._outbox:
+                    return
+                batch = [self._outbox.popleft() for _ in range(min(self.notify_batch_size, len(self._outbox)))]
+            try:
+                with self._connection_factory() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(PRESENCE_SQL, (PRESENCE_LOCK_KEY, self._listener_pid))
+                        present = cursor.fetchone()[0]
+                        if present:
+                            psycopg2.extras.execute_values(
+                                cursor, NOTIFY_SQL, [(self.channel, payload) for payload in batch],
+                                page_size=self.notify_batch_size
+                            )
+            except Exception as e:
+                logger.error(f"خطأ في إرسال التحديثات المباشرة ({len(batch)} رسالة): {e}")
+                with self._cond:
+                    self._notify_failures += 1
+                    self._notify_dropped += len(batch)
+                return
+            self._peers_present = present
+            self._presence_checked_at = time.monotonic()
+            with self._cond:
+                if present:
+                    self._notify_sent += len(batch)
+                else:
+                    self._notify_skipped += len(batch)
+
+    def stop_notifier(self):
+        """إيقاف ثريد الإرسال بعد إرسال ما تبقى في الطابور"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        thread.join(timeout=10)
+        self._thread = None
+
+    def _on_notification(self, connection, pid, channel, payload):
+        """استقبال حدث من عملية أخرى وتوزيعه محليًا"""
+        try:
+            message = json_backend.loads(payload)
+        except ValueError:
+            logger.warning(f"رسالة تحديث مباشر غير صالحة على {channel}")
+            return
+        if message.get("o") == self.origin:
+            return
+        self._notify_received += 1
+        user_id, event, data = message["u"], message["e"], message["d"]
+        if event == "balance":
+            # الناشر أبطل التخزين المشترك بنفسه، أما المحلي فنسخته في هذه العملية قديمة الآن
+            if not user_cache.shared:
+                user_cache.delete(user_id)
+            # لوحة المتصدرين في الذاكرة تتبع تغييرات العمليات الأخرى أيضًا
+            if leaderboard.loaded:
+                leaderboard.update(user_id, data["points"], data["total_points"])
+        self._dispatch(user_id, event, data)
+
+    async def _listen_loop(self, check_interval=30.0, retry_delay=5.0):
+        """الاستماع لقناة NOTIFY باتصال مخصص مع إعادة الاتصال عند انقطاعه
+
+        يحمل الاتصال نفسه قفل الحضور ما دامت في العملية اشتراكات أو تخزين مؤقت محلي يحتاج الإبطال،
+        فيُحرر تلقائيًا إذا انقطع.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self._dsn)
+                await connection.add_listener(self.channel, self._on_notification)
+                self._listener_pid = connection.get_server_pid()
+                self._listening = True
+                logger.info(f"بدء الاستماع للتحديثات المباشرة على القناة {self.channel}")
+                present = False
+                checked_at = loop.time()
+                while True:
+                    await asyncio.sleep(self.presence_interval)
+                    if bool(self._connections or not user_cache.shared) != present:
+                        present = not present
+                        await connection.execute(
+                            'SELECT pg_advisory_lock_shared($1)' if present else 'SELECT pg_advisory_unlock_shared($1)',
+                            PRESENCE_LOCK_KEY
+                        )
+                    elif loop.time() - checked_at >= check_interval:
+                        await connection.execute("SELECT 1")
+                    else:
+                        continue
+                    checked_at = loop.time()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"انقطع الاستماع للتحديثات المباشرة: {e}")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+                if self._listening:
+                    self._listening = False
+                    # ربما فاتت أحداث أثناء الانقطاع فيعيد العملاء مزامنة حالتهم
+                    self._broadcast(RESYNC_FRAME)
+            await asyncio.sleep(retry_delay)
+
+    # لوحة المتصدرين
+
+    def _leaderboard_snapshot(self):
+        return [
+            {"user_id": user_id, "username": username, "points": points, "total_points": total_points}
+            for user_id, username, points, total_points in leaderboard.top(self.leaderboard_size)
+        ]
+
+    async def _leaderboard_loop(self):
+        """بث أعلى المتصدرين لكل الاشتراكات عند تغيرهم، بحد أقصى مرة كل فاصل زمني"""
+        while True:
+            await asyncio.sleep(self.leaderboard_interval)
+            if not self._leaderboard_dirty or not self._connections or not leaderboard.loaded:
+                continue
+            self._leaderboard_dirty = False
+            snapshot = self._leaderboard_snapshot()
+            if snapshot == self._last_leaderboard:
+                continue
+            self._last_leaderboard = snapshot
+            self._broadcast(encode_event("leaderboard", {"leaderboard": snapshot}))
+
+    # دورة الحياة
+
+    async def start(self):
+        """ربط الموزع بحلقة أحداث خادم API وبدء الاستماع وبث لوحة المتصدرين"""
+        if not self.enabled or self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        if leaderboard.loaded:
+            self._last_leaderboard = self._leaderboard_snapshot()
+        self._tasks = [asyncio.create_task(self._leaderboard_loop())]
+        if self.notify:
+            self._tasks.append(asyncio.create_task(self._listen_loop()))
+
+    async def stop(self):
+        """إيقاف مهام الموزع وثريد الإرسال"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        self.stop_notifier()
+
+    def stats(self):
+        """مقاييس الاتصالات والأحداث ورسائل NOTIFY"""
+        with self._cond:
+            outbox = len(self._outbox)
+        return {
+            "connections": self._connections,
+            "users": len(self._subscribers),
+            "listening": int(self._listening),
+            "published": self._published,
+            "delivered": self._delivered,
+            "overflows": self._overflows,
+            "rejected": self._rejected,
+            "notify_queue_depth": outbox,
+            "notify_sent": self._notify_sent,
+            "notify_dropped": self._notify_dropped,
+            "notify_skipped": self._notify_skipped,
+            "notify_failures": self._notify_failures,
+            "notify_received": self._notify_received,
+        }
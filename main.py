@@ -1,11 +1,14 @@
-import threading
+import argparse
 import logging
+import multiprocessing
 import os
-import time
-import psycopg2.extras
-from bot import start_bot
 from api import run_api
-from database import create_table
+from database import create_table, close_pool
+from config import (
+    BOT_MODE, API_HOST, API_PORT, API_WORKERS, CACHE_BACKEND, USER_CACHE_TTL,
+    LEADERBOARD_REFRESH_SECONDS, DB_POOL_MAX_SIZE, ASYNC_DB_POOL_MAX_SIZE, WEBHOOK_AUTO_SET,
+    BOT_METRICS_PORT
+)
 
 # إعداد السجلات
 logging.basicConfig(
@@ -14,19 +17,108 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# سيتم التعامل مع JSON داخل الدوال التي تتطلب ذلك
+# مهلة انتظار إنهاء عملية البوت قبل إيقافها قسرًا (بالثواني)
+BOT_SHUTDOWN_TIMEOUT = 30
+
+
+def run_bot_process():
+    """نقطة دخول عملية البوت المنفصلة (وضع الاستطلاع)"""
+    from bot import start_bot
+    if BOT_METRICS_PORT:
+        from metrics import serve_metrics
+        serve_metrics(API_HOST, BOT_METRICS_PORT)
+    try:
+        start_bot()
+    finally:
+        from database import activity_writer
+        activity_writer.stop()
+        close_pool()
+
+
+def log_topology(workers, host, port, bot_process):
+    """تسجيل توزيع العمليات وحالة الموارد المشتركة عند البدء"""
+    logger.info(f"خادم API: {workers} عملية على {host}:{port}")
+    if bot_process is not None:
+        logger.info(f"البوت: وضع الاستطلاع في عملية منفصلة (pid={bot_process.pid})")
+    elif BOT_MODE == "webhook":
+        logger.info(f"البوت: وضع الـ webhook داخل عمليات خادم API ({workers})")
+    else:
+        logger.info("البوت: معطل")
+
+    # كل عملية تفتح تجمعي اتصالات خاصين بها (المتزامن وغير المتزامن)
+    processes = workers + (1 if bot_process is not None else 0)
+    max_connections = workers * (DB_POOL_MAX_SIZE + ASYNC_DB_POOL_MAX_SIZE)
+    if bot_process is not None:
+        max_connections += DB_POOL_MAX_SIZE
+    logger.info(f"قاعدة البيانات: حتى {max_connections} اتصال من {processes} عملية")
+
+    if CACHE_BACKEND == "local" and processes > 1:
+        logger.warning(
+            f"التخزين المؤقت محلي لكل عملية: قد تبقى قيمة قديمة في عملية أخرى حتى {USER_CACHE_TTL} ثانية؛ "
+            f"استخدم CACHE_BACKEND=redis لتخزين مشترك"
+        )
+    else:
+        logger.info(f"التخزين المؤقت: {CACHE_BACKEND}")
+    if processes > 1:
+        logger.info(f"لوحة المتصدرين: نسخة لكل عملية تُعاد مزامنتها كل {LEADERBOARD_REFRESH_SECONDS} ثانية")
+
+
+def stop_bot_process(bot_process):
+    """إيقاف عملية البوت بإشارة SIGTERM ثم قسرًا عند تجاوز المهلة"""
+    if bot_process is None or not bot_process.is_alive():
+        return
+    logger.info("جاري إيقاف عملية البوت...")
+    bot_process.terminate()
+    bot_process.join(BOT_SHUTDOWN_TIMEOUT)
+    if bot_process.is_alive():
+        logger.warning("لم تتوقف عملية البوت خلال المهلة؛ جاري إيقافها قسرًا")
+        bot_process.kill()
+        bot_process.join()
+
+
+def build_parser():
+    """إنشاء محلل أوامر سطر الأوامر"""
+    parser = argparse.ArgumentParser(description="تشغيل نظام نقاط Forex Fabric")
+    parser.add_argument("--host", default=API_HOST, help="عنوان خادم API")
+    parser.add_argument("--port", type=int, default=API_PORT, help="منفذ خادم API")
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="عدد عمليات خادم API")
+    parser.add_argument("--no-bot", action="store_true", help="عدم تشغيل عملية البوت بوضع الاستطلاع")
+    return parser
+
 
 if __name__ == "__main__":
-    # تهيئة قاعدة البيانات
+    args = build_parser().parse_args()
+    workers = max(1, args.workers)
+
+    # تهيئة قاعدة البيانات مرة واحدة قبل تشغيل العمليات
     logger.info("جاري تهيئة قاعدة البيانات...")
     create_table()
-    
-    # بدء خادم API في ثريد منفصل
-    logger.info("جاري بدء خادم FastAPI...")
-    api_thread = threading.Thread(target=run_api)
-    api_thread.daemon = True
-    api_thread.start()
-    
-    # بدء بوت تيليجرام في الثريد الرئيسي
-    logger.info("جاري بدء بوت تيليجرام...")
-    start_bot()
\ No newline at end of file
+    # لا يحتاج المشغل إلى اتصالاته بعد الترحيلات، والعمليات الفرعية تفتح تجمعاتها الخاصة
+    close_pool()
+
+    bot_process = None
+    if BOT_MODE == "webhook":
+        # الفشل مبكرًا قبل تشغيل العمال إذا لم يُعيَّن سر الـ webhook
+        from bot import check_webhook_secret
+        check_webhook_secret()
+        if workers > 1 and WEBHOOK_AUTO_SET:
+            # تسجيل الـ webhook مرة واحدة هنا بدل تسجيله من كل عامل
+            from bot import register_webhook
+            register_webhook()
+            os.environ["WEBHOOK_AUTO_SET"] = "0"
+    elif not args.no_bot:
+        # عملية منفصلة للبوت حتى لا يتشارك قفل GIL مع خادم API
+        bot_process = multiprocessing.get_context("spawn").Process(
+            target=run_bot_process, name="telegram-bot"
+        )
+        bot_process.start()
+
+    log_topology(workers, args.host, args.port, bot_process)
+
+    try:
+        # يتعامل uvicorn مع SIGINT/SIGTERM وينهي الطلبات الجارية في كل عامل قبل الخروج
+        run_api(args.host, args.port, workers)
+    finally:
+        stop_bot_process(bot_process)
+        close_pool()
+        logger.info("تم إيقاف النظام")
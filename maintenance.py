@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import sys
+from datetime import date
+
+from database import reconcile_referral_counts, purge_idempotency_keys
+from grants import bulk_grant, read_grants_csv, get_campaign
+from referral_fraud import run_fraud_scan
+from ledger import (
+    ensure_activity_partitions, refresh_activity_rollups, archive_activity_partitions,
+    restore_activity_archive, ledger_status
+)
+from config import (
+    IDEMPOTENCY_KEY_TTL_HOURS, GRANT_CHUNK_SIZE, ACTIVITIES_PARTITION_MONTHS_AHEAD,
+    ACTIVITIES_RETENTION_MONTHS, ACTIVITIES_ARCHIVE_DIR, REFERRAL_FRAUD_BURST_MINUTES,
+    REFERRAL_FRAUD_BURST_LIMIT, REFERRAL_FRAUD_FRESH_MINUTES, REFERRAL_FRAUD_MIN_REFERRALS,
+    REFERRAL_FRAUD_THRESHOLD
+)
+
+# إعداد السجلات
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# مهام الصيانة الدورية التي تُشغَّل يدويًا أو من cron
+
+
+def reconcile_referrals_command(args):
+    """مطابقة عدادات الإحالات المخزنة مع جدول الإحالات"""
+    report = reconcile_referral_counts(fix=not args.dry_run, sample_size=args.sample)
+    if report is None:
+        return 1
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def purge_idempotency_keys_command(args):
+    """حذف مفاتيح منع التكرار المنتهية"""
+    deleted = purge_idempotency_keys(max_age_hours=args.older_than_hours)
+    if deleted is None:
+        return 1
+    print(json.dumps({"deleted": deleted}, ensure_ascii=False))
+    return 0
+
+
+def grant_campaign_command(args):
+    """منح النقاط بالجملة من ملف CSV لحملة، أو عرض حالتها"""
+    if args.status:
+        campaign = get_campaign(args.campaign)
+        if campaign is None:
+            print(f"الحملة {args.campaign} غير موجودة")
+            return 1
+        print(json.dumps(campaign, ensure_ascii=False, indent=2))
+        return 0
+    if not args.csv:
+        print("يجب تحديد ملف CSV عبر --csv")
+        return 2
+    try:
+        report = bulk_grant(
+            args.campaign, read_grants_csv(args.csv, args.activity_type),
+            chunk_size=args.chunk_size, description=args.description, resume=not args.rescan
+        )
+    except Exception as e:
+        # الدفعات المثبتة تبقى مسجلة، وإعادة تشغيل الأمر نفسه تستأنف من آخر دفعة
+        logger.error(f"توقف منح الحملة {args.campaign}: {e}")
+        return 1
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def partitions_command(args):
+    """إنشاء أقسام النشاطات الشهرية القادمة"""
+    created = ensure_activity_partitions(months_ahead=args.months_ahead)
+    print(json.dumps({"created": created}, ensure_ascii=False, indent=2))
+    return 0
+
+
+def rollup_activities_command(args):
+    """تحديث جدول التجميع اليومي للنشاطات"""
+    report = refresh_activity_rollups(since=args.since)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def archive_activities_command(args):
+    """أرشفة أقسام النشاطات الأقدم من مدة الاحتفاظ ثم حذفها"""
+    try:
+        report = archive_activity_partitions(
+            retention_months=args.older_than_months, archive_dir=args.archive_dir, dry_run=args.dry_run
+        )
+    except Exception as e:
+        # القسم المفصول قبل التوقف يُكمل في التشغيل التالي
+        logger.error(f"توقفت أرشفة النشاطات: {e}")
+        return 1
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def restore_activities_command(args):
+    """استعادة ملف أرشيف نشاطات إلى قاعدة البيانات"""
+    try:
+        report = restore_activity_archive(args.file)
+    except ValueError as e:
+        print(str(e))
+        return 2
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def ledger_status_command(args):
+    """عرض أقسام سجل النشاطات وحالة التجميع والأرشيفات"""
+    print(json.dumps(ledger_status(), ensure_ascii=False, indent=2))
+    return 0
+
+
+def referral_fraud_command(args):
+    """تقييم شبكة الإحالات كاملة والإبلاغ عن المجموعات المشبوهة"""
+    report = run_fraud_scan(
+        threshold=args.threshold, limit=args.limit, save=args.save,
+        burst_minutes=args.burst_minutes, burst_limit=args.burst_limit,
+        fresh_minutes=args.fresh_minutes, min_referrals=args.min_referrals,
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def build_parser():
+    """إنشاء محلل أوامر سطر الأوامر"""
+    parser = argparse.ArgumentParser(description="مهام صيانة نظام نقاط Forex Fabric")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reconcile = subparsers.add_parser(
+        "reconcile-referrals", help="إعادة حساب عدادات الإحالات والإبلاغ عن الانحراف"
+    )
+    reconcile.add_argument("--dry-run", action="store_true", help="الإبلاغ فقط دون التصحيح")
+    reconcile.add_argument("--sample", type=int, default=20, help="عدد أمثلة الانحراف المعروضة")
+    reconcile.set_defaults(func=reconcile_referrals_command)
+
+    purge_keys = subparsers.add_parser(
+        "purge-idempotency-keys", help="حذف مفاتيح منع تكرار السحب الأقدم من المدة المحددة"
+    )
+    purge_keys.add_argument(
+        "--older-than-hours", type=int, default=IDEMPOTENCY_KEY_TTL_HOURS, help="عمر المفاتيح المحذوفة بالساعات"
+    )
+    purge_keys.set_defaults(func=purge_idempotency_keys_command)
+
+    grant = subparsers.add_parser(
+        "grant-campaign", help="منح النقاط بالجملة من ملف CSV (user_id,points[,activity_type[,details]])"
+    )
+    grant.add_argument("--campaign", required=True, help="معرف الحملة؛ كل مستخدم يُمنح مرة واحدة لكل حملة")
+    grant.add_argument("--csv", help="مسار ملف المنح")
+    grant.add_argument("--activity-type", default="campaign", help="نوع النشاط للصفوف التي لا تحدده")
+    grant.add_argument("--description", help="وصف الحملة")
+    grant.add_argument("--chunk-size", type=int, default=GRANT_CHUNK_SIZE, help="عدد الصفوف في كل دفعة")
+    grant.add_argument("--rescan", action="store_true", help="إعادة قراءة الملف من بدايته بدل تخطي الصفوف المعالجة")
+    grant.add_argument("--status", action="store_true", help="عرض حالة الحملة فقط")
+    grant.set_defaults(func=grant_campaign_command)
+
+    partitions = subparsers.add_parser("partitions", help="إنشاء أقسام النشاطات الشهرية القادمة مسبقًا")
+    partitions.add_argument(
+        "--months-ahead", type=int, default=ACTIVITIES_PARTITION_MONTHS_AHEAD, help="عدد الأشهر القادمة المجهزة"
+    )
+    partitions.set_defaults(func=partitions_command)
+
+    rollup = subparsers.add_parser("rollup-activities", help="تحديث التجميع اليومي للنشاطات")
+    rollup.add_argument(
+        "--since", type=date.fromisoformat, help="إعادة الحساب من هذا اليوم (YYYY-MM-DD) بدل آخر يوم مكتمل"
+    )
+    rollup.set_defaults(func=rollup_activities_command)
+
+    archive = subparsers.add_parser(
+        "archive-activities", help="أرشفة أقسام النشاطات القديمة إلى ملفات CSV مضغوطة ثم حذفها"
+    )
+    archive.add_argument(
+        "--older-than-months", type=int, default=ACTIVITIES_RETENTION_MONTHS, help="مدة الاحتفاظ بالأشهر"
+    )
+    archive.add_argument("--archive-dir", default=ACTIVITIES_ARCHIVE_DIR, help="مجلد ملفات الأرشيف")
+    archive.add_argument("--dry-run", action="store_true", help="عرض الأقسام المستحقة فقط")
+    archive.set_defaults(func=archive_activities_command)
+
+    restore = subparsers.add_parser("restore-activities", help="استعادة ملف أرشيف نشاطات (activities_pYYYYMM.csv.gz)")
+    restore.add_argument("file", help="مسار ملف الأرشيف")
+    restore.set_defaults(func=restore_activities_command)
+
+    status = subparsers.add_parser("ledger-status", help="عرض أقسام سجل النشاطات وحالة التجميع والأرشيفات")
+    status.set_defaults(func=ledger_status_command)
+
+    fraud = subparsers.add_parser(
+        "referral-fraud", help="تقييم شبكة الإحالات بحثًا عن اندفاعات الحسابات الجديدة والحلقات والمجموعات المشبوهة"
+    )
+    fraud.add_argument("--threshold", type=float, default=REFERRAL_FRAUD_THRESHOLD, help="درجة تعليم المحيل مشبوهًا (0 إلى 1)")
+    fraud.add_argument("--burst-minutes", type=int, default=REFERRAL_FRAUD_BURST_MINUTES, help="نافذة رصد الاندفاع بالدقائق")
+    fraud.add_argument("--burst-limit", type=int, default=REFERRAL_FRAUD_BURST_LIMIT, help="عدد الإحالات في النافذة الذي يعد اندفاعًا كاملًا")
+    fraud.add_argument("--fresh-minutes", type=int, default=REFERRAL_FRAUD_FRESH_MINUTES, help="عمر الحساب الجديد عند إحالته بالدقائق")
+    fraud.add_argument("--min-referrals", type=int, default=REFERRAL_FRAUD_MIN_REFERRALS, help="أقل عدد إحالات لتقييم المحيل")
+    fraud.add_argument("--limit", type=int, default=50, help="عدد المجموعات والمحيلين المعروضين")
+    fraud.add_argument("--save", action="store_true", help="حفظ الدرجات في جدول referral_risk_scores")
+    fraud.set_defaults(func=referral_fraud_command)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
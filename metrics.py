@@ -0,0 +1,373 @@
+import bisect
+import functools
+import inspect
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+# مقاييس الأداء بصيغة Prometheus النصية دون اعتماديات خارجية: مدرجات زمنية وعدادات
+# بتسميات، إضافة إلى جامعين يحولون قواميس stats() الموجودة (التجمع، التخزين المؤقت،
+# كاتب النشاطات، ...) إلى مقاييس عند كل طلب لـ /metrics. كل عملية تحتفظ بمقاييسها.
+
+# حدود فئات مدرج زمن المعالجة (بالثواني)
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# استعلامات قاعدة البيانات واستعارة الاتصالات أسرع بكثير من معالجات البوت
+DB_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class LatencyHistogram:
+    """مدرج تكراري تراكمي لزمن المعالجة، آمن بين الثريدات"""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+            self._count += 1
+
+    def snapshot(self):
+        """إرجاع الفئات التراكمية والمجموع والعدد"""
+        with self._lock:
+            cumulative = []
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), self._counts):
+                running += count
+                cumulative.append((bound, running))
+            return {"buckets": cumulative, "sum": self._sum, "count": self._count}
+
+
+class _Family:
+    """مقياس بتسميات: قيمة مستقلة لكل مجموعة قيم تسميات"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """القيمة الخاصة بمجموعة تسميات (تُنشأ عند أول استخدام)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"المقياس {self.name} يتطلب التسميات {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class Histogram(_Family):
+    """عائلة مدرجات زمنية بتسميات"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return LatencyHistogram(self.buckets)
+
+    def observe(self, seconds, *values):
+        self.labels(*values).observe(seconds)
+
+    def collect(self):
+        for values, histogram in self.children():
+            yield dict(zip(self.labelnames, values)), histogram.snapshot()
+
+
+class _CounterValue:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Family):
+    """عائلة عدادات متزايدة بتسميات"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, *values, amount=1):
+        self.labels(*values).inc(amount)
+
+    def collect(self):
+        for values, counter in self.children():
+            yield dict(zip(self.labelnames, values)), counter.value
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items())
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not (isinstance(value, float) and math.isnan(value))
+
+
+def _is_snapshot(value):
+    return isinstance(value, dict) and "buckets" in value and "count" in value
+
+
+def _render_histogram(lines, name, labels, snapshot):
+    for bound, count in snapshot["buckets"]:
+        lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(float(bound))))} {count}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(snapshot['sum'])}")
+    lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+
+
+class MetricsRegistry:
+    """سجل المقاييس في العملية وعرضها بصيغة Prometheus النصية"""
+
+    def __init__(self, namespace="forexfabric"):
+        self.namespace = namespace
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        metric = Histogram(f"{self.namespace}_{name}", documentation, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(f"{self.namespace}_{name}", documentation, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix, stats_fn):
+        """تحويل قاموس stats() إلى مقاييس عند كل عرض
+
+        القيم العددية تصبح مقاييس gauge، والقواميس الفرعية تصبح تسمية name،
+        ولقطات LatencyHistogram تصبح مدرجات. القيم النصية تُتجاهل.
+        """
+        with self._lock:
+            self._collectors.append((prefix, stats_fn))
+
+    def _render_stats(self, lines, prefix, stats):
+        gauges = {}
+        histograms = {}
+        for key, value in stats.items():
+            name = f"{self.namespace}_{prefix}_{key}"
+            if _is_number(value):
+                gauges.setdefault(name, []).append(({}, value))
+            elif _is_snapshot(value):
+                histograms.setdefault(f"{name}_seconds", []).append(({}, value))
+            elif isinstance(value, dict):
+                for sub_name, sub_value in value.items():
+                    labels = {"name": sub_name}
+                    if _is_number(sub_value):
+                        gauges.setdefault(name, []).append((labels, sub_value))
+                    elif _is_snapshot(sub_value):
+                        histograms.setdefault(f"{name}_seconds", []).append((labels, sub_value))
+                    elif isinstance(sub_value, dict):
+                        for field, field_value in sub_value.items():
+                            if _is_number(field_value):
+                                gauges.setdefault(f"{name}_{field}", []).append((labels, field_value))
+
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name, samples in histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, snapshot in samples:
+                _render_histogram(lines, name, labels, snapshot)
+
+    def render(self):
+        """نص المقاييس بصيغة Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in metric.collect():
+                if metric.kind == "histogram":
+                    _render_histogram(lines, metric.name, labels, value)
+                else:
+                    lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+
+        for prefix, stats_fn in collectors:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logger.warning(f"تعذر جمع مقاييس {prefix}: {e}")
+                continue
+            if stats:
+                self._render_stats(lines, prefix, stats)
+        return "\n".join(lines) + "\n"
+
+
+# السجل المشترك في العملية والمقاييس الأساسية
+registry = MetricsRegistry()
+
+db_query_seconds = registry.histogram(
+    "db_query_duration_seconds", "زمن دوال الوصول إلى قاعدة البيانات كما يراه المستدعي",
+    ("layer", "function"), buckets=DB_LATENCY_BUCKETS
+)
+db_pool_acquire_seconds = registry.histogram(
+    "db_pool_acquire_duration_seconds", "زمن انتظار استعارة اتصال من التجمع",
+    ("pool",), buckets=DB_LATENCY_BUCKETS
+)
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "زمن معالجة طلبات HTTP لكل مسار",
+    ("method", "route")
+)
+http_requests_total = registry.counter(
+    "http_requests_total", "عدد طلبات HTTP لكل مسار ورمز حالة",
+    ("method", "route", "status")
+)
+
+
+def timed(histogram, *label_values):
+    """مُزخرف يسجل زمن الدالة (المتزامنة أو غير المتزامنة) مع اسمها كآخر تسمية"""
+    def decorator(fn):
+        child = histogram.labels(*label_values, fn.__name__)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class HTTPMetricsMiddleware:
+    """ميدلوير ASGI يسجل زمن كل طلب HTTP وعدده حسب قالب المسار (لا المسار الفعلي) ورمز الحالة"""
+
+    def __init__(self, app, exclude_paths=("/metrics",), exclude_prefixes=()):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+        # الاتصالات طويلة العمر (مثل قناة SSE) تفسد توزيع زمن الطلبات
+        self.exclude_prefixes = tuple(exclude_prefixes)
+        self._route_paths = None
+
+    def _route(self, scope):
+        """قالب المسار المطابق، مثل /api/user/{user_id}، لإبقاء عدد التسميات محدودًا"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            app = scope.get("app")
+            routes = getattr(getattr(app, "router", None), "routes", ())
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path
+                for route in routes if getattr(route, "endpoint", None) is not None
+            }
+        return self._route_paths.get(endpoint, getattr(endpoint, "__name__", "unknown"))
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["path"] in self.exclude_paths
+                or scope["path"].startswith(self.exclude_prefixes)):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # الموجه يضيف endpoint إلى scope نفسه بعد المطابقة
+            route = self._route(scope)
+            method = scope["method"]
+            http_request_seconds.observe(time.perf_counter() - started, method, route)
+            http_requests_total.inc(method, route, str(status))
+
+
+def serve_metrics(host, port, source=registry):
+    """خادم HTTP صغير في ثريد خلفي يعرض /metrics (لعملية البوت في وضع polling)"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = source.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", f"{CONTENT_TYPE}; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"مقاييس Prometheus متاحة على http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,442 @@
+import logging
+import sys
+import json
+from collections import namedtuple
+
+from database import get_db_connection
+
+# إعداد السجلات
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# مفتاح قفل استشاري يمنع تطبيق الترحيلات من أكثر من عملية في الوقت نفسه
+MIGRATIONS_LOCK_KEY = 720250001
+
+# الترحيلات غير المعاملاتية (مثل CREATE INDEX CONCURRENTLY) تُنفّذ بوضع autocommit
+Migration = namedtuple("Migration", ["version", "description", "statements", "transactional"])
+Migration.__new__.__defaults__ = (True,)
+
+MIGRATIONS = [
+    Migration(1, "الجداول الأساسية", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username VARCHAR(255) NOT NULL,
+            full_name VARCHAR(255),
+            points INTEGER DEFAULT 0,
+            total_points INTEGER DEFAULT 0,
+            last_claim_time TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS referrals (
+            id SERIAL PRIMARY KEY,
+            referrer_id BIGINT REFERENCES users(user_id),
+            referred_id BIGINT REFERENCES users(user_id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(referrer_id, referred_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS activities (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            activity_type VARCHAR(50) NOT NULL,
+            points INTEGER NOT NULL,
+            details JSONB DEFAULT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS social_media_visits (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            social_type VARCHAR(50) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, social_type)
+        )
+        ''',
+    ]),
+    Migration(2, "فهرس لوحة المتصدرين", [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_points ON users (points DESC)',
+    ], transactional=False),
+    Migration(3, "فهرس سجل نشاطات المستخدم", [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_activities_user_created ON activities (user_id, created_at DESC)',
+    ], transactional=False),
+    Migration(4, "فهرس عدد الإحالات", [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_referrals_referrer ON referrals (referrer_id)',
+    ], transactional=False),
+    Migration(5, "عداد الإحالات المخزن في جدول المستخدمين", [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS referrals_count INTEGER NOT NULL DEFAULT 0',
+        '''
+        UPDATE users u
+        SET referrals_count = r.actual
+        FROM (
+            SELECT referrer_id, COUNT(*) AS actual
+            FROM referrals
+            GROUP BY referrer_id
+        ) r
+        WHERE r.referrer_id = u.user_id
+        ''',
+    ]),
+    Migration(6, "فهرس ترقيم سجل النشاطات بالمفاتيح (created_at, id)", [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_activities_user_created_id ON activities (user_id, created_at DESC, id DESC)',
+        'DROP INDEX CONCURRENTLY IF EXISTS idx_activities_user_created',
+    ], transactional=False),
+    Migration(7, "جدول طلبات السحب ومفاتيح منع التكرار", [
+        '''
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL REFERENCES users(user_id),
+            amount INTEGER NOT NULL CHECK (amount > 0),
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            details JSONB NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        "ALTER TABLE withdrawals ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'pending'",
+        'CREATE INDEX IF NOT EXISTS idx_withdrawals_user_created ON withdrawals (user_id, created_at DESC)',
+        '''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id BIGINT NOT NULL,
+            idempotency_key VARCHAR(255) NOT NULL,
+            operation VARCHAR(50) NOT NULL,
+            request_hash CHAR(64) NOT NULL,
+            response JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, idempotency_key)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)',
+    ]),
+    Migration(8, "جداول حملات منح النقاط بالجملة", [
+        '''
+        CREATE TABLE IF NOT EXISTS grant_campaigns (
+            campaign_id VARCHAR(100) PRIMARY KEY,
+            description VARCHAR(255),
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            rows_processed BIGINT NOT NULL DEFAULT 0,
+            rows_applied BIGINT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS grant_campaign_items (
+            campaign_id VARCHAR(100) NOT NULL REFERENCES grant_campaigns(campaign_id),
+            user_id BIGINT NOT NULL,
+            points INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (campaign_id, user_id)
+        )
+        ''',
+    ]),
+    Migration(9, "تقسيم سجل النشاطات شهريًا وجداول التجميع اليومي", [
+        # إعادة بناء الجدول مرة واحدة كجدول مقسم حسب created_at (تُنفذ في نافذة صيانة للجداول الكبيرة)
+        'ALTER TABLE activities RENAME TO activities_legacy',
+        'ALTER INDEX IF EXISTS idx_activities_user_created_id RENAME TO idx_activities_legacy_user_created_id',
+        'ALTER SEQUENCE activities_id_seq AS BIGINT',
+        '''
+        CREATE TABLE activities (
+            id BIGINT NOT NULL DEFAULT nextval('activities_id_seq'),
+            user_id BIGINT REFERENCES users(user_id),
+            activity_type VARCHAR(50) NOT NULL,
+            points INTEGER NOT NULL,
+            details JSONB DEFAULT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        ''',
+        'ALTER SEQUENCE activities_id_seq OWNED BY activities.id',
+        'CREATE INDEX idx_activities_user_created_id ON activities (user_id, created_at DESC, id DESC)',
+        # يلتقط أي صف خارج الأقسام الشهرية حتى تنشئها مهمة الصيانة (ledger.ensure_activity_partitions)
+        'CREATE TABLE activities_default PARTITION OF activities DEFAULT',
+        '''
+        DO $$
+        DECLARE
+            month DATE;
+        BEGIN
+            SELECT date_trunc('month', COALESCE(MIN(created_at), LOCALTIMESTAMP))::date
+            INTO month FROM activities_legacy;
+            WHILE month <= (date_trunc('month', LOCALTIMESTAMP) + INTERVAL '3 months')::date LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF activities FOR VALUES FROM (%L) TO (%L)',
+                    'activities_p' || to_char(month, 'YYYYMM'), month, (month + INTERVAL '1 month')::date
+                );
+                month := (month + INTERVAL '1 month')::date;
+            END LOOP;
+        END
+        $$
+        ''',
+        '''
+        INSERT INTO activities (id, user_id, activity_type, points, details, created_at)
+        SELECT id, user_id, activity_type, points, details, COALESCE(created_at, LOCALTIMESTAMP)
+        FROM activities_legacy
+        ''',
+        'DROP TABLE activities_legacy',
+        '''
+        CREATE TABLE IF NOT EXISTS activity_daily_rollups (
+            user_id BIGINT NOT NULL,
+            day DATE NOT NULL,
+            activity_type VARCHAR(50) NOT NULL,
+            activity_count INTEGER NOT NULL,
+            points BIGINT NOT NULL,
+            PRIMARY KEY (user_id, day, activity_type)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS activity_rollup_state (
+            name VARCHAR(50) PRIMARY KEY,
+            complete_through DATE NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS activity_archives (
+            partition_name VARCHAR(63) PRIMARY KEY,
+            range_start DATE NOT NULL,
+            range_end DATE NOT NULL,
+            row_count BIGINT NOT NULL,
+            file_path TEXT NOT NULL,
+            sha256 CHAR(64) NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    Migration(10, "درجات خطر الاحتيال في الإحالات", [
+        '''
+        CREATE TABLE IF NOT EXISTS referral_risk_scores (
+            user_id BIGINT PRIMARY KEY,
+            score REAL NOT NULL,
+            cluster_root BIGINT NOT NULL,
+            signals JSONB NOT NULL,
+            scored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_referral_risk_scores_score ON referral_risk_scores (score DESC)',
+    ]),
+]
+
+# الاستعلامات الساخنة والفهرس الذي يجب أن يختاره المخطط لكل منها
+# (المعرف EXPLAIN_USER_ID من البيانات الاصطناعية التي يضيفها explain_hot_queries)
+EXPLAIN_USER_ID = -1
+
+HOT_QUERIES = {
+    "get_leaderboard": (
+        'SELECT user_id, username, points, total_points FROM users ORDER BY points DESC LIMIT %s',
+        (10,),
+        "idx_users_points"
+    ),
+    "get_user_activities": (
+        'SELECT activity_type, points, created_at, details FROM activities '
+        'WHERE user_id = %s ORDER BY created_at DESC LIMIT %s',
+        (EXPLAIN_USER_ID, 10),
+        "idx_activities_user_created_id"
+    ),
+    "get_user_activities_page": (
+        'SELECT id, activity_type, points, created_at, details FROM activities '
+        'WHERE user_id = %s AND (created_at, id) < (NOW(), 0) ORDER BY created_at DESC, id DESC LIMIT %s',
+        (EXPLAIN_USER_ID, 11),
+        "idx_activities_user_created_id"
+    ),
+    "reconcile_referral_counts": (
+        'SELECT COUNT(*) FROM referrals WHERE referrer_id = %s',
+        (EXPLAIN_USER_ID,),
+        "idx_referrals_referrer"
+    ),
+}
+
+# الفحص يكتب بيانات اصطناعية ويأخذ أقفالًا، فلا يعمل إلا على قاعدة اختبار مؤقتة يحوي اسمها هذه العلامة
+EXPLAIN_DATABASE_MARKER = "test"
+
+# بيانات اصطناعية بحجم واقعي تُضاف داخل معاملة الفحص ثم يُتراجع عنها
+EXPLAIN_SEED_USERS = 50000
+EXPLAIN_SEED_REFERRERS = 1000
+EXPLAIN_SEED_STATEMENTS = [
+    '''
+    INSERT INTO users (user_id, username, points, total_points)
+    SELECT -g, 'explain_' || g, (random() * 10000)::int, (random() * 20000)::int
+    FROM generate_series(1, %(users)s) g
+    ON CONFLICT (user_id) DO NOTHING
+    ''',
+    '''
+    INSERT INTO activities (user_id, activity_type, points, details, created_at)
+    SELECT -(1 + g %% %(referrers)s), 'explain', 1, '{}', LOCALTIMESTAMP - make_interval(mins => g %% 43200)
+    FROM generate_series(1, %(users)s) g
+    ''',
+    '''
+    INSERT INTO referrals (referrer_id, referred_id)
+    SELECT -(1 + g %% %(referrers)s), -g
+    FROM generate_series(%(referrers)s + 1, %(users)s) g
+    ON CONFLICT DO NOTHING
+    ''',
+    'ANALYZE users',
+    'ANALYZE activities',
+    'ANALYZE referrals',
+]
+
+INDEX_NODE_TYPES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+def _ensure_migrations_table(conn):
+    """إنشاء جدول تتبع الترحيلات المطبقة"""
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    conn.commit()
+
+def get_applied_versions(conn):
+    """الحصول على أرقام الترحيلات المطبقة بالفعل"""
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT version FROM schema_migrations')
+        versions = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    return versions
+
+def _apply(conn, migration):
+    """تطبيق ترحيل واحد وتسجيله"""
+    if migration.transactional:
+        with conn.cursor() as cursor:
+            for statement in migration.statements:
+                cursor.execute(statement)
+            cursor.execute(
+                'INSERT INTO schema_migrations (version, description) VALUES (%s, %s)',
+                (migration.version, migration.description)
+            )
+        conn.commit()
+        return
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for statement in migration.statements:
+                cursor.execute(statement)
+            cursor.execute(
+                'INSERT INTO schema_migrations (version, description) VALUES (%s, %s)',
+                (migration.version, migration.description)
+            )
+    finally:
+        conn.autocommit = False
+
+def run_migrations(target_version=None):
+    """تطبيق الترحيلات المعلقة بالترتيب وإرجاع أرقام ما تم تطبيقه"""
+    applied_now = []
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATIONS_LOCK_KEY,))
+        conn.commit()
+        try:
+            _ensure_migrations_table(conn)
+            applied = get_applied_versions(conn)
+
+            for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+                if target_version is not None and migration.version > target_version:
+                    break
+                if migration.version in applied:
+                    continue
+
+                logger.info(f"تطبيق الترحيل {migration.version}: {migration.description}")
+                try:
+                    _apply(conn, migration)
+                except Exception as e:
+                    logger.error(f"فشل تطبيق الترحيل {migration.version}: {e}")
+                    conn.rollback()
+                    raise
+                applied_now.append(migration.version)
+        finally:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATIONS_LOCK_KEY,))
+            conn.commit()
+
+    if applied_now:
+        logger.info(f"تم تطبيق الترحيلات: {applied_now}")
+    else:
+        logger.info("قاعدة البيانات محدثة، لا توجد ترحيلات معلقة")
+    return applied_now
+
+def _plan_nodes(plan):
+    """جمع عقد خطة EXPLAIN بصيغة JSON (العقدة وكل ما تحتها)"""
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+def _parent_index(cursor, index_name):
+    """اسم فهرس الجدول المقسم الأصلي لفهرس قسم، أو الاسم نفسه لفهرس جدول عادي"""
+    cursor.execute(
+        'SELECT inhparent::regclass::text FROM pg_inherits WHERE inhrelid = to_regclass(%s)',
+        (index_name,)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else index_name
+
+def _require_test_database(cursor):
+    """رفض تشغيل الفحص على قاعدة لا يدل اسمها على أنها قاعدة اختبار"""
+    cursor.execute('SELECT current_database()')
+    name = cursor.fetchone()[0]
+    if EXPLAIN_DATABASE_MARKER not in name.lower():
+        raise RuntimeError(
+            f"فحص الخطط يكتب بيانات اصطناعية ويأخذ أقفالًا، فلا يعمل إلا على قاعدة اختبار "
+            f"(يجب أن يحوي اسمها '{EXPLAIN_DATABASE_MARKER}')، والقاعدة الحالية {name}"
+        )
+
+def explain_hot_queries(seed_users=EXPLAIN_SEED_USERS):
+    """فحص خطط تنفيذ الاستعلامات الساخنة والتحقق من أن المخطط يختار الفهرس المتوقع لكل منها
+
+    يعمل على قاعدة اختبار مؤقتة فقط: تُطبق الترحيلات، ثم تُضاف بيانات اصطناعية بحجم واقعي
+    وتُحدَّث الإحصاءات بـ ANALYZE داخل معاملة يُتراجع عنها، وتُفحص الخطط والمسح التسلسلي مفعل.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            _require_test_database(cursor)
+        conn.commit()
+    run_migrations()
+
+    results = {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            for statement in EXPLAIN_SEED_STATEMENTS:
+                cursor.execute(statement, {"users": seed_users, "referrers": EXPLAIN_SEED_REFERRERS})
+            for name, (query, params, expected_index) in HOT_QUERIES.items():
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = _plan_nodes(plan[0]["Plan"])
+                indexes = {
+                    _parent_index(cursor, node["Index Name"])
+                    for node in nodes
+                    if node.get("Node Type") in INDEX_NODE_TYPES and node.get("Index Name")
+                }
+                results[name] = {
+                    "expected_index": expected_index,
+                    "uses_expected_index": expected_index in indexes,
+                    "indexes": sorted(indexes),
+                    "node_types": sorted({node.get("Node Type") for node in nodes if node.get("Node Type")}),
+                }
+        conn.rollback()
+    return results
+
+if __name__ == "__main__":
+    if "--explain" in sys.argv:
+        try:
+            report = explain_hot_queries()
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(2)
+        for name, info in report.items():
+            status = "✅" if info["uses_expected_index"] else "❌"
+            used = ', '.join(info['indexes']) or 'بلا فهرس'
+            print(f"{status} {name}: المتوقع {info['expected_index']}، المستخدم {used} ({', '.join(info['node_types'])})")
+        sys.exit(0 if all(info["uses_expected_index"] for info in report.values()) else 1)
+
+    run_migrations()
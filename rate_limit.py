@@ -0,0 +1,228 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from metrics import registry
+from config import (
+    RATE_LIMIT_ENABLED, RATE_LIMIT_BACKEND, RATE_LIMIT_REDIS_URL, RATE_LIMIT_MAX_KEYS,
+    RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST, RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST,
+    RATE_LIMIT_GLOBAL_RATE, RATE_LIMIT_GLOBAL_BURST
+)
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+
+class RateLimitBackend:
+    """الواجهة المشتركة لمخازن دلاء الرموز (token buckets)"""
+
+    def consume(self, buckets, cost=1):
+        """سحب رموز من كل الدلاء معًا أو عدم سحب شيء
+
+        buckets: قائمة (مفتاح، معدل التعبئة بالثانية، السعة).
+        يعيد (مسموح، ثواني الانتظار، فهرس الدلو الرافض أو None).
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class LocalTokenBuckets(RateLimitBackend):
+    """دلاء رموز في ذاكرة العملية، محدودة العدد (LRU) وآمنة بين الثريدات"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        # مفتاح -> (الرموز المتاحة، وقت آخر تحديث)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def _level(self, key, rate, burst, now):
+        """الرموز المتاحة في الدلو الآن (يُستدعى مع حيازة القفل)"""
+        item = self._buckets.get(key)
+        if item is None:
+            return float(burst)
+        tokens, updated = item
+        return min(float(burst), tokens + (now - updated) * rate)
+
+    def consume(self, buckets, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            levels = [self._level(key, rate, burst, now) for key, rate, burst in buckets]
+            for index, ((key, rate, burst), tokens) in enumerate(zip(buckets, levels)):
+                if tokens < cost:
+                    retry_after = (cost - tokens) / rate if rate > 0 else math.inf
+                    return False, retry_after, index
+            for (key, rate, burst), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - cost, now)
+                self._buckets.move_to_end(key)
+            # إخلاء الأقدم استخدامًا: الدلو المُخلى يعود ممتلئًا عند الطلب التالي
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self._evictions += 1
+        return True, 0.0, None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "local",
+                "tracked_keys": len(self._buckets),
+                "max_keys": self.max_keys,
+                "evictions": self._evictions,
+            }
+
+
+# سكربت Lua يفحص كل الدلاء ثم يسحب منها ذريًا على الخادم
+# KEYS: مفاتيح الدلاء، ARGV: التكلفة ثم (المعدل، السعة) لكل دلو
+_REDIS_CONSUME_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = burst
+    if state[1] then
+        tokens = math.min(burst, tonumber(state[1]) + (now - tonumber(state[2])) * rate)
+    end
+    if tokens < cost then
+        local retry = -1
+        if rate > 0 then retry = (cost - tokens) / rate end
+        return {0, tostring(retry), i}
+    end
+    levels[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', levels[i] - cost, 'ts', now)
+    local ttl = 60000
+    if rate > 0 then ttl = math.ceil(burst / rate * 1000) + 1000 end
+    redis.call('PEXPIRE', key, ttl)
+end
+return {1, '0', 0}
+"""
+
+
+class RedisTokenBuckets(RateLimitBackend):
+    """دلاء رموز مشتركة بين العمليات على خادم متوافق مع Redis"""
+
+    def __init__(self, url, prefix="ff:rl:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("حزمة redis غير مثبتة؛ ثبّتها لاستخدام RATE_LIMIT_BACKEND=redis") from e
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_CONSUME_SCRIPT)
+        self._lock = threading.Lock()
+        self._errors = 0
+
+    def consume(self, buckets, cost=1):
+        keys = [f"{self.prefix}{key}" for key, rate, burst in buckets]
+        argv = [cost]
+        for key, rate, burst in buckets:
+            argv.extend((rate, burst))
+        try:
+            allowed, retry_after, index = self._script(keys=keys, args=argv)
+        except Exception as e:
+            # تعطل المخزن المشترك لا يوقف الخدمة: السماح بالطلب
+            logger.warning(f"خطأ في مخزن تحديد المعدل: {e}")
+            with self._lock:
+                self._errors += 1
+            return True, 0.0, None
+        if allowed:
+            return True, 0.0, None
+        retry_after = float(retry_after)
+        return False, (math.inf if retry_after < 0 else retry_after), int(index) - 1
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "redis", "errors": self._errors}
+
+
+class RateLimiter:
+    """محدد معدل لكل مستخدم ولكل عنوان IP مع سقف عام اختياري لمسارات الكتابة"""
+
+    def __init__(self, backend, user_limit, ip_limit, global_limit=None, enabled=True):
+        self.backend = backend
+        # كل حد هو (المعدل بالثانية، السعة)، ومعدل 0 يعطل الحد
+        self.user_limit = user_limit
+        self.ip_limit = ip_limit
+        self.global_limit = global_limit
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._allowed = defaultdict(int)
+        self._rejected = defaultdict(int)
+        self._rejected_by = defaultdict(int)
+
+    def _buckets(self, action, user_id, ip):
+        buckets = []
+        scopes = []
+        if user_id is not None and self.user_limit and self.user_limit[0] > 0:
+            buckets.append((f"{action}:user:{user_id}", *self.user_limit))
+            scopes.append("user")
+        if ip and self.ip_limit and self.ip_limit[0] > 0:
+            buckets.append((f"{action}:ip:{ip}", *self.ip_limit))
+            scopes.append("ip")
+        if self.global_limit and self.global_limit[0] > 0:
+            buckets.append(("global", *self.global_limit))
+            scopes.append("global")
+        return buckets, scopes
+
+    def check(self, action, user_id=None, ip=None):
+        """فحص طلب وسحب رمز؛ يعيد (مسموح، ثواني الانتظار قبل المحاولة التالية)"""
+        if not self.enabled:
+            return True, 0.0
+        buckets, scopes = self._buckets(action, user_id, ip)
+        if not buckets:
+            return True, 0.0
+        allowed, retry_after, index = self.backend.consume(buckets)
+        with self._lock:
+            if allowed:
+                self._allowed[action] += 1
+            else:
+                self._rejected[action] += 1
+                self._rejected_by[scopes[index]] += 1
+        return allowed, retry_after
+
+    def stats(self):
+        """عدادات الطلبات المسموحة والمرفوضة لكل إجراء ونطاق"""
+        with self._lock:
+            stats = {
+                "enabled": self.enabled,
+                "allowed": dict(self._allowed),
+                "rejected": dict(self._rejected),
+                "rejected_by": dict(self._rejected_by),
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+def create_rate_limiter(backend=RATE_LIMIT_BACKEND):
+    """إنشاء محدد المعدل حسب الإعدادات"""
+    if backend == "redis":
+        store = RedisTokenBuckets(RATE_LIMIT_REDIS_URL)
+    elif backend == "local":
+        store = LocalTokenBuckets(max_keys=RATE_LIMIT_MAX_KEYS)
+    else:
+        raise ValueError(f"واجهة تحديد معدل غير معروفة: {backend}")
+    return RateLimiter(
+        store,
+        user_limit=(RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST),
+        ip_limit=(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST),
+        global_limit=(RATE_LIMIT_GLOBAL_RATE, RATE_LIMIT_GLOBAL_BURST),
+        enabled=RATE_LIMIT_ENABLED,
+    )
+
+
+# محدد المعدل المشترك لمسارات المطالبة والزيارة والسحب في خادم API والبوت
+rate_limiter = create_rate_limiter()
+registry.register_stats("rate_limit", rate_limiter.stats)
@@ -0,0 +1,237 @@
+import logging
+import time
+
+import psycopg2.extras
+
+import json_backend
+from database import get_db_connection
+from referral_graph import ReferralGraph
+from config import (
+    REFERRAL_POINTS, REFERRAL_FRAUD_BURST_MINUTES, REFERRAL_FRAUD_BURST_LIMIT,
+    REFERRAL_FRAUD_FRESH_MINUTES, REFERRAL_FRAUD_MIN_REFERRALS, REFERRAL_FRAUD_THRESHOLD
+)
+
+# إعداد السجلات
+logger = logging.getLogger(__name__)
+
+# تقييم دوري لشبكة الإحالات كاملة في الذاكرة بحثًا عن مجموعات مشبوهة. لكل محيل أربع إشارات:
+# - burst: أكبر عدد إحالات لحسابات جديدة (أُنشئت قبل إحالتها بقليل) خلال نافذة قصيرة
+# - inactive: نسبة المحالين الذين لم يكسبوا أي نقاط بأنفسهم (نقاطهم كلها من إحالاتهم أو لا شيء)
+# - cascade: طول أطول سلسلة إحالات متتالية تحته تمت كل خطوة منها خلال النافذة نفسها
+# - ring: المحيل جزء من حلقة إحالات (أ أحال ب و ب أحال أ مباشرة أو عبر وسطاء)
+# والمجموعة هي شجرة المحيل الجذر التي تضم محيلين مشبوهين.
+
+_SIGNAL_WEIGHTS = {"burst": 0.4, "inactive": 0.3, "cascade": 0.15, "ring": 0.15}
+
+# سلسلة سريعة بهذا الطول تُعد إشارة كاملة
+_CASCADE_LIMIT = 3
+
+_EDGES_SQL = '''
+    SELECT r.referrer_id, r.referred_id,
+           EXTRACT(EPOCH FROM r.created_at)::float8,
+           EXTRACT(EPOCH FROM u.created_at)::float8,
+           u.total_points - u.referrals_count * %s
+    FROM referrals r
+    JOIN users u ON u.user_id = r.referred_id
+    WHERE r.referrer_id IS NOT NULL
+    ORDER BY r.created_at, r.id
+'''
+
+
+def load_edges(batch_size=10000):
+    """حواف الإحالات مع وقت إنشاء حساب المحال ونقاطه المكتسبة بنفسه، بمؤشر على الخادم"""
+    with get_db_connection() as conn:
+        with conn.cursor(name="referral_fraud_edges") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(_EDGES_SQL, (REFERRAL_POINTS,))
+            return [tuple(row) for row in cursor]
+
+
+def max_in_window(times, window):
+    """أكبر عدد من الأوقات المرتبة يقع داخل نافذة واحدة بطول window"""
+    best = start = 0
+    for end, moment in enumerate(times):
+        while moment - times[start] > window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def find_rings(edges):
+    """المكونات المترابطة بقوة (أكثر من مستخدم) في رسم الإحالات، أي الحلقات (Tarjan دون تعاود)"""
+    adjacency = {}
+    for referrer_id, referred_id in edges:
+        adjacency.setdefault(referrer_id, []).append(referred_id)
+
+    index, low, on_stack = {}, {}, set()
+    stack, rings = [], []
+    counter = 0
+    for start in adjacency:
+        if start in index:
+            continue
+        index[start] = low[start] = counter
+        counter += 1
+        stack.append(start)
+        on_stack.add(start)
+        work = [(start, iter(adjacency.get(start, ())))]
+        while work:
+            node, neighbours = work[-1]
+            descended = False
+            for neighbour in neighbours:
+                if neighbour not in index:
+                    index[neighbour] = low[neighbour] = counter
+                    counter += 1
+                    stack.append(neighbour)
+                    on_stack.add(neighbour)
+                    work.append((neighbour, iter(adjacency.get(neighbour, ()))))
+                    descended = True
+                    break
+                if neighbour in on_stack:
+                    low[node] = min(low[node], index[neighbour])
+            if descended:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1:
+                    rings.append(sorted(component))
+    return rings
+
+
+def fast_cascades(graph, window):
+    """لكل مستخدم: طول أطول سلسلة تحته تمت كل إحالة فيها خلال window من إحالة أبيها"""
+    cascade = {}
+    for root in graph.roots():
+        for node in reversed(graph.subtree(root)):
+            joined = graph.joined_at(node)
+            best = 0
+            for child in graph.direct_referrals(node):
+                if joined is None:
+                    # لا وقت مرجعي للجذر فتبدأ السلسلة من محاليه
+                    best = max(best, cascade.get(child, 0))
+                elif graph.joined_at(child) - joined <= window:
+                    best = max(best, cascade.get(child, 0) + 1)
+            if best:
+                cascade[node] = best
+    return cascade
+
+
+def score_referrers(edges, burst_minutes=REFERRAL_FRAUD_BURST_MINUTES, burst_limit=REFERRAL_FRAUD_BURST_LIMIT,
+                    fresh_minutes=REFERRAL_FRAUD_FRESH_MINUTES, min_referrals=REFERRAL_FRAUD_MIN_REFERRALS):
+    """تقييم المحيلين من صفوف load_edges؛ يعيد (الفهرس، الدرجات، الحلقات)"""
+    graph = ReferralGraph(refresh_seconds=0)
+    graph.load((referrer_id, referred_id, referred_at) for referrer_id, referred_id, referred_at, _, _ in edges)
+
+    window = burst_minutes * 60
+    fresh = fresh_minutes * 60
+    fresh_times, totals, inactive = {}, {}, {}
+    for referrer_id, _, referred_at, account_created_at, own_points in edges:
+        totals[referrer_id] = totals.get(referrer_id, 0) + 1
+        if own_points is not None and own_points <= 0:
+            inactive[referrer_id] = inactive.get(referrer_id, 0) + 1
+        if referred_at is not None and account_created_at is not None and referred_at - account_created_at <= fresh:
+            fresh_times.setdefault(referrer_id, []).append(referred_at)
+
+    rings = find_rings(graph.edges())
+    in_ring = {member for ring in rings for member in ring}
+    cascades = fast_cascades(graph, window)
+
+    scores = {}
+    for referrer_id, total in totals.items():
+        if total < min_referrals and referrer_id not in in_ring:
+            continue
+        burst = max_in_window(fresh_times.get(referrer_id, []), window)
+        signals = {
+            "referrals": total,
+            "burst": burst,
+            "inactive_ratio": round(inactive.get(referrer_id, 0) / total, 3),
+            "cascade": cascades.get(referrer_id, 0),
+            "ring": referrer_id in in_ring,
+        }
+        score = (
+            _SIGNAL_WEIGHTS["burst"] * min(1.0, burst / burst_limit)
+            + _SIGNAL_WEIGHTS["inactive"] * signals["inactive_ratio"]
+            + _SIGNAL_WEIGHTS["cascade"] * min(1.0, signals["cascade"] / _CASCADE_LIMIT)
+            + _SIGNAL_WEIGHTS["ring"] * signals["ring"]
+        )
+        scores[referrer_id] = (round(score, 3), signals)
+    return graph, scores, rings
+
+
+def build_clusters(graph, scores, threshold):
+    """تجميع المحيلين المشبوهين حسب جذر شجرتهم"""
+    clusters = {}
+    for user_id, (score, signals) in scores.items():
+        if score < threshold:
+            continue
+        ancestors = graph.ancestors(user_id)
+        root = ancestors[-1] if ancestors else user_id
+        cluster = clusters.setdefault(root, {
+            "root_id": root, "downline_size": graph.downline_size(root),
+            "max_score": 0.0, "flagged": 0, "referrals": 0, "members": [],
+        })
+        cluster["max_score"] = max(cluster["max_score"], score)
+        cluster["flagged"] += 1
+        cluster["referrals"] += signals["referrals"]
+        cluster["members"].append((score, user_id))
+    result = sorted(clusters.values(), key=lambda c: (c["max_score"], c["flagged"]), reverse=True)
+    for cluster in result:
+        cluster["members"] = [user_id for _, user_id in sorted(cluster["members"], reverse=True)[:20]]
+    return result
+
+
+def save_scores(graph, scores):
+    """استبدال جدول درجات الخطر بنتائج التقييم الحالي"""
+    rows = []
+    for user_id, (score, signals) in scores.items():
+        ancestors = graph.ancestors(user_id)
+        rows.append((user_id, score, ancestors[-1] if ancestors else user_id, json_backend.dumps(signals)))
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('DELETE FROM referral_risk_scores')
+            psycopg2.extras.execute_values(
+                cursor,
+                'INSERT INTO referral_risk_scores (user_id, score, cluster_root, signals) VALUES %s',
+                rows,
+                page_size=1000
+            )
+    return len(rows)
+
+
+def run_fraud_scan(threshold=REFERRAL_FRAUD_THRESHOLD, limit=50, save=False, **options):
+    """تقييم شبكة الإحالات كاملة ويعيد تقريرًا بالمحيلين والمجموعات المشبوهة"""
+    started = time.monotonic()
+    edges = load_edges()
+    graph, scores, rings = score_referrers(edges, **options)
+    clusters = build_clusters(graph, scores, threshold)
+    flagged = sorted(
+        ((score, user_id, signals) for user_id, (score, signals) in scores.items() if score >= threshold),
+        key=lambda item: item[0], reverse=True
+    )
+    report = {
+        "edges": len(edges),
+        "referred_users": len(graph),
+        "referrers_scored": len(scores),
+        "flagged": len(flagged),
+        "threshold": threshold,
+        "rings": [{"size": len(ring), "members": ring[:20]} for ring in rings[:limit]],
+        "clusters": clusters[:limit],
+        "top": [dict(signals, user_id=user_id, score=score) for score, user_id, signals in flagged[:limit]],
+    }
+    if save:
+        report["saved"] = save_scores(graph, scores)
+    report["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    logger.info(
+        f"فحص الإحالات: {len(scores)} محيل مقيَّم، {len(flagged)} مشبوه في {len(clusters)} مجموعة "
+        f"و {len(rings)} حلقة ({report['elapsed_seconds']} ث)"
+    )
+    return report
@@ -0,0 +1,210 @@
+import bisect
+import threading
+import time
+from collections import Counter
+
+from config import REFERRAL_GRAPH_REFRESH_SECONDS
+
+
+class ReferralGraph:
+    """فهرس تجاور لشجرة الإحالات في الذاكرة يُحدَّث تدريجيًا مع كل إحالة جديدة
+
+    أب كل مستخدم هو أول من أحاله؛ الإحالات الإضافية للمستخدم نفسه (أو التي تغلق حلقة)
+    تُحفظ كحواف خارج الشجرة فلا تدخل في العمق وحجم الشبكة لكنها تظهر في كشف الحلقات.
+    """
+
+    def __init__(self, refresh_seconds=REFERRAL_GRAPH_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._reset()
+        self._loaded_at = None
+        self._refreshing = False
+
+    def _reset(self):
+        # المحال -> المحيل الأول، ووقت إحالته (ثوانٍ منذ epoch)
+        self._parent = {}
+        self._joined = {}
+        # المحيل -> المحالون في الشجرة، والحواف خارجها
+        self._children = {}
+        self._extra = {}
+        # المستخدم -> عدد كل من تحته في الشجرة
+        self._downline = {}
+        # أوقات الإحالات مرتبة ومحيلوها، لأعلى المحيلين في نافذة زمنية
+        self._times = []
+        self._referrers = []
+
+    @property
+    def loaded(self):
+        """هل تم بناء الفهرس من قاعدة البيانات"""
+        return self._loaded_at is not None
+
+    def is_stale(self):
+        """هل حان وقت إعادة المزامنة مع قاعدة البيانات (إحالات من عمليات أخرى)"""
+        if self._loaded_at is None:
+            return True
+        if not self.refresh_seconds:
+            return False
+        return time.monotonic() - self._loaded_at >= self.refresh_seconds
+
+    def begin_refresh(self):
+        """حجز إعادة البناء لمستدعٍ واحد فقط لتجنب تكرار المسح الكامل"""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            return True
+
+    def cancel_refresh(self):
+        """إلغاء حجز إعادة البناء بعد فشلها"""
+        with self._lock:
+            self._refreshing = False
+
+    def load(self, rows):
+        """إعادة بناء الفهرس من صفوف (المحيل، المحال، وقت الإحالة) مرتبة حسب الوقت"""
+        graph = ReferralGraph(self.refresh_seconds)
+        for referrer_id, referred_id, referred_at in rows:
+            graph._add_edge(referrer_id, referred_id, referred_at or 0.0)
+            graph._times.append(referred_at or 0.0)
+            graph._referrers.append(referrer_id)
+        graph._compute_downline()
+        with self._lock:
+            self._parent = graph._parent
+            self._joined = graph._joined
+            self._children = graph._children
+            self._extra = graph._extra
+            self._downline = graph._downline
+            self._times = graph._times
+            self._referrers = graph._referrers
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+
+    def add(self, referrer_id, referred_id, referred_at=None):
+        """إضافة إحالة جديدة وتحديث أحجام الشبكات على طول سلسلة المحيلين"""
+        if referred_at is None:
+            referred_at = time.time()
+        with self._lock:
+            if self._add_edge(referrer_id, referred_id, referred_at):
+                size = self._downline.get(referred_id, 0) + 1
+                for ancestor in self._ancestors(referred_id):
+                    self._downline[ancestor] = self._downline.get(ancestor, 0) + size
+            index = bisect.bisect_right(self._times, referred_at)
+            self._times.insert(index, referred_at)
+            self._referrers.insert(index, referrer_id)
+
+    def _add_edge(self, referrer_id, referred_id, referred_at):
+        """تسجيل حافة؛ يعيد True إذا أصبحت جزءًا من الشجرة"""
+        if referred_id in self._parent or referred_id in self._ancestors(referrer_id, include_self=True):
+            self._extra.setdefault(referrer_id, []).append(referred_id)
+            return False
+        self._parent[referred_id] = referrer_id
+        self._joined[referred_id] = referred_at
+        self._children.setdefault(referrer_id, []).append(referred_id)
+        return True
+
+    def _compute_downline(self):
+        """حساب حجم الشبكة لكل مستخدم بمرور واحد من الأوراق نحو الجذور"""
+        downline = {}
+        for root in [node for node in self._children if node not in self._parent]:
+            for node in reversed(self._subtree_order(root)):
+                children = self._children.get(node, ())
+                downline[node] = sum(downline[child] + 1 for child in children)
+        self._downline = {node: size for node, size in downline.items() if size}
+
+    def _subtree_order(self, root):
+        """عقد الشجرة تحت root بترتيب ما قبل الزيارة (دون تكرار)"""
+        order, stack = [], [root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(self._children.get(node, ()))
+        return order
+
+    def _ancestors(self, user_id, include_self=False):
+        ancestors = [user_id] if include_self else []
+        node = self._parent.get(user_id)
+        while node is not None:
+            ancestors.append(node)
+            node = self._parent.get(node)
+        return ancestors
+
+    def ancestors(self, user_id):
+        """سلسلة المحيلين من المحيل المباشر حتى الجذر"""
+        with self._lock:
+            return self._ancestors(user_id)
+
+    def subtree(self, user_id):
+        """المستخدم وكل من تحته في الشجرة بترتيب ما قبل الزيارة"""
+        with self._lock:
+            return self._subtree_order(user_id)
+
+    def referrer(self, user_id):
+        """المحيل المباشر أو None"""
+        return self._parent.get(user_id)
+
+    def direct_referrals(self, user_id):
+        """المحالون مباشرة في الشجرة"""
+        with self._lock:
+            return list(self._children.get(user_id, ()))
+
+    def extra_referrals(self, user_id):
+        """إحالات المستخدم التي لم تدخل الشجرة (محال سبقت إحالته أو حافة تغلق حلقة)"""
+        with self._lock:
+            return list(self._extra.get(user_id, ()))
+
+    def downline_size(self, user_id):
+        """عدد كل المستخدمين تحت المستخدم في الشجرة"""
+        return self._downline.get(user_id, 0)
+
+    def joined_at(self, user_id):
+        """وقت إحالة المستخدم أو None إذا لم يُحَل"""
+        return self._joined.get(user_id)
+
+    def roots(self):
+        """المحيلون الذين لم يُحالوا (جذور الأشجار)"""
+        with self._lock:
+            return [node for node in self._children if node not in self._parent]
+
+    def referrers(self):
+        """كل من أحال مستخدمًا واحدًا على الأقل"""
+        with self._lock:
+            return list(set(self._children) | set(self._extra))
+
+    def edges(self):
+        """كل الحواف (المحيل، المحال) بما فيها التي خارج الشجرة"""
+        with self._lock:
+            edges = [(referrer, child) for referrer, children in self._children.items() for child in children]
+            edges.extend((referrer, child) for referrer, children in self._extra.items() for child in children)
+            return edges
+
+    def tree(self, user_id, max_depth=3):
+        """ملخص موقع المستخدم في الشجرة وعدد المحالين في كل مستوى حتى max_depth"""
+        with self._lock:
+            ancestors = self._ancestors(user_id)
+            levels = []
+            frontier = self._children.get(user_id, ())
+            while frontier and len(levels) < max_depth:
+                levels.append(len(frontier))
+                frontier = [child for node in frontier for child in self._children.get(node, ())]
+            return {
+                "user_id": user_id,
+                "referrer_id": ancestors[0] if ancestors else None,
+                "depth": len(ancestors),
+                "ancestors": ancestors,
+                "direct_referrals": len(self._children.get(user_id, ())),
+                "downline_size": self._downline.get(user_id, 0),
+                "levels": levels,
+            }
+
+    def top_referrers(self, since, limit=10):
+        """أكثر المحيلين إحالات منذ since (ثوانٍ منذ epoch) بصيغة (المحيل، العدد)"""
+        with self._lock:
+            start = bisect.bisect_left(self._times, since)
+            counts = Counter(self._referrers[start:])
+        return counts.most_common(limit)
+
+    def __len__(self):
+        return len(self._parent)
+
+
+# الفهرس المشترك بين ثريد البوت وثريد خادم API
+referral_graph = ReferralGraph()
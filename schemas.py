@@ -0,0 +1,88 @@
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+# نماذج استجابات API: تعيد نقاط النهاية قواميس يتحقق منها FastAPI مقابل response_model
+# قبل تسلسلها عبر FastJSONResponse (انظر http_cache.py)، فلا تُرسل حقول غير معلنة
+
+
+class UserResponse(BaseModel):
+    user_id: int
+    username: Optional[str]
+    full_name: Optional[str]
+    points: int
+    total_points: int
+    last_claim_time: Optional[str]
+    referrals_count: int
+    can_claim: bool
+    next_claim_time: int
+    visited_socials: List[str]
+    social_links: Dict[str, str]
+
+
+class LeaderboardEntry(BaseModel):
+    user_id: int
+    username: Optional[str]
+    points: int
+    total_points: int
+
+
+class LeaderboardResponse(BaseModel):
+    leaderboard: List[LeaderboardEntry]
+
+
+class Activity(BaseModel):
+    id: int
+    activity_type: str
+    points: int
+    created_at: str
+    details: Dict[str, Any]
+
+
+class ActivitiesPage(BaseModel):
+    activities: List[Activity]
+    next_cursor: Optional[str]
+
+
+class BootstrapResponse(ActivitiesPage):
+    user: UserResponse
+    leaderboard: List[LeaderboardEntry]
+
+
+class RankResponse(BaseModel):
+    user_id: int
+    rank: int
+
+
+class ActivityTypeSummary(BaseModel):
+    activity_type: str
+    count: int
+    points: int
+
+
+class ActivitySummary(BaseModel):
+    days: int
+    total_activities: int
+    total_points: int
+    by_type: List[ActivityTypeSummary]
+
+
+class ReferralTree(BaseModel):
+    user_id: int
+    referrer_id: Optional[int]
+    depth: int
+    ancestors: List[int]
+    direct_referrals: int
+    downline_size: int
+    levels: List[int]
+
+
+class TopReferrer(BaseModel):
+    user_id: int
+    username: Optional[str]
+    referrals: int
+
+
+class TopReferrersResponse(BaseModel):
+    hours: int
+    referrers: List[TopReferrer]
@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import inspect
+import threading
+import weakref
+from collections import defaultdict
+
+# كل مجموعات الدمج في العملية، ليُبطل تغيير نقاط مستخدم القراءات الجارية له في الطبقتين
+_groups = weakref.WeakSet()
+
+
+class _Call:
+    """استدعاء جارٍ ينتظر نتيجته المستدعون المتطابقون"""
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _FlightGroup:
+    """الأساس المشترك: تتبع الاستدعاءات الجارية وعدادات الدمج"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        # مفتاح الاستدعاء الجاري -> معرف المستخدم الذي تخصه القراءة
+        self._users = {}
+        self._executions = defaultdict(int)
+        self._coalesced = defaultdict(int)
+        _groups.add(self)
+
+    def _release(self, key, call):
+        """إزالة الاستدعاء من الجارية إن لم يُبطل أو يُستبدل (يُستدعى مع حيازة القفل)"""
+        if self._calls.get(key) is call:
+            del self._calls[key]
+            self._users.pop(key, None)
+
+    def forget_user(self, user_id):
+        """فصل القراءات الجارية لمستخدم: المستدعون الجدد يبدؤون استعلامًا جديدًا بعد الكتابة"""
+        with self._lock:
+            for key in [k for k, uid in self._users.items() if uid == user_id]:
+                del self._calls[key]
+                del self._users[key]
+
+    def wrap(self, user_scoped=True):
+        """مُزخرف يدمج الاستدعاءات المتطابقة للدالة (المعامل الأول هو معرف المستخدم إن كانت user_scoped)"""
+        def decorator(fn):
+            signature = inspect.signature(fn)
+
+            def call_key(args, kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                values = tuple(bound.arguments.values())
+                return (fn.__name__,) + values, (values[0] if user_scoped else None)
+
+            return self._decorate(fn, call_key)
+        return decorator
+
+    def stats(self):
+        """عدد الاستعلامات المنفذة والاستدعاءات التي شاركت نتيجة استعلام جارٍ لكل دالة"""
+        with self._lock:
+            names = set(self._executions) | set(self._coalesced)
+            return {
+                "in_flight": len(self._calls),
+                "functions": {
+                    name: {
+                        "executions": self._executions[name],
+                        "coalesced": self._coalesced[name],
+                    }
+                    for name in sorted(names)
+                },
+                "coalesced": sum(self._coalesced.values()),
+            }
+
+
+class SingleFlight(_FlightGroup):
+    """دمج الاستدعاءات المتطابقة المتزامنة من عدة ثريدات في استعلام واحد"""
+
+    def do(self, key, fn, args=(), kwargs=None, user_id=None):
+        """تنفيذ fn مرة واحدة لكل مفتاح جارٍ وإرجاع النتيجة نفسها لكل المنتظرين"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                if user_id is not None:
+                    self._users[key] = user_id
+                self._executions[key[0]] += 1
+            else:
+                self._coalesced[key[0]] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **(kwargs or {}))
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._release(key, call)
+            call.event.set()
+        return call.result
+
+    def _decorate(self, fn, call_key):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key, user_id = call_key(args, kwargs)
+            return self.do(key, fn, args, kwargs, user_id)
+        return wrapper
+
+
+class AsyncSingleFlight(_FlightGroup):
+    """دمج الاستدعاءات المتطابقة المتزامنة من عدة مهام asyncio في استعلام واحد"""
+
+    async def do(self, key, fn, args=(), kwargs=None, user_id=None):
+        """تشغيل fn كمهمة واحدة لكل مفتاح جارٍ؛ إلغاء أحد المنتظرين لا يلغي المهمة المشتركة"""
+        with self._lock:
+            task = self._calls.get(key)
+            if task is None:
+                task = self._calls[key] = asyncio.ensure_future(fn(*args, **(kwargs or {})))
+                if user_id is not None:
+                    self._users[key] = user_id
+                self._executions[key[0]] += 1
+                task.add_done_callback(functools.partial(self._task_done, key))
+            else:
+                self._coalesced[key[0]] += 1
+        return await asyncio.shield(task)
+
+    def _task_done(self, key, task):
+        with self._lock:
+            self._release(key, task)
+        if not task.cancelled():
+            # تعليم الاستثناء كمقروء حتى لو أُلغي كل المنتظرين
+            task.exception()
+
+    def _decorate(self, fn, call_key):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key, user_id = call_key(args, kwargs)
+            return await self.do(key, fn, args, kwargs, user_id)
+        return wrapper
+
+
+def forget_user(user_id):
+    """فصل القراءات الجارية لمستخدم في كل المجموعات بعد تغيير بياناته"""
+    for group in list(_groups):
+        group.forget_user(user_id)
@@ -3,6 +3,9 @@ let userId = new URLSearchParams(window.location.search).get('user_id');
 let startTime = Date.now();
 let countdownInterval;
 let userData = null;
+let activitiesCursor = null;
+let liveSource = null;
+let liveConnected = false;
 
 // بدء التطبيق عند تحميل الصفحة
 document.addEventListener('DOMContentLoaded', () => {
@@ -18,15 +21,98 @@ async function initApp() {
     }
 
     try {
-        await fetchUserData();
-        await fetchLeaderboard();
-        await fetchActivityHistory();
+        await fetchBootstrap();
+        connectLiveUpdates();
     } catch (error) {
         console.error('خطأ في تهيئة التطبيق:', error);
         showToast('خطأ', 'حدث خطأ أثناء تحميل البيانات', 'error');
     }
 }
 
+// جلب بيانات المستخدم ولوحة المتصدرين وأحدث النشاطات في طلب واحد
+async function fetchBootstrap() {
+    try {
+        const response = await fetch(`/api/bootstrap/${userId}?leaderboard_limit=10&activities_limit=10`);
+        
+        if (!response.ok) {
+            throw new Error(`خطأ في الاستجابة: ${response.status}`);
+        }
+        
+        const data = await response.json();
+        userData = data.user;
+        updateUI();
+        updateLeaderboard(data.leaderboard);
+        activitiesCursor = data.next_cursor;
+        updateActivityHistory(data.activities);
+    } catch (error) {
+        console.error('خطأ في تحميل بيانات التطبيق:', error);
+        throw error;
+    }
+}
+
+// الاشتراك في التحديثات المباشرة من الخادم (الرصيد، النشاطات الجديدة، لوحة المتصدرين)
+function connectLiveUpdates() {
+    if (!window.EventSource || liveSource) return;
+    
+    liveSource = new EventSource(`/api/live/${userId}`);
+    
+    liveSource.addEventListener('open', () => {
+        // بعد انقطاع قد تكون فاتت أحداث، فتُعاد مزامنة الحالة كاملة
+        if (liveConnected) {
+            fetchBootstrap().catch(() => {});
+        }
+        liveConnected = true;
+    });
+    
+    liveSource.addEventListener('balance', (event) => {
+        applyBalanceUpdate(JSON.parse(event.data));
+    });
+    
+    liveSource.addEventListener('leaderboard', (event) => {
+        updateLeaderboard(JSON.parse(event.data).leaderboard);
+    });
+    
+    liveSource.addEventListener('resync', () => {
+        fetchBootstrap().catch(() => {});
+    });
+}
+
+// هل تصل النشاطات الجديدة عبر القناة المباشرة فلا حاجة لطلبها مع كل عملية
+function liveActive() {
+    return liveSource !== null && liveSource.readyState === EventSource.OPEN;
+}
+
+// تطبيق تحديث رصيد مرسل من الخادم (من هذه الصفحة أو البوت أو أي مصدر آخر)
+function applyBalanceUpdate(data) {
+    if (!userData) return;
+    
+    userData.points = data.points;
+    userData.total_points = data.total_points;
+    document.getElementById('current-points').textContent = userData.points;
+    document.getElementById('total-points').textContent = userData.total_points;
+    
+    if (data.activity) {
+        if (data.activity.activity_type === 'referral') {
+            userData.referrals_count += 1;
+            document.getElementById('referrals-count').textContent = userData.referrals_count;
+        }
+        prependActivity(data.activity);
+    }
+}
+
+// تحديث سجل النشاطات من استجابة عملية، أو جلبه إذا لم تتضمنه الاستجابة
+function refreshActivitiesFrom(data) {
+    // النشاط الجديد يصل عبر القناة المباشرة
+    if (liveActive()) return;
+    
+    if (data.activities) {
+        activitiesCursor = data.next_cursor;
+        updateActivityHistory(data.activities);
+    } else {
+        fetchActivityHistory();
+    }
+}
+
 // جلب بيانات المستخدم من الخادم
 async function fetchUserData() {
     try {
@@ -179,7 +265,7 @@ async function visitSocialMedia(socialType, url) {
     
     try {
         // تسجيل الزيارة في الخادم
-        const response = await fetch(`/api/social_visit/${userId}`, {
+        const response = await fetch(`/api/social_visit/${userId}?activities_limit=${liveActive() ? 0 : 10}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -203,7 +289,7 @@ async function visitSocialMedia(socialType, url) {
             showToast('تم بنجاح', data.message, 'success');
             
             // تحديث سجل النشاطات
-            fetchActivityHistory();
+            refreshActivitiesFrom(data);
         } else {
             showToast('تنبيه', data.message, 'warning');
         }
@@ -254,66 +340,121 @@ async function fetchActivityHistory() {
         }
         
         const data = await response.json();
+        activitiesCursor = data.next_cursor;
         updateActivityHistory(data.activities);
     } catch (error) {
         console.error('خطأ في جلب تاريخ النشاطات:', error);
     }
 }
 
+// جلب الصفحة التالية من سجل النشاطات باستخدام مؤشر الصفحة
+async function fetchMoreActivities() {
+    if (!activitiesCursor) return;
+    
+    try {
+        const response = await fetch(`/api/activities/${userId}?limit=10&cursor=${encodeURIComponent(activitiesCursor)}`);
+        if (!response.ok) {
+            throw new Error(`خطأ في الاستجابة: ${response.status}`);
+        }
+        
+        const data = await response.json();
+        activitiesCursor = data.next_cursor;
+        updateActivityHistory(data.activities, true);
+    } catch (error) {
+        console.error('خطأ في جلب المزيد من النشاطات:', error);
+    }
+}
+
+// تحديث زر عرض المزيد من النشاطات
+function updateLoadMoreButton() {
+    let loadMoreBtn = document.getElementById('load-more-activities-btn');
+    
+    if (!loadMoreBtn) {
+        loadMoreBtn = document.createElement('button');
+        loadMoreBtn.id = 'load-more-activities-btn';
+        loadMoreBtn.className = 'action-button';
+        loadMoreBtn.style.marginTop = '1rem';
+        loadMoreBtn.textContent = 'عرض المزيد';
+        loadMoreBtn.addEventListener('click', fetchMoreActivities);
+        document.getElementById('activities-container').appendChild(loadMoreBtn);
+    }
+    
+    loadMoreBtn.style.display = activitiesCursor ? 'block' : 'none';
+}
+
+// أيقونات وأسماء أنواع النشاطات في السجل
+const activityIcons = {
+    daily_claim: '🎁',
+    referral: '👥',
+    task_completion: '✅',
+    social_instagram: '📸',
+    social_telegram: '📱',
+    social_website: '🌐',
+    social_support: '🆘',
+    withdrawal: '💸'
+};
+
+const activityNames = {
+    daily_claim: 'المكافأة اليومية',
+    referral: 'إحالة صديق',
+    task_completion: 'إكمال مهمة',
+    social_instagram: 'زيارة انستغرام',
+    social_telegram: 'زيارة تيليغرام',
+    social_website: 'زيارة الموقع الرسمي',
+    social_support: 'زيارة الدعم الفني',
+    withdrawal: 'سحب النقاط'
+};
+
+// إنشاء عنصر نشاط واحد في السجل
+function createActivityItem(activity) {
+    const date = new Date(activity.created_at);
+    const formattedDate = `${date.toLocaleDateString()} ${date.toLocaleTimeString()}`;
+    
+    const activityType = activity.activity_type;
+    const icon = activityIcons[activityType] || '🔹';
+    const name = activityNames[activityType] || activityType;
+    
+    const activityItem = document.createElement('div');
+    activityItem.className = 'activity-item';
+    activityItem.innerHTML = `
+        <div class="activity-icon" style="display: inline-block; margin-left: 8px;">${icon}</div>
+        <div class="activity-details" style="display: inline-block;">
+            <div class="activity-name">${name}</div>
+            <div class="activity-date">${formattedDate}</div>
+        </div>
+        <div class="activity-points" style="float: left;">
+            ${activity.points > 0 ? '+' : ''}${activity.points} نقطة
+        </div>
+    `;
+    return activityItem;
+}
+
+// إضافة نشاط جديد وصل عبر القناة المباشرة إلى أعلى السجل
+function prependActivity(activity) {
+    const activityList = document.getElementById('activities-list');
+    const placeholder = activityList.querySelector('.no-activities');
+    if (placeholder) {
+        placeholder.remove();
+    }
+    activityList.insertBefore(createActivityItem(activity), activityList.firstChild);
+}
+
 // تحديث عرض سجل النشاطات
-function updateActivityHistory(activities) {
+function updateActivityHistory(activities, append = false) {
     const activityList = document.getElementById('activities-list');
-    activityList.innerHTML = '';
-    
-    const activityIcons = {
-        daily_claim: '🎁',
-        referral: '👥',
-        task_completion: '✅',
-        social_instagram: '📸',
-        social_telegram: '📱',
-        social_website: '🌐',
-        social_support: '🆘',
-        withdrawal: '💸'
-    };
-    
-    const activityNames = {
-        daily_claim: 'المكافأة اليومية',
-        referral: 'إحالة صديق',
-        task_completion: 'إكمال مهمة',
-        social_instagram: 'زيارة انستغرام',
-        social_telegram: 'زيارة تيليغرام',
-        social_website: 'زيارة الموقع الرسمي',
-        social_support: 'زيارة الدعم الفني',
-        withdrawal: 'سحب النقاط'
-    };
+    if (!append) {
+        activityList.innerHTML = '';
+    }
     
     if (activities && activities.length > 0) {
         activities.forEach(activity => {
-            const date = new Date(activity.created_at);
-            const formattedDate = `${date.toLocaleDateString()} ${date.toLocaleTimeString()}`;
-            
-            const activityType = activity.activity_type;
-            const icon = activityIcons[activityType] || '🔹';
-            const name = activityNames[activityType] || activityType;
-            
-            const activityItem = document.createElement('div');
-            activityItem.className = 'activity-item';
-            activityItem.innerHTML = `
-                <div class="activity-icon" style="display: inline-block; margin-left: 8px;">${icon}</div>
-                <div class="activity-details" style="display: inline-block;">
-                    <div class="activity-name">${name}</div>
-                    <div class="activity-date">${formattedDate}</div>
-                </div>
-                <div class="activity-points" style="float: left;">
-                    ${activity.points > 0 ? '+' : ''}${activity.points} نقطة
-                </div>
-            `;
-            
-            activityList.appendChild(activityItem);
+            activityList.appendChild(createActivityItem(activity));
         });
-    } else {
+    } else if (!append) {
         activityList.innerHTML = '<div class="no-activities">لا توجد أنشطة حتى الآن</div>';
     }
+    
+    updateLoadMoreButton();
 }
 
 // جلب وعرض لوحة المتصدرين
@@ -410,7 +551,7 @@ function setupEventListeners() {
     // زر المطالبة اليومية
     document.getElementById('daily-claim-btn').addEventListener('click', async () => {
         try {
-            const response = await fetch(`/api/daily_claim/${userId}`, {
+            const response = await fetch(`/api/daily_claim/${userId}?activities_limit=${liveActive() ? 0 : 10}`, {
                 method: 'POST'
             });
             
@@ -426,7 +567,7 @@ function setupEventListeners() {
                 showToast('تم بنجاح', data.message, 'success');
                 
                 // تحديث سجل النشاطات
-                fetchActivityHistory();
+                refreshActivitiesFrom(data);
             } else {
                 if (data.seconds_remaining) {
                     showToast('تنبيه', 'لا يمكنك المطالبة الآن، يرجى الانتظار', 'warning');
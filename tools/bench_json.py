@@ -0,0 +1,122 @@
+"""قياس تكلفة تسلسل الاستجابة لكل طلب: المسار القديم مقابل واجهة JSON السريعة
+
+الحمولتان: لوحة المتصدرين، وصفحة من 100 نشاط بتفاصيل JSONB.
+المسار القديم: فك تفاصيل كل نشاط بـ json.loads ثم jsonable_encoder (إن توفر FastAPI)
+ثم json.dumps كما في JSONResponse. المسار الجديد: json_backend.dumps_bytes على القواميس مباشرة.
+
+مثال:
+    python tools/bench_json.py --iterations 20000
+    JSON_BACKEND=stdlib python tools/bench_json.py
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_backend  # noqa: E402
+
+try:
+    from fastapi.encoders import jsonable_encoder
+except ImportError:
+    jsonable_encoder = None
+
+
+def leaderboard_rows(count):
+    """صفوف لوحة متصدرين مولدة بأسماء عربية"""
+    return [(1000 + i, f"مستخدم_{i}", 10000 - i * 7, 20000 - i * 5) for i in range(count)]
+
+
+def activity_rows(count):
+    """صفوف نشاطات مولدة؛ التفاصيل نص JSON كما كانت تُقرأ قبل محول JSONB"""
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    rows = []
+    for i in range(count):
+        details = {"social_type": "telegram", "url": "https://t.me/Forex_Fabric", "claim_time": now.isoformat()}
+        rows.append((i + 1, "daily_claim" if i % 2 else "social_telegram", 10, now - timedelta(minutes=i),
+                     json.dumps(details, ensure_ascii=False)))
+    return rows
+
+
+def format_leaderboard(rows):
+    return {"leaderboard": [
+        {"user_id": user_id, "username": username, "points": points, "total_points": total_points}
+        for user_id, username, points, total_points in rows
+    ]}
+
+
+def format_activities(rows, parse_details):
+    return {
+        "activities": [
+            {
+                "id": activity_id,
+                "activity_type": activity_type,
+                "points": points,
+                "created_at": created_at.isoformat(),
+                "details": json.loads(details) if parse_details else details,
+            }
+            for activity_id, activity_type, points, created_at, details in rows
+        ],
+        "next_cursor": "MjAyNS0wMS0wMVQxMjowMDowMHwxMDA",
+    }
+
+
+def render_before(content):
+    """تسلسل FastAPI الافتراضي: jsonable_encoder ثم JSONResponse.render"""
+    if jsonable_encoder is not None:
+        content = jsonable_encoder(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def measure(fn, iterations):
+    """متوسط الزمن لكل استدعاء بالميكروثانية (أفضل 5 تكرارات)"""
+    best = min(timeit.repeat(fn, number=iterations, repeat=5))
+    return best / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس تكلفة تسلسل JSON لكل طلب")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--leaderboard-size", type=int, default=10)
+    parser.add_argument("--activities", type=int, default=100)
+    args = parser.parse_args()
+
+    board = leaderboard_rows(args.leaderboard_size)
+    raw_activities = activity_rows(args.activities)
+    # بعد التحسين تصل التفاصيل من محول JSONB كقواميس جاهزة
+    decoded_activities = [row[:4] + (json.loads(row[4]),) for row in raw_activities]
+
+    cases = {
+        "leaderboard": (
+            lambda: render_before(format_leaderboard(board)),
+            lambda: json_backend.dumps_bytes(format_leaderboard(board)),
+        ),
+        f"activities_{args.activities}": (
+            lambda: render_before(format_activities(raw_activities, parse_details=True)),
+            lambda: json_backend.dumps_bytes(format_activities(decoded_activities, parse_details=False)),
+        ),
+    }
+
+    results = {
+        "backend": json_backend.backend_name,
+        "jsonable_encoder": jsonable_encoder is not None,
+        "cases": {},
+    }
+    for name, (before, after) in cases.items():
+        before_us = measure(before, args.iterations)
+        after_us = measure(after, args.iterations)
+        results["cases"][name] = {
+            "before_us": round(before_us, 2),
+            "after_us": round(after_us, 2),
+            "speedup": round(before_us / after_us, 2),
+            "bytes": len(after()),
+        }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,457 @@
+"""مجموعة قياس الأداء: مزيج واقعي من الطلبات عبر تطبيق FastAPI ومعالجات البوت داخل العملية
+
+يتطلب قاعدة بيانات معبأة بـ tools/seed_data.py. المرحلة الأولى تشغّل تطبيق ASGI مباشرة
+(بدء التشغيل والإيقاف كما في الخادم، دون شبكة) بعدد من العملاء المتزامنين، والثانية
+تستدعي معالجات أوامر البوت من عدة ثريدات بتحديثات وهمية. يُختار المستخدم لكل طلب
+بتوزيع Zipf فيتركز الحمل على المستخدمين النشطين.
+
+يعرض التقرير الإنتاجية و p50/p95/p99 لكل نقطة نهاية وأمر بوت (من زمن كل طلب)، ولكل
+دالة في database.py و async_database.py (تقديرًا من مدرجات metrics.py كما في
+histogram_quantile)، ويحفظ النتائج بصيغة JSON للمقارنة بين التشغيلات.
+
+مثال:
+    python tools/seed_data.py --users 20000 --activities 30 --reset
+    python tools/bench_suite.py --duration 30 --concurrency 32 --output bench_results/base.json
+    python tools/bench_suite.py --duration 30 --compare bench_results/base.json
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# القياس يستهدف مسارات التنفيذ لا محدد المعدل، والبوت يُستدعى مباشرة لا عبر الـ webhook
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ["BOT_MODE"] = "polling"
+os.environ["METRICS_ENABLED"] = "1"
+
+from seed_data import SYNTHETIC_USER_ID_BASE, synthetic_user_ids, zipf_weights  # noqa: E402
+
+DEFAULT_API_MIX = "page_load=40,leaderboard=25,claim=15,social_visit=15,withdraw=5"
+DEFAULT_BOT_MIX = "balance=30,daily_claim=20,history=20,leaderboard=20,start=10"
+
+
+def parse_mix(value):
+    """تحليل مزيج مثل "page_load=40,claim=15" إلى (الأسماء، الأوزان)"""
+    names, weights = [], []
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() and float(weight or 1) > 0:
+            names.append(name.strip())
+            weights.append(float(weight or 1))
+    return names, weights
+
+
+def percentile(sorted_values, q):
+    """النسبة المئوية بالاستيفاء الخطي بين أقرب قيمتين"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies, errors, elapsed):
+    """ملخص زمن الاستجابة بالملي ثانية والإنتاجية لعملية واحدة"""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+class Recorder:
+    """تجميع أزمنة الطلبات والأخطاء لكل عملية (آمن بين الثريدات)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.recording = False
+
+    def record(self, name, seconds, ok):
+        if not self.recording:
+            return
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, elapsed):
+        with self._lock:
+            return {
+                name: summarize(values, self.errors.get(name, 0), elapsed)
+                for name, values in sorted(self.latencies.items())
+            }
+
+
+class UserPicker:
+    """اختيار مستخدم بتوزيع Zipf على ترتيب عشوائي ثابت للمستخدمين"""
+
+    def __init__(self, user_ids, skew, rng):
+        self.user_ids = list(user_ids)
+        rng.shuffle(self.user_ids)
+        self.cumulative = list(itertools.accumulate(zipf_weights(len(self.user_ids), skew)))
+
+    def pick(self, rng):
+        index = bisect.bisect_left(self.cumulative, rng.random())
+        return self.user_ids[min(index, len(self.user_ids) - 1)]
+
+
+def db_histogram_snapshot():
+    """لقطة مدرجات زمن دوال قاعدة البيانات الحالية"""
+    from metrics import db_query_seconds
+    return {
+        f"{labels['layer']}.{labels['function']}": snapshot
+        for labels, snapshot in db_query_seconds.collect()
+    }
+
+
+def histogram_quantile(q, buckets):
+    """تقدير النسبة المئوية من فئات تراكمية [(الحد، العدد)] كما في Prometheus"""
+    total = buckets[-1][1]
+    if total == 0:
+        return 0.0
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def db_function_report(before, after, elapsed):
+    """الفرق بين لقطتين: عدد الاستدعاءات ومتوسط الزمن والنسب المئوية المقدرة لكل دالة"""
+    report = {}
+    for name, snapshot in sorted(after.items()):
+        base = before.get(name)
+        base_counts = [count for _, count in base["buckets"]] if base else [0] * len(snapshot["buckets"])
+        buckets = [(bound, count - base_count) for (bound, count), base_count in zip(snapshot["buckets"], base_counts)]
+        count = snapshot["count"] - (base["count"] if base else 0)
+        if count <= 0:
+            continue
+        total = snapshot["sum"] - (base["sum"] if base else 0.0)
+        report[name] = {
+            "count": count,
+            "calls_per_second": round(count / elapsed, 1) if elapsed else 0.0,
+            "mean_ms": round(total / count * 1000, 3),
+            "p50_ms": round(histogram_quantile(0.50, buckets) * 1000, 3),
+            "p95_ms": round(histogram_quantile(0.95, buckets) * 1000, 3),
+            "p99_ms": round(histogram_quantile(0.99, buckets) * 1000, 3),
+        }
+    return report
+
+
+async def asgi_request(app, method, path, query="", body=None, headers=()):
+    """تنفيذ طلب HTTP واحد على تطبيق ASGI مباشرة وإرجاع (رمز الحالة، المحتوى)"""
+    payload = json.dumps(body).encode() if body is not None else b""
+    raw_headers = [(b"host", b"bench"), (b"accept-encoding", b"gzip")]
+    if body is not None:
+        raw_headers += [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+    raw_headers += [(name.lower().encode(), value.encode()) for name, value in headers]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "headers": raw_headers,
+        "client": ("127.0.0.1", 40000), "server": ("bench", 80),
+    }
+    sent = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    response = {"status": None, "body": []}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return response["status"], b"".join(response["body"])
+
+
+def api_operations(social_types):
+    """عمليات مزيج API: الاسم -> دالة تعيد (الطريقة، المسار، الاستعلام، المحتوى، الترويسات)"""
+    return {
+        "page_load": lambda uid, rng: ("GET", f"/api/bootstrap/{uid}", "leaderboard_limit=10&activities_limit=10", None, ()),
+        "leaderboard": lambda uid, rng: ("GET", "/api/leaderboard", "limit=10", None, ()),
+        "claim": lambda uid, rng: ("POST", f"/api/daily_claim/{uid}", "activities_limit=10", {}, ()),
+        "social_visit": lambda uid, rng: (
+            "POST", f"/api/social_visit/{uid}", "activities_limit=10", {"social_type": rng.choice(social_types)}, ()
+        ),
+        "withdraw": lambda uid, rng: (
+            "POST", f"/api/withdraw/{uid}", "",
+            {"amount": rng.randint(1, 50), "details": {"method": "bench"}},
+            (("Idempotency-Key", str(uuid.uuid4())),)
+        ),
+        "activities": lambda uid, rng: ("GET", f"/api/activities/{uid}", "limit=20", None, ()),
+        "rank": lambda uid, rng: ("GET", f"/api/rank/{uid}", "", None, ()),
+    }
+
+
+async def run_api_phase(picker, mix, args, recorder):
+    """تشغيل مزيج API بعدد العملاء المحدد خلال فترة الإحماء ثم فترة القياس"""
+    from api import api
+    from config import SOCIAL_MEDIA_LINKS
+
+    operations = api_operations(sorted(SOCIAL_MEDIA_LINKS))
+    names, weights = mix
+    unknown = [name for name in names if name not in operations]
+    if unknown:
+        raise SystemExit(f"عمليات API غير معروفة: {unknown} (المتاح: {sorted(operations)})")
+
+    await api.router.startup()
+    try:
+        stop_at = time.monotonic() + args.warmup + args.duration
+
+        async def client(index):
+            rng = random.Random(args.seed * 1000 + index)
+            while time.monotonic() < stop_at:
+                name = rng.choices(names, weights)[0]
+                method, path, query, body, headers = operations[name](picker.pick(rng), rng)
+                started = time.perf_counter()
+                try:
+                    status, _ = await asgi_request(api, method, path, query, body, headers)
+                    ok = status is not None and status < 500
+                except Exception:
+                    ok = False
+                recorder.record(name, time.perf_counter() - started, ok)
+
+        clients = [asyncio.ensure_future(client(i)) for i in range(args.concurrency)]
+        await asyncio.sleep(args.warmup)
+        recorder.recording = True
+        db_before = db_histogram_snapshot()
+        measured_from = time.monotonic()
+        await asyncio.gather(*clients)
+        elapsed = time.monotonic() - measured_from
+        recorder.recording = False
+        return elapsed, db_histogram_snapshot(), db_before
+    finally:
+        await api.router.shutdown()
+
+
+class _FakeMessage:
+    """رسالة تيليجرام وهمية تسجل الرد بدل إرساله"""
+
+    def __init__(self, user):
+        self.from_user = user
+        self.replies = []
+
+    def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def fake_update(user_id):
+    """تحديث وهمي يكفي لمعالجات الأوامر النصية"""
+    user = SimpleNamespace(id=user_id, username=f"user_{user_id - SYNTHETIC_USER_ID_BASE}",
+                           first_name="Synthetic", last_name=None)
+    message = _FakeMessage(user)
+    return SimpleNamespace(message=message, effective_user=user, effective_chat=SimpleNamespace(id=user_id),
+                           callback_query=None)
+
+
+def run_bot_phase(picker, mix, args, recorder):
+    """استدعاء معالجات أوامر البوت من عدة ثريدات كما يفعل مجمع العمال"""
+    import bot
+
+    handlers = {
+        "start": bot.start,
+        "balance": bot.balance_command,
+        "daily_claim": bot.daily_claim_command,
+        "history": bot.history_command,
+        "leaderboard": bot.leaderboard_command,
+        "referral": bot.referral_command,
+        "tasks": bot.tasks_command,
+    }
+    names, weights = mix
+    unknown = [name for name in names if name not in handlers]
+    if unknown:
+        raise SystemExit(f"أوامر بوت غير معروفة: {unknown} (المتاح: {sorted(handlers)})")
+
+    from database import load_leaderboard
+    load_leaderboard()
+    stop_at = time.monotonic() + args.warmup + args.bot_duration
+
+    def worker(index):
+        rng = random.Random(args.seed * 7919 + index)
+        context = SimpleNamespace(args=[], bot=None)
+        while time.monotonic() < stop_at:
+            name = rng.choices(names, weights)[0]
+            update = fake_update(picker.pick(rng))
+            started = time.perf_counter()
+            try:
+                handlers[name](update, context)
+                ok = True
+            except Exception:
+                ok = False
+            recorder.record(name, time.perf_counter() - started, ok)
+
+    with ThreadPoolExecutor(max_workers=args.bot_threads) as executor:
+        futures = [executor.submit(worker, i) for i in range(args.bot_threads)]
+        time.sleep(args.warmup)
+        recorder.recording = True
+        db_before = db_histogram_snapshot()
+        measured_from = time.monotonic()
+        for future in futures:
+            future.result()
+        elapsed = time.monotonic() - measured_from
+        recorder.recording = False
+    return elapsed, db_histogram_snapshot(), db_before
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset_summary():
+    """حجم البيانات الاصطناعية في قاعدة البيانات"""
+    from database import get_db_cursor
+    with get_db_cursor() as (conn, cursor):
+        ids = synthetic_user_ids(cursor)
+        cursor.execute('SELECT COUNT(*) FROM activities WHERE user_id >= %s', (SYNTHETIC_USER_ID_BASE,))
+        activities = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM referrals WHERE referred_id >= %s', (SYNTHETIC_USER_ID_BASE,))
+        referrals = cursor.fetchone()[0]
+    return ids, {"users": len(ids), "activities": activities, "referrals": referrals}
+
+
+def print_section(title, rows):
+    print(f"\n{title}")
+    print(f"  {'name':<36}{'count':>9}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in rows.items():
+        rate = row.get("throughput_rps", row.get("calls_per_second", 0.0))
+        print(f"  {name:<36}{row['count']:>9}{rate:>10}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def print_comparison(results, baseline):
+    """مقارنة الإنتاجية و p95 مع نتائج تشغيل سابق"""
+    print(f"\nالمقارنة مع {baseline.get('meta', {}).get('git_revision')} ({baseline.get('meta', {}).get('timestamp')})")
+    for section in ("api", "bot", "db_functions"):
+        current, previous = results.get(section, {}), baseline.get(section, {})
+        for name in sorted(set(current) & set(previous)):
+            now, before = current[name], previous[name]
+            rate_key = "throughput_rps" if "throughput_rps" in now else "calls_per_second"
+            rate_change = (now[rate_key] / before[rate_key] - 1) * 100 if before.get(rate_key) else 0.0
+            p95_change = (now["p95_ms"] / before["p95_ms"] - 1) * 100 if before.get("p95_ms") else 0.0
+            print(f"  {section}/{name:<40} rps {rate_change:+7.1f}%   p95 {p95_change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس أداء مسارات API والبوت على بيانات اصطناعية")
+    parser.add_argument("--duration", type=float, default=20.0, help="مدة قياس مرحلة API بالثواني")
+    parser.add_argument("--bot-duration", type=float, default=10.0, help="مدة قياس مرحلة البوت بالثواني")
+    parser.add_argument("--warmup", type=float, default=2.0, help="فترة الإحماء قبل كل مرحلة بالثواني")
+    parser.add_argument("--concurrency", type=int, default=32, help="عدد عملاء API المتزامنين")
+    parser.add_argument("--bot-threads", type=int, default=8, help="عدد ثريدات معالجات البوت")
+    parser.add_argument("--api-mix", default=DEFAULT_API_MIX)
+    parser.add_argument("--bot-mix", default=DEFAULT_BOT_MIX)
+    parser.add_argument("--skew", type=float, default=1.1, help="أس توزيع Zipf لاختيار المستخدمين")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-api", action="store_true", help="تخطي مرحلة API")
+    parser.add_argument("--no-bot", action="store_true", help="تخطي مرحلة البوت")
+    parser.add_argument("--output", help="ملف JSON للنتائج (افتراضيًا bench_results/bench-<الوقت>.json)")
+    parser.add_argument("--compare", help="ملف نتائج سابق للمقارنة")
+    args = parser.parse_args()
+
+    import json_backend
+    from database import close_pool
+
+    user_ids, dataset = dataset_summary()
+    if not user_ids:
+        print("لا توجد بيانات اصطناعية؛ شغّل tools/seed_data.py أولًا", file=sys.stderr)
+        return 1
+    picker = UserPicker(user_ids, args.skew, random.Random(args.seed))
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "json_backend": json_backend.backend_name,
+            "dataset": dataset,
+            "args": vars(args),
+        },
+    }
+
+    try:
+        if not args.no_api:
+            recorder = Recorder()
+            elapsed, db_after, db_before = asyncio.run(
+                run_api_phase(picker, parse_mix(args.api_mix), args, recorder)
+            )
+            results["api"] = recorder.report(elapsed)
+            results["api_db_functions"] = db_function_report(db_before, db_after, elapsed)
+            print_section(f"API ({args.concurrency} عميل، {elapsed:.1f} ث)", results["api"])
+            print_section("دوال قاعدة البيانات أثناء مرحلة API (تقدير من المدرجات)", results["api_db_functions"])
+
+        if not args.no_bot:
+            recorder = Recorder()
+            elapsed, db_after, db_before = run_bot_phase(picker, parse_mix(args.bot_mix), args, recorder)
+            results["bot"] = recorder.report(elapsed)
+            results["bot_db_functions"] = db_function_report(db_before, db_after, elapsed)
+            print_section(f"البوت ({args.bot_threads} ثريد، {elapsed:.1f} ث)", results["bot"])
+            print_section("دوال قاعدة البيانات أثناء مرحلة البوت (تقدير من المدرجات)", results["bot_db_functions"])
+    finally:
+        close_pool()
+
+    results["db_functions"] = {**results.get("api_db_functions", {}), **results.get("bot_db_functions", {})}
+
+    output = args.output or os.path.join(
+        "bench_results", f"bench-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nتم حفظ النتائج في {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""قياس تدرج معدل الطلبات في الثانية مع عدد عمليات خادم API
+
+يشغّل `main.py --no-bot` لكل عدد عمال، وينتظر جاهزية الخادم، ثم يرسل طلبات
+متزامنة من عدة عمليات عميل لمدة محددة ويعرض معدل الطلبات ونسبة التحسن.
+
+مثال:
+    python tools/bench_workers.py --workers 1 2 4 --duration 15 --clients 4 --connections 16
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from multiprocessing import get_context
+from threading import Thread
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_ready(host, port, timeout):
+    """انتظار استجابة الخادم لأول طلب"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request("GET", "/api/leaderboard?limit=1")
+            conn.getresponse().read()
+            conn.close()
+            return True
+        except OSError:
+            time.sleep(0.25)
+    return False
+
+
+def connection_loop(host, port, paths, deadline, result):
+    """إرسال طلبات متتالية على اتصال HTTP دائم حتى انتهاء المدة"""
+    rng = random.Random()
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    while time.monotonic() < deadline:
+        try:
+            conn.request("GET", rng.choice(paths))
+            response = conn.getresponse()
+            response.read()
+            result["ok" if response.status < 500 else "errors"] += 1
+        except (OSError, http.client.HTTPException):
+            result["errors"] += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.close()
+
+
+def client_process(host, port, paths, duration, connections):
+    """عملية عميل تشغّل عدة اتصالات متوازية وتعيد عدد الطلبات الناجحة والفاشلة"""
+    deadline = time.monotonic() + duration
+    results = [{"ok": 0, "errors": 0} for _ in range(connections)]
+    threads = [
+        Thread(target=connection_loop, args=(host, port, paths, deadline, result))
+        for result in results
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(r["ok"] for r in results), sum(r["errors"] for r in results)
+
+
+def run_level(args, workers, paths):
+    """تشغيل الخادم بعدد عمال محدد وقياس معدل الطلبات"""
+    server = subprocess.Popen(
+        [sys.executable, "main.py", "--no-bot", "--host", args.host,
+         "--port", str(args.port), "--workers", str(workers)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    try:
+        if not wait_ready(args.host, args.port, args.startup_timeout):
+            raise RuntimeError(f"لم يصبح الخادم جاهزًا خلال {args.startup_timeout} ثانية")
+        # إحماء التجمعات والتخزين المؤقت في كل العمال
+        client_process(args.host, args.port, paths, args.warmup, args.connections)
+
+        with get_context("spawn").Pool(args.clients) as pool:
+            started = time.monotonic()
+            outcomes = pool.starmap(
+                client_process,
+                [(args.host, args.port, paths, args.duration, args.connections)] * args.clients,
+            )
+            elapsed = time.monotonic() - started
+    finally:
+        # إيقاف سلس كما في بيئة الإنتاج
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    ok = sum(o[0] for o in outcomes)
+    errors = sum(o[1] for o in outcomes)
+    return {
+        "workers": workers,
+        "requests": ok,
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(ok / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس تدرج خادم API مع عدد العمال")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="أعداد العمال المراد قياسها")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--duration", type=float, default=15.0, help="مدة القياس لكل مستوى (بالثواني)")
+    parser.add_argument("--warmup", type=float, default=3.0, help="مدة الإحماء (بالثواني)")
+    parser.add_argument("--clients", type=int, default=4, help="عدد عمليات العميل")
+    parser.add_argument("--connections", type=int, default=16, help="عدد الاتصالات لكل عملية عميل")
+    parser.add_argument("--user-ids", type=int, nargs="*", default=[], help="معرفات مستخدمين لطلبات /api/user")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="حفظ النتائج بصيغة JSON")
+    parser.add_argument("--verbose", action="store_true", help="عرض سجلات الخادم")
+    args = parser.parse_args()
+
+    paths = ["/api/leaderboard?limit=10"]
+    paths += [f"/api/user/{user_id}" for user_id in args.user_ids]
+    paths += [f"/api/rank/{user_id}" for user_id in args.user_ids]
+
+    results = []
+    for workers in args.workers:
+        result = run_level(args, workers, paths)
+        if results:
+            result["speedup"] = round(result["requests_per_second"] / results[0]["requests_per_second"], 2)
+        else:
+            result["speedup"] = 1.0
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"paths": paths, "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""خادم تيليجرام وهمي لاختبار الحمل على وضع الـ webhook دون اتصال بالإنترنت
+
+يشغّل واجهة Bot API وهمية تسجّل ردود البوت، ثم يرسل تحديثات مسجلة (أو مولدة)
+إلى مسار الـ webhook ويقيس الزمن من إرسال التحديث حتى وصول الرد.
+
+مثال:
+    # تشغيل خادم API بوضع الـ webhook موجهًا إلى الخادم الوهمي
+    BOT_MODE=webhook WEBHOOK_SECRET=local-test-secret WEBHOOK_AUTO_SET=0 \\
+        TELEGRAM_API_URL=http://127.0.0.1:8081/bot python main.py
+
+    # إرسال 2000 تحديث مولد من 200 مستخدم بتوازي 50 (السر يُرسل أيضًا في ترويسة تيليجرام)
+    python tools/fake_telegram.py --webhook http://127.0.0.1:5000/telegram/webhook/local-test-secret \\
+        --secret local-test-secret --synthetic 2000 --users 200 --concurrency 50
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_INFO = {"id": 1000000001, "is_bot": True, "first_name": "Forex Fabric", "username": "ForexFabricPointsBot"}
+
+SYNTHETIC_COMMANDS = ["/start", "/balance", "/daily_claim", "/history", "/leaderboard", "/tasks", "/help"]
+
+
+class ReplyRecorder:
+    """مطابقة ردود البوت مع التحديثات المرسلة لكل محادثة وحساب الزمن"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sent = defaultdict(deque)
+        self.latencies = []
+        self.unmatched = 0
+        self.calls = defaultdict(int)
+
+    def update_sent(self, chat_id):
+        with self._lock:
+            self._sent[chat_id].append(time.monotonic())
+
+    def reply_received(self, chat_id):
+        now = time.monotonic()
+        with self._lock:
+            pending = self._sent.get(chat_id)
+            if not pending:
+                self.unmatched += 1
+                return
+            self.latencies.append(now - pending.popleft())
+
+    def outstanding(self):
+        with self._lock:
+            return sum(len(q) for q in self._sent.values())
+
+
+def make_handler(recorder):
+    """إنشاء معالج HTTP لواجهة Bot API الوهمية"""
+    message_ids = itertools.count(1)
+
+    class FakeBotAPIHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _params(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            content_type = self.headers.get("Content-Type", "")
+            if "application/json" in content_type and body:
+                return json.loads(body)
+            query = urllib.parse.urlparse(self.path).query
+            params = dict(urllib.parse.parse_qsl(body.decode() or query))
+            return params
+
+        def _reply(self, result):
+            payload = json.dumps({"ok": True, "result": result}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self.do_POST()
+
+        def do_POST(self):
+            method = urllib.parse.urlparse(self.path).path.rsplit("/", 1)[-1]
+            params = self._params()
+            recorder.calls[method] += 1
+
+            if method == "getMe":
+                return self._reply(BOT_INFO)
+            if method in ("sendMessage", "editMessageText"):
+                chat_id = int(params.get("chat_id", 0))
+                recorder.reply_received(chat_id)
+                return self._reply({
+                    "message_id": next(message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": BOT_INFO,
+                    "text": params.get("text", ""),
+                })
+            # answerCallbackQuery و setWebhook وغيرها
+            return self._reply(True)
+
+    return FakeBotAPIHandler
+
+
+def command_update(update_id, user_id, text):
+    """إنشاء تحديث رسالة أمر بصيغة Bot API"""
+    command = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+def synthetic_updates(count, users, seed=1):
+    """توليد تحديثات أوامر عشوائية من مجموعة مستخدمين (يبدأ كل مستخدم بـ /start)"""
+    rng = random.Random(seed)
+    base_user = 9_000_000_000
+    update_id = itertools.count(1)
+    started = set()
+    for _ in range(count):
+        user_id = base_user + rng.randrange(users)
+        text = "/start" if user_id not in started else rng.choice(SYNTHETIC_COMMANDS)
+        started.add(user_id)
+        yield command_update(next(update_id), user_id, text)
+
+
+def load_updates(path):
+    """تحميل تحديثات مسجلة من ملف JSON (قائمة) أو NDJSON (تحديث في كل سطر)"""
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def update_chat_id(update):
+    """معرف المحادثة التي سيُرسل إليها الرد"""
+    if "message" in update:
+        return update["message"]["chat"]["id"]
+    if "callback_query" in update:
+        return update["callback_query"]["message"]["chat"]["id"]
+    return None
+
+
+def post_update(webhook, update, recorder, secret=""):
+    """إرسال تحديث واحد إلى مسار الـ webhook"""
+    chat_id = update_chat_id(update)
+    if chat_id is not None:
+        recorder.update_sent(chat_id)
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    request = urllib.request.Request(webhook, data=json.dumps(update).encode(), headers=headers)
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+
+
+def percentile(values, fraction):
+    """قيمة المئين من قائمة مرتبة"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="خادم تيليجرام وهمي واختبار حمل لوضع الـ webhook")
+    parser.add_argument("--host", default="127.0.0.1", help="عنوان خادم Bot API الوهمي")
+    parser.add_argument("--port", type=int, default=8081, help="منفذ خادم Bot API الوهمي")
+    parser.add_argument("--webhook", help="عنوان مسار الـ webhook على خادم API")
+    parser.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET", ""),
+                        help="قيمة ترويسة X-Telegram-Bot-Api-Secret-Token (افتراضيًا WEBHOOK_SECRET)")
+    parser.add_argument("--updates", help="ملف تحديثات مسجلة (JSON أو NDJSON)")
+    parser.add_argument("--synthetic", type=int, default=0, help="عدد التحديثات المولدة")
+    parser.add_argument("--users", type=int, default=100, help="عدد المستخدمين في التحديثات المولدة")
+    parser.add_argument("--concurrency", type=int, default=20, help="عدد الطلبات المتزامنة")
+    parser.add_argument("--wait", type=float, default=30.0, help="مهلة انتظار الردود المتبقية (بالثواني)")
+    parser.add_argument("--serve-only", action="store_true", help="تشغيل خادم Bot API الوهمي فقط")
+    parser.add_argument("--output", help="حفظ النتائج بصيغة JSON")
+    args = parser.parse_args()
+
+    recorder = ReplyRecorder()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(recorder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"خادم Bot API الوهمي يعمل على http://{args.host}:{args.port}/bot")
+
+    if args.serve_only:
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return 0
+
+    if not args.webhook:
+        parser.error("--webhook مطلوب ما لم يُستخدم --serve-only")
+
+    if args.updates:
+        updates = load_updates(args.updates)
+    else:
+        updates = list(synthetic_updates(args.synthetic or 100, args.users))
+
+    started = time.monotonic()
+    errors = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(post_update, args.webhook, update, recorder, args.secret) for update in updates]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors += 1
+                print(f"فشل إرسال تحديث: {e}", file=sys.stderr)
+    posted = time.monotonic() - started
+
+    deadline = time.monotonic() + args.wait
+    while recorder.outstanding() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(recorder.latencies)
+    result = {
+        "updates": len(updates),
+        "post_errors": errors,
+        "replies": len(latencies),
+        "missing_replies": recorder.outstanding(),
+        "unmatched_replies": recorder.unmatched,
+        "post_seconds": round(posted, 3),
+        "total_seconds": round(elapsed, 3),
+        "updates_per_second": round(len(updates) / posted, 1) if posted else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "bot_api_calls": dict(recorder.calls),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    server.shutdown()
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
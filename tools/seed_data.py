@@ -0,0 +1,209 @@
+"""تعبئة قاعدة PostgreSQL محلية ببيانات اصطناعية لقياس الأداء
+
+ينشئ N مستخدم بمعرفات تبدأ من SYNTHETIC_USER_ID_BASE (فلا تختلط بالمستخدمين الحقيقيين)،
+وشبكة إحالات بالارتباط التفضيلي (قلة من المستخدمين يحيلون معظم الآخرين)، و M نشاط
+في المتوسط لكل مستخدم موزعة بتوزيع Zipf نحو المستخدمين النشطين. الأرصدة وعدادات
+الإحالات تُحسب من البيانات المولدة، والإدراج يتم بـ COPY على دفعات.
+
+مثال:
+    python migrations.py
+    python tools/seed_data.py --users 50000 --activities 40 --skew 1.1 --reset
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_db_connection, close_pool  # noqa: E402
+from config import SOCIAL_MEDIA_POINTS, DAILY_POINTS, REFERRAL_POINTS  # noqa: E402
+
+# معرفات المستخدمين الاصطناعيين خارج نطاق معرفات تيليجرام المعتادة
+SYNTHETIC_USER_ID_BASE = 8_000_000_000
+
+# الجداول التي تحمل معرف مستخدم، بترتيب الحذف (قبل جدول المستخدمين)
+_DEPENDENT_TABLES = (
+    ("activities", "user_id"),
+    ("social_media_visits", "user_id"),
+    ("withdrawals", "user_id"),
+    ("idempotency_keys", "user_id"),
+    ("grant_campaign_items", "user_id"),
+    ("referral_risk_scores", "user_id"),
+    ("referrals", "referred_id"),
+    ("referrals", "referrer_id"),
+)
+
+_ACTIVITY_KINDS = (
+    ("daily_claim", DAILY_POINTS, 0.7),
+    ("social_telegram", SOCIAL_MEDIA_POINTS, 0.1),
+    ("social_instagram", SOCIAL_MEDIA_POINTS, 0.1),
+    ("social_website", SOCIAL_MEDIA_POINTS, 0.05),
+    ("social_support", SOCIAL_MEDIA_POINTS, 0.05),
+)
+
+
+def synthetic_user_ids(cursor):
+    """معرفات المستخدمين الاصطناعيين الموجودين بترتيب الإنشاء"""
+    cursor.execute('SELECT user_id FROM users WHERE user_id >= %s ORDER BY user_id', (SYNTHETIC_USER_ID_BASE,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def zipf_weights(count, skew):
+    """أوزان Zipf للرتب 1..count (الرتبة الأولى هي الأنشط)"""
+    weights = [1.0 / (rank ** skew) for rank in range(1, count + 1)]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def _copy(cursor, table, columns, rows):
+    """نسخ صفوف إلى جدول بصيغة CSV عبر COPY"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def reset_synthetic(cursor):
+    """حذف كل البيانات الاصطناعية السابقة"""
+    for table, column in _DEPENDENT_TABLES:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} >= %s', (SYNTHETIC_USER_ID_BASE,))
+    cursor.execute('DELETE FROM users WHERE user_id >= %s', (SYNTHETIC_USER_ID_BASE,))
+
+
+def build_referrals(count, rate, rng):
+    """شبكة إحالات بالارتباط التفضيلي: يُختار المحيل باحتمال يتناسب مع إحالاته السابقة"""
+    referrer_of = {}
+    tickets = [0]
+    for index in range(1, count):
+        if rng.random() < rate:
+            referrer = rng.choice(tickets)
+            referrer_of[index] = referrer
+            tickets.append(referrer)
+        tickets.append(index)
+    return referrer_of
+
+
+def seed(users, activities_per_user, skew=1.1, referral_rate=0.6, claimable_fraction=0.8,
+         days=90, chunk_size=2000, reset=False, random_seed=42):
+    """تعبئة البيانات الاصطناعية وإرجاع ملخص بأعدادها وزمنها"""
+    rng = random.Random(random_seed)
+    started = time.monotonic()
+    now = datetime.utcnow()
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if reset:
+                reset_synthetic(cursor)
+            elif synthetic_user_ids(cursor):
+                raise RuntimeError("توجد بيانات اصطناعية سابقة؛ استخدم --reset لإعادة إنشائها")
+
+    # توزيع النشاطات: رتب Zipf موزعة عشوائيًا على المستخدمين
+    ranks = list(range(users))
+    rng.shuffle(ranks)
+    weights = zipf_weights(users, skew)
+    total_activities = users * activities_per_user
+    activity_counts = [int(round(weights[ranks[i]] * total_activities)) for i in range(users)]
+
+    referrer_of = build_referrals(users, referral_rate, rng)
+    referrals_count = [0] * users
+    for referrer in referrer_of.values():
+        referrals_count[referrer] += 1
+
+    kinds = [kind for kind, _, _ in _ACTIVITY_KINDS]
+    kind_points = {kind: points for kind, points, _ in _ACTIVITY_KINDS}
+    kind_weights = [weight for _, _, weight in _ACTIVITY_KINDS]
+    window = days * 86400
+
+    written_activities = 0
+    for chunk_start in range(0, users, chunk_size):
+        chunk = range(chunk_start, min(users, chunk_start + chunk_size))
+        user_rows, activity_rows, referral_rows = [], [], []
+        for index in chunk:
+            user_id = SYNTHETIC_USER_ID_BASE + index
+            created_at = now - timedelta(seconds=window)
+            earned = 0
+            for _ in range(activity_counts[index]):
+                kind = rng.choices(kinds, kind_weights)[0]
+                points = kind_points[kind]
+                earned += points
+                activity_rows.append((
+                    user_id, kind, points, json.dumps({"synthetic": True}),
+                    (now - timedelta(seconds=rng.randrange(window))).isoformat(sep=" "),
+                ))
+            referred = referrals_count[index]
+            earned += referred * REFERRAL_POINTS
+            # الأغلبية يمكنها المطالبة اليومية فورًا، والبقية طالبت منذ قليل
+            last_claim = None if rng.random() < claimable_fraction else (now - timedelta(hours=1)).isoformat(sep=" ")
+            user_rows.append((
+                user_id, f"user_{index}", f"Synthetic User {index}", earned, earned,
+                last_claim, created_at.isoformat(sep=" "), referred,
+            ))
+            if index in referrer_of:
+                referral_rows.append((SYNTHETIC_USER_ID_BASE + referrer_of[index], user_id))
+
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                _copy(cursor, "users", (
+                    "user_id", "username", "full_name", "points", "total_points",
+                    "last_claim_time", "created_at", "referrals_count",
+                ), user_rows)
+                # المحيل دائمًا أقدم من المحال فهو موجود في دفعة سابقة أو في الدفعة نفسها
+                _copy(cursor, "referrals", ("referrer_id", "referred_id"), referral_rows)
+                _copy(cursor, "activities", ("user_id", "activity_type", "points", "details", "created_at"), activity_rows)
+        written_activities += len(activity_rows)
+        print(f"  {min(users, chunk_start + chunk_size)}/{users} مستخدم، {written_activities} نشاط", file=sys.stderr)
+
+    with get_db_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for table in ("users", "referrals", "activities"):
+                    cursor.execute(f'ANALYZE {table}')
+        finally:
+            conn.autocommit = False
+
+    top = sorted(activity_counts, reverse=True)
+    return {
+        "users": users,
+        "activities": written_activities,
+        "referrals": len(referrer_of),
+        "max_referrals": max(referrals_count) if referrals_count else 0,
+        "max_activities_per_user": top[0] if top else 0,
+        "top_1pct_activity_share": round(sum(top[:max(1, users // 100)]) / max(1, written_activities), 3),
+        "skew": skew,
+        "seed": random_seed,
+        "elapsed_seconds": round(time.monotonic() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="تعبئة قاعدة البيانات ببيانات اصطناعية لقياس الأداء")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--activities", type=int, default=20, help="متوسط عدد النشاطات لكل مستخدم")
+    parser.add_argument("--skew", type=float, default=1.1, help="أس توزيع Zipf للنشاطات (أكبر = تركيز أعلى)")
+    parser.add_argument("--referral-rate", type=float, default=0.6, help="نسبة المستخدمين القادمين بإحالة")
+    parser.add_argument("--claimable", type=float, default=0.8, help="نسبة المستخدمين القادرين على المطالبة اليومية")
+    parser.add_argument("--days", type=int, default=90, help="مدى تواريخ النشاطات بالأيام")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="حذف البيانات الاصطناعية السابقة أولًا")
+    args = parser.parse_args()
+
+    try:
+        summary = seed(
+            args.users, args.activities, skew=args.skew, referral_rate=args.referral_rate,
+            claimable_fraction=args.claimable, days=args.days, reset=args.reset, random_seed=args.seed,
+        )
+    finally:
+        close_pool()
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
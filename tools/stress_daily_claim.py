@@ -0,0 +1,126 @@
+"""اختبار ضغط للمطالبة اليومية المتزامنة على قاعدة بيانات حقيقية
+
+ينشئ مستخدمًا جديدًا ثم يطلق مئات المطالبات المتوازية له من عدة خيوط خلف حاجز مشترك ويتحقق من أن:
+- مطالبة واحدة فقط تنجح، وكل المطالبات الخاسرة تعيد seconds_remaining كعدد صحيح.
+- الرصيد زاد بمقدار DAILY_POINTS بالضبط، وفي سجل النشاطات صف daily_claim واحد فقط.
+
+يُشغَّل الفحص في وضعي كاتب النشاطات (sync ثم buffered) لأن الوضع buffered لا يستخدم
+CTE التسجيل داخل العبارة نفسها بل يضيف النشاط إلى الطابور بعد نجاح المطالبة.
+
+يحتاج DATABASE_URL يشير إلى قاعدة اختبار مع تطبيق الترحيلات (python migrations.py).
+
+مثال:
+    python tools/stress_daily_claim.py --requests 300 --threads 64
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DAILY_POINTS  # noqa: E402
+from database import (  # noqa: E402
+    activity_writer, add_user, get_db_cursor, daily_claim, close_pool
+)
+
+
+def create_user():
+    """مستخدم اختبار جديد لم يطالب بعد"""
+    user_id = random.randint(9_000_000_000, 9_999_999_999)
+    add_user(user_id, f"stress_{user_id}")
+    return user_id
+
+
+def stored_state(user_id):
+    """الرصيد وعدد نشاطات المطالبة اليومية كما في قاعدة البيانات (دون ذاكرة التخزين المؤقت)"""
+    with get_db_cursor() as (conn, cursor):
+        cursor.execute('SELECT points FROM users WHERE user_id = %s', (user_id,))
+        points = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT COUNT(*) FROM activities WHERE user_id = %s AND activity_type = 'daily_claim'",
+            (user_id,)
+        )
+        claims = cursor.fetchone()[0]
+    return points, claims
+
+
+def run_parallel(threads, calls):
+    """تنفيذ الاستدعاءات بعد حاجز مشترك لتعظيم التزامن"""
+    barrier = threading.Barrier(min(threads, len(calls)))
+
+    def call(fn):
+        try:
+            barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(call, calls))
+
+
+def check_claims(args, mode):
+    """مطالبات متزامنة لمستخدم واحد: منح واحد بالضبط"""
+    activity_writer.mode = mode
+    user_id = create_user()
+    points_before, _ = stored_state(user_id)
+
+    results = run_parallel(args.threads, [lambda: daily_claim(user_id) for _ in range(args.requests)])
+    if activity_writer.buffered:
+        activity_writer.flush()
+
+    succeeded = [data for ok, data in results if ok]
+    lost = [data for ok, data in results if ok is False]
+    bad_remaining = [data for data in lost if type(data) is not int]
+    points, claims = stored_state(user_id)
+
+    failures = []
+    if len(succeeded) != 1:
+        failures.append(f"عدد المطالبات الناجحة {len(succeeded)} والمتوقع 1")
+    if len(succeeded) + len(lost) != args.requests:
+        failures.append(f"{args.requests - len(succeeded) - len(lost)} مطالبة لم تجد المستخدم")
+    if bad_remaining:
+        failures.append(f"{len(bad_remaining)} مطالبة خاسرة لم تعد seconds_remaining صحيحًا، مثل: {bad_remaining[0]!r}")
+    if points - points_before != DAILY_POINTS:
+        failures.append(f"زاد الرصيد بمقدار {points - points_before} والمتوقع {DAILY_POINTS}")
+    if claims != 1:
+        failures.append(f"عدد نشاطات daily_claim المسجلة {claims} والمتوقع 1")
+
+    remaining = sorted(set(lost)) if not bad_remaining else []
+    return failures, {
+        "user_id": user_id, "succeeded": len(succeeded), "lost": len(lost),
+        "seconds_remaining": f"{remaining[0]}..{remaining[-1]}" if remaining else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="اختبار ضغط للمطالبة اليومية المتزامنة")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=64)
+    args = parser.parse_args()
+    if args.requests < 200:
+        parser.error("يجب ألا يقل عدد المطالبات عن 200")
+
+    exit_code = 0
+    original_mode = activity_writer.mode
+    try:
+        for mode in ("sync", "buffered"):
+            failures, info = check_claims(args, mode)
+            status = "✅" if not failures else "❌"
+            print(f"{status} {mode}: {info}")
+            for failure in failures:
+                print(f"   - {failure}")
+            if failures:
+                exit_code = 1
+    finally:
+        activity_writer.stop()
+        activity_writer.mode = original_mode
+        close_pool()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""اختبار ضغط لطلبات السحب المتزامنة على قاعدة بيانات حقيقية
+
+ينشئ مستخدمًا برصيد معروف ثم يطلق طلبات سحب متوازية من عدة خيوط ويتحقق من أن:
+- الرصيد لا يصبح سالبًا أبدًا، وعدد الطلبات الناجحة يساوي الرصيد // المبلغ بالضبط.
+- إعادة الطلب بمفتاح منع التكرار نفسه (حتى بالتوازي) لا تخصم إلا مرة واحدة وتعيد النتيجة نفسها.
+- استخدام المفتاح نفسه لطلب مختلف يُرفض.
+
+يحتاج DATABASE_URL يشير إلى قاعدة اختبار مع تطبيق الترحيلات (python migrations.py).
+
+مثال:
+    python tools/stress_withdrawals.py --balance 1000 --amount 30 --requests 200 --threads 32
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import (  # noqa: E402
+    add_user, get_db_cursor, request_withdrawal, close_pool
+)
+
+
+def create_funded_user(balance):
+    """مستخدم اختبار جديد برصيد محدد"""
+    user_id = random.randint(9_000_000_000, 9_999_999_999)
+    add_user(user_id, f"stress_{user_id}")
+    with get_db_cursor() as (conn, cursor):
+        cursor.execute('UPDATE users SET points = %s, total_points = %s WHERE user_id = %s', (balance, balance, user_id))
+    return user_id
+
+
+def stored_state(user_id):
+    """الرصيد وعدد طلبات السحب ومجموعها كما في قاعدة البيانات"""
+    with get_db_cursor() as (conn, cursor):
+        cursor.execute('SELECT points FROM users WHERE user_id = %s', (user_id,))
+        points = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM withdrawals WHERE user_id = %s', (user_id,))
+        count, total = cursor.fetchone()
+    return points, count, total
+
+
+def run_parallel(threads, calls):
+    """تنفيذ الاستدعاءات بعد حاجز مشترك لتعظيم التزامن"""
+    barrier = threading.Barrier(min(threads, len(calls)))
+
+    def call(fn):
+        try:
+            barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(call, calls))
+
+
+def check_overdraw(args):
+    """طلبات متزامنة دون مفاتيح: لا سحب على المكشوف"""
+    user_id = create_funded_user(args.balance)
+    results = run_parallel(args.threads, [
+        lambda: request_withdrawal(user_id, args.amount, {"method": "stress"}) for _ in range(args.requests)
+    ])
+    succeeded = sum(1 for ok, _ in results if ok)
+    points, count, total = stored_state(user_id)
+    expected = min(args.requests, args.balance // args.amount)
+
+    failures = []
+    if points < 0:
+        failures.append(f"رصيد سالب: {points}")
+    if succeeded != expected or count != expected:
+        failures.append(f"عدد الطلبات الناجحة {succeeded} (المسجل {count}) والمتوقع {expected}")
+    if points != args.balance - total:
+        failures.append(f"الرصيد {points} لا يطابق الرصيد الأولي ناقص المسحوب {args.balance - total}")
+    return failures, {"user_id": user_id, "succeeded": succeeded, "remaining_points": points}
+
+
+def check_replay(args):
+    """المفتاح نفسه بالتوازي: خصم واحد ونتيجة واحدة"""
+    user_id = create_funded_user(args.balance)
+    key = str(uuid.uuid4())
+    details = {"method": "stress", "wallet": "replay"}
+    results = run_parallel(args.threads, [
+        lambda: request_withdrawal(user_id, args.amount, details, key) for _ in range(args.threads)
+    ])
+    # الطلبات التي وصلت أثناء تنفيذ الأصلي تنتظر قفل المفتاح ثم تعيد نتيجته
+    completed = [data for ok, data in results if ok]
+    replayed = [data for data in completed if data["replayed"]]
+    points, count, _ = stored_state(user_id)
+
+    failures = []
+    if count != 1 or points != args.balance - args.amount:
+        failures.append(f"خصم مكرر: {count} طلب سحب والرصيد {points}")
+    if len(completed) - len(replayed) != 1:
+        failures.append(f"عدد الطلبات المنفذة فعليًا {len(completed) - len(replayed)} والمتوقع 1")
+    if len({data["withdrawal_id"] for data in completed}) != 1:
+        failures.append("النتائج المعادة لا تحمل معرف السحب نفسه")
+
+    ok, message = request_withdrawal(user_id, args.amount + 1, details, key)
+    if ok:
+        failures.append("قُبل المفتاح نفسه لطلب بمبلغ مختلف")
+    return failures, {"user_id": user_id, "completed": len(completed), "replayed": len(replayed), "mismatch": message}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="اختبار ضغط لطلبات السحب المتزامنة")
+    parser.add_argument("--balance", type=int, default=1000)
+    parser.add_argument("--amount", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=32)
+    args = parser.parse_args()
+
+    exit_code = 0
+    try:
+        for name, check in (("overdraw", check_overdraw), ("replay", check_replay)):
+            failures, info = check(args)
+            status = "✅" if not failures else "❌"
+            print(f"{status} {name}: {info}")
+            for failure in failures:
+                print(f"   - {failure}")
+            if failures:
+                exit_code = 1
+    finally:
+        close_pool()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())